@@ -0,0 +1,74 @@
+"""
+Size and latency benchmark of the embedding storage formats.
+
+Compares, for a 512-d embedding, the former pickle format (a pickled list of floats, written to and read
+back from a temporary file as the MinIO helpers did) with the binary embedding format in float32 and
+float16, encoded and decoded in memory.
+
+Usage:
+    python -m benchmarks.embedding_format --repeat 2000
+"""
+import argparse
+import os
+import pickle
+import tempfile
+import time
+
+import numpy as np
+
+from core.embedding_format import encode_embedding, decode_embedding, load_legacy_pickle
+
+
+def pickle_roundtrip(embedding):
+    """Former save_embedding_pkl / get_embedding_pkl path, through temporary files."""
+    with tempfile.NamedTemporaryFile(delete=False) as temp_pkl:
+        pickle.dump(embedding.tolist(), temp_pkl)
+    with open(temp_pkl.name, "rb") as file:
+        data = file.read()
+    os.unlink(temp_pkl.name)
+
+    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+        temp_file.write(data)
+    with open(temp_file.name, "rb") as file:
+        decoded = pickle.load(file)
+    os.unlink(temp_file.name)
+    return data, decoded
+
+
+def legacy_memory_roundtrip(embedding):
+    """Pickle format read with the restricted reader, in memory."""
+    data = pickle.dumps(embedding.tolist())
+    return data, load_legacy_pickle(data).tolist()
+
+
+def binary_roundtrip(dtype):
+    def roundtrip(embedding):
+        data = encode_embedding(embedding, model_version="benchmark", segment_count=180, dtype=dtype)
+        return data, decode_embedding(data)[0].tolist()
+    return roundtrip
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000, help="Number of encode/decode round trips.")
+    args = parser.parse_args()
+
+    embedding = np.random.default_rng(0).standard_normal(512).astype(np.float32)
+    formats = {
+        "pickle (temp files)": pickle_roundtrip,
+        "pickle (in memory)": legacy_memory_roundtrip,
+        "binary float32": binary_roundtrip("float32"),
+        "binary float16": binary_roundtrip("float16"),
+    }
+    for name, roundtrip in formats.items():
+        data, decoded = roundtrip(embedding)
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            roundtrip(embedding)
+        elapsed_us = (time.perf_counter() - start) / args.repeat * 1e6
+        error = np.abs(np.asarray(decoded, dtype=np.float32) - embedding).max()
+        print(f"{name:>20}: {len(data):6d} bytes, {elapsed_us:8.1f} us per round trip, max abs error {error:.2e}")
+
+
+if __name__ == "__main__":
+    main()
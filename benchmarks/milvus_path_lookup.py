@@ -0,0 +1,76 @@
+"""
+Latency of the lookups of entities by path in a Milvus collection, either:
+    - path filter: `path in [...]`, a scan of the path field, as the routes did before the id index,
+    - id lookup: `id in [...]`, a primary key fetch, with the ids of the paths from the milvus_entity_ids table.
+
+Reports, per mode and number of paths per lookup, the p50/p95 latency of a lookup. The paths are sampled from the
+index of the collection, which must have been synced first with `python -m services.milvus_ids`. Needs the
+configured Milvus and database.
+
+Usage:
+    python -m benchmarks.milvus_path_lookup --paths 1 9 32 --lookups 200
+    python -m benchmarks.milvus_path_lookup --collection 87
+"""
+import argparse
+import random
+import statistics
+import time
+
+from core.config import DEFAULT_SETTINGS, SessionLocal
+from models.milvus import MilvusEntityId
+from services.milvus import get_milvus_512_collection, get_milvus_87_collection
+from services.milvus_ids import format_string_list
+
+
+def measure(collection, exprs, output_fields):
+    durations = []
+    for expr in exprs:
+        start = time.perf_counter()
+        collection.query(expr=expr, output_fields=output_fields)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def percentile(durations, q):
+    return statistics.quantiles(durations, n=100)[q - 1] if len(durations) > 1 else durations[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the latency of Milvus lookups by path filter and by primary key.")
+    parser.add_argument("--collection", choices=["512", "87"], default="512", help="Collection queried.")
+    parser.add_argument("--paths", type=int, nargs="+", default=[1, 9, 32], help="Numbers of paths per lookup.")
+    parser.add_argument("--lookups", type=int, default=200, help="Number of lookups per mode and number of paths.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.collection == "512":
+        collection = get_milvus_512_collection()
+        name, output_fields = DEFAULT_SETTINGS.milvus_512_collection_name, ["embedding"]
+    else:
+        collection = get_milvus_87_collection()
+        name, output_fields = DEFAULT_SETTINGS.milvus_87_collection_name, ["predictions", "title", "artist"]
+
+    with SessionLocal() as db:
+        ids = dict(db.query(MilvusEntityId.path, MilvusEntityId.milvus_id).filter_by(collection=name))
+    if not ids:
+        raise SystemExit(f"No id indexed for {name}, run `python -m services.milvus_ids` first")
+
+    rng = random.Random(args.seed)
+    paths = list(ids)
+    print(f"{name}: {len(paths)} entities indexed")
+    print(f"{'paths':>6} {'mode':>12} {'p50 ms':>9} {'p95 ms':>9}")
+    for count in args.paths:
+        samples = [rng.sample(paths, min(count, len(paths))) for _ in range(args.lookups)]
+        modes = {
+            "path filter": [f"path in {format_string_list(sample)}" for sample in samples],
+            "id lookup": [f"id in [{', '.join(str(ids[path]) for path in sample)}]" for sample in samples],
+        }
+        for mode, exprs in modes.items():
+            # Warms up the connection and the loaded segments before timing
+            measure(collection, exprs[:5], output_fields)
+            durations = measure(collection, exprs, output_fields)
+            print(f"{count:>6} {mode:>12} {percentile(durations, 50) * 1000:>9.2f} {percentile(durations, 95) * 1000:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Latency, memory and accuracy benchmark of the MusicNet inference backends.
+
+Converts the production model to each backend in a fresh process and reports, per backend:
+    - the conversion time,
+    - the mean latency of a single-file prediction and of a batch prediction,
+    - the peak RSS growth of the process after loading and running the backend,
+    - the parity with the eager model (top-1 agreement, maximum probability difference) and, on the labelled
+      sample, the accuracy of both.
+
+The labelled sample is drawn from the music_library tracks whose genre is one of the MusicNet classes. Without
+database and MinIO access, --synthetic uses random input tensors, and --stand-in replaces the production model by
+a ResNet-18 with the MusicNet classes, so that the benchmark can run anywhere.
+
+Usage:
+    python -m benchmarks.music_net_backends --sample 32 --repeat 20
+    python -m benchmarks.music_net_backends --synthetic --stand-in
+"""
+import argparse
+import multiprocessing
+import random
+import resource
+import time
+
+import torch
+
+
+def labelled_sample(sample_size, seed):
+    """Spectrogram tensors and genres of a random sample of the music_library tracks with a MusicNet genre."""
+    from core.config import SessionLocal
+    from models.music import MusicLibrary
+    from services.music_net import MAPPING_DICT_MUSIC_NET, create_spectrogram_tensor_from_minio
+
+    with SessionLocal() as db:
+        rows = [(row.filepath, row.genre.lower()) for row in db.query(MusicLibrary.filepath, MusicLibrary.genre)
+                if row.filepath and row.genre and row.genre.lower() in MAPPING_DICT_MUSIC_NET]
+    tensors, labels = [], []
+    for path, genre in random.Random(seed).sample(rows, min(sample_size, len(rows))):
+        try:
+            tensors.append(create_spectrogram_tensor_from_minio(path, warm_cache=False))
+            labels.append(genre)
+        except Exception as e:
+            print(f"Skipping {path}: {e}")
+    return tensors, labels
+
+
+def load_eager_model(stand_in):
+    if stand_in:
+        from torchvision.models import resnet18
+        from services.music_net import MAPPING_DICT_MUSIC_NET
+
+        torch.manual_seed(0)
+        return resnet18(num_classes=len(MAPPING_DICT_MUSIC_NET)).eval()
+
+    from services.music_net import get_production_model
+
+    return get_production_model().to("cpu").eval()
+
+
+def timed(function, repeat):
+    function()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def run_backend(backend, stand_in, tensors, labels, repeat, results):
+    """Runs in a fresh process, so that the peak RSS only accounts for one backend."""
+    from services.music_net import check_backend_parity, export_music_net_model, predict_top_k_with_production_music_net
+
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    reference = load_eager_model(stand_in)
+
+    start = time.perf_counter()
+    model = export_music_net_model(reference, backend)
+    export_seconds = time.perf_counter() - start
+
+    single_ms = timed(lambda: predict_top_k_with_production_music_net(model, tensors[:1]), repeat)
+    batch_ms = timed(lambda: predict_top_k_with_production_music_net(model, tensors), repeat)
+    peak_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_kb) / 1024
+
+    parity = check_backend_parity(reference, model, tensors, labels)
+    results.put({"backend": backend, "export_seconds": export_seconds, "single_ms": single_ms,
+                 "batch_ms": batch_ms, "peak_mb": peak_mb, **parity})
+
+
+def main():
+    from services.music_net import MUSIC_NET_BACKENDS, MUSIC_NET_INPUT_SHAPE
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=list(MUSIC_NET_BACKENDS), help="Backends to compare.")
+    parser.add_argument("--sample", type=int, default=32, help="Number of tracks (or tensors) in the sample.")
+    parser.add_argument("--repeat", type=int, default=20, help="Number of timed predictions per backend.")
+    parser.add_argument("--synthetic", action="store_true", help="Use random input tensors instead of MegaSet tracks.")
+    parser.add_argument("--stand-in", action="store_true", help="Use a ResNet-18 instead of the production model.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the sampling.")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        generator = torch.Generator().manual_seed(args.seed)
+        tensors, labels = [torch.randn(MUSIC_NET_INPUT_SHAPE, generator=generator) for _ in range(args.sample)], None
+    else:
+        tensors, labels = labelled_sample(args.sample, args.seed)
+    if not tensors:
+        print("Empty sample")
+        return
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    print(f"{len(tensors)} {'labelled' if labels else 'synthetic'} inputs, {torch.get_num_threads()} threads")
+    print(f"{'backend':>17} {'export s':>8} {'1 file ms':>9} {f'{len(tensors)} files ms':>12} {'peak MB':>8} "
+          f"{'top-1 agree':>11} {'max dp':>8} {'accuracy':>17}")
+    for backend in args.backends:
+        process = context.Process(target=run_backend, args=(backend, args.stand_in, tensors, labels, args.repeat, results))
+        process.start()
+        report = results.get()
+        process.join()
+        accuracy = f"{report['accuracy']:.3f} (eager {report['reference_accuracy']:.3f})" if labels else "-"
+        print(f"{report['backend']:>17} {report['export_seconds']:>8.2f} {report['single_ms']:>9.1f} "
+              f"{report['batch_ms']:>12.1f} {report['peak_mb']:>8.0f} {report['top1_agreement']:>11.3f} "
+              f"{report['max_probability_difference']:>8.1e} {accuracy:>17}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Latency benchmark of the MusicNet input preprocessing.
+
+Creates the model input tensor of a synthetic track with the former path (specshow plot saved to a PNG file,
+reopened and resized) and with the in-memory rendering, and reports the latency of each, along with the share of
+the mel spectrogram computation they both include.
+
+Usage:
+    python -m benchmarks.music_net_spectrogram --repeat 10
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+import torch
+
+from services.music_net import create_preprocessed_spectrogram, create_spectrogram_tensor, compute_mel_db
+
+
+def timed(function, repeat):
+    function()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10, help="Number of runs of each path.")
+    parser.add_argument("--seconds", type=float, default=60, help="Length of the synthetic track in seconds.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    n_samples = int(22050 * args.seconds)
+    audio = 0.3 * np.sin(np.cumsum(np.linspace(0.01, 0.5, n_samples))) + 0.05 * rng.standard_normal(n_samples)
+    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
+        audio_file = temp_file.name
+    try:
+        sf.write(audio_file, audio.astype(np.float32), 22050)
+
+        mel_ms, _ = timed(lambda: compute_mel_db(audio_file), args.repeat)
+        png_ms, png_tensor = timed(lambda: create_preprocessed_spectrogram(audio_file), args.repeat)
+        memory_ms, memory_tensor = timed(lambda: create_spectrogram_tensor(audio_file), args.repeat)
+    finally:
+        os.unlink(audio_file)
+
+    print(f"mel spectrogram (both paths): {mel_ms:7.1f} ms")
+    print(f"PNG rendering path:           {png_ms:7.1f} ms ({png_ms - mel_ms:7.1f} ms rendering)")
+    print(f"in-memory rendering path:     {memory_ms:7.1f} ms ({memory_ms - mel_ms:7.1f} ms rendering)")
+    print(f"identical tensors: {torch.equal(png_tensor, memory_tensor)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Peak memory benchmark of the OpenL3 patch batching.
+
+Builds the model input batches for a synthetic mel spectrogram of a long track, once with the former
+copy-based builder and once with the strided-view builder, each in a fresh process, and reports the
+peak RSS growth of each run.
+
+Usage:
+    python -m benchmarks.openl3_patch_memory --minutes 10
+"""
+import argparse
+import multiprocessing
+import resource
+
+import numpy as np
+
+
+X_SIZE = 199
+MELBANDS = 128
+BATCH_SIZE = 60
+PERMUTATION = [0, 3, 2, 1]
+
+
+def legacy_batches(melspectrogram):
+    """Former EmbeddingsOpenL3.__melspectrogram_to_batch followed by the batch slicing of compute()."""
+    import essentia.standard as es
+
+    npatches = int(np.ceil((melspectrogram.shape[0] - X_SIZE) / X_SIZE) + 1)
+    batch = np.zeros([npatches, X_SIZE, MELBANDS], dtype="float32")
+    for i in range(npatches):
+        last_frame = min(i * X_SIZE + X_SIZE, melspectrogram.shape[0])
+        first_frame = i * X_SIZE
+        data_size = last_frame - first_frame
+        if data_size <= 0:
+            batch = np.delete(batch, i, axis=0)
+            break
+        batch[i, :data_size] = melspectrogram[first_frame:last_frame]
+    batch = np.expand_dims(batch, 1)
+    batch = es.TensorTranspose(permutation=PERMUTATION)(batch)
+    for start in range(0, batch.shape[0], BATCH_SIZE):
+        yield batch[start:start + BATCH_SIZE]
+
+
+def strided_batches(melspectrogram):
+    """Strided-view builder used by EmbeddingsOpenL3, with the transposition folded into the view."""
+    from core.extract_openl3_embeddings import melspectrogram_to_patches
+
+    batch = np.expand_dims(melspectrogram_to_patches(melspectrogram, X_SIZE, X_SIZE), 1).transpose(PERMUTATION)
+    for start in range(0, batch.shape[0], BATCH_SIZE):
+        yield np.ascontiguousarray(batch[start:start + BATCH_SIZE])
+
+
+def measure(builder_name, n_frames, queue):
+    """Runs one builder in the current process and reports its peak RSS growth in MB."""
+    builders = {"legacy": legacy_batches, "strided": strided_batches}
+    melspectrogram = np.random.default_rng(0).standard_normal((n_frames, MELBANDS), dtype=np.float32)
+    # Import the builder dependencies before taking the baseline
+    next(builders[builder_name](melspectrogram[:X_SIZE]))
+
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    checksum = 0.0
+    for batch in builders[builder_name](melspectrogram):
+        checksum += float(batch[:, 0, 0, 0].sum())
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((builder_name, (peak_kb - baseline_kb) / 1024, checksum))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, default=10, help="Length of the synthetic track in minutes.")
+    args = parser.parse_args()
+
+    # One 1-second patch of 199 mel frames per second of audio (hop_time=1)
+    n_frames = int(args.minutes * 60) * X_SIZE
+    mel_mb = n_frames * MELBANDS * 4 / 1024 / 1024
+    print(f"Track of {args.minutes} min: mel spectrogram of {n_frames} frames ({mel_mb:.1f} MB)")
+
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    for builder_name in ["legacy", "strided"]:
+        process = context.Process(target=measure, args=(builder_name, n_frames, queue))
+        process.start()
+        process.join()
+        name, peak_mb, _ = queue.get()
+        print(f"{name:>8}: peak RSS growth {peak_mb:8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
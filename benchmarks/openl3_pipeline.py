@@ -0,0 +1,92 @@
+"""
+Throughput benchmark of the pipelined OpenL3 extraction.
+
+Extracts the mean embedding of a synthetic track with the stages run in sequence (pipeline_depth=0) and with mel
+extraction overlapped with inference in a worker thread, each with the track decoded before the first window or in
+a decoding process while the model runs, and reports the throughput of each run in seconds of audio per wall-clock
+second. The decoding process is started before the runs are timed.
+
+Without --graph, the TensorFlow model is replaced by a stand-in doing a dense projection of each patch on the CPU,
+so that the benchmark can run anywhere; pass the OpenL3 graph for real inference costs.
+
+Usage:
+    python -m benchmarks.openl3_pipeline --minutes 5 --depths 0 2 4
+    python -m benchmarks.openl3_pipeline --format mp3 --decode-processes 0 1
+    python -m benchmarks.openl3_pipeline --graph openl3.pb
+"""
+import argparse
+import os
+import tempfile
+import time
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+
+def stand_in_model():
+    """TensorflowPredict stand-in: a 512-d projection of each mel patch, releasing the GIL like TensorFlow does."""
+    weights = np.random.default_rng(0).standard_normal((199 * 128, 512), dtype=np.float32)
+
+    def predict(pool):
+        batch = pool["melspectrogram"]
+        return {"embeddings": batch.reshape(len(batch), -1) @ weights}
+    return MagicMock(side_effect=predict)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, default=5, help="Length of the synthetic track in minutes.")
+    parser.add_argument("--depths", type=int, nargs="+", default=[0, 2], help="Pipeline depths to compare.")
+    parser.add_argument("--window-seconds", type=float, default=60, help="Streaming window in seconds.")
+    parser.add_argument("--decode-processes", type=int, nargs="+", default=[0, 1],
+                        help="Numbers of decoding processes to compare (0 to decode before the first window).")
+    parser.add_argument("--format", default="wav", help="Format of the synthetic track, e.g. wav or mp3.")
+    parser.add_argument("--graph", help="OpenL3 graph file, instead of the stand-in model.")
+    args = parser.parse_args()
+
+    import essentia.standard as es
+    from core.audio_decoding import DecoderProcessPool
+    from core.extract_openl3_embeddings import EmbeddingsOpenL3
+
+    seconds = args.minutes * 60
+    rng = np.random.default_rng(0)
+    audio = (0.3 * np.sin(np.arange(int(seconds * 44100)) * 0.05) + 0.1 * rng.standard_normal(int(seconds * 44100)))
+    with tempfile.NamedTemporaryFile(suffix=f".{args.format}", delete=False) as temp_file:
+        audio_file = temp_file.name
+    try:
+        es.MonoWriter(filename=audio_file, sampleRate=44100, format=args.format)(audio.astype(np.float32))
+
+        decoders = {}
+        for processes in args.decode_processes:
+            decoders[processes] = DecoderProcessPool(processes) if processes else None
+            if processes:
+                # Start the processes, and have them import Essentia, before timing
+                with tempfile.NamedTemporaryFile(suffix=".pcm") as warm_up:
+                    decoders[processes].submit(audio_file, warm_up.name, 48000).result()
+
+        reference = None
+        for depth in args.depths:
+            for processes, decoder in decoders.items():
+                if args.graph:
+                    model = EmbeddingsOpenL3(args.graph, pipeline_depth=depth, decoder=decoder)
+                else:
+                    with patch("core.extract_openl3_embeddings.es.TensorflowPredict", return_value=stand_in_model()):
+                        model = EmbeddingsOpenL3("stand-in.pb", pipeline_depth=depth, decoder=decoder)
+
+                start = time.perf_counter()
+                embedding = model.compute_mean(audio_file, window_seconds=args.window_seconds)
+                elapsed = time.perf_counter() - start
+
+                reference = embedding if reference is None else reference
+                identical = "identical" if np.array_equal(embedding, reference) else "DIFFERENT"
+                print(f"pipeline_depth={depth} decode_processes={processes}: {elapsed:6.2f} s, "
+                      f"{seconds / elapsed:6.1f} s of audio per second ({identical})")
+        for decoder in decoders.values():
+            if decoder is not None:
+                decoder.shutdown()
+    finally:
+        os.unlink(audio_file)
+
+
+if __name__ == "__main__":
+    main()
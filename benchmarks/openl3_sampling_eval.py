@@ -0,0 +1,133 @@
+"""
+Accuracy and speed evaluation of the approximate OpenL3 mean embedding (segment sampling).
+
+For a random sample of MegaSet tracks (or the MP3 files of a local directory), computes the full-track mean
+embedding and the sampled approximations for several numbers of excerpts and both excerpt selections, and reports
+for each setting:
+    - the cosine similarity between the approximate and the full-track mean embedding,
+    - the overlap of their top-k neighbors in the 512-d Milvus collection (skipped with --no-milvus),
+    - the speedup of the extraction.
+
+Usage:
+    python -m benchmarks.openl3_sampling_eval --sample 50 --excerpts 2 4 8 16 --top-k 10
+    python -m benchmarks.openl3_sampling_eval --local-dir ~/Music --graph openl3.pb --no-milvus
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+
+def iter_megaset_tracks(sample_size, seed):
+    """Downloads a random sample of the music_library tracks from MinIO, one at a time."""
+    from core.config import DEFAULT_SETTINGS, SessionLocal, minio_client
+    from models.music import MusicLibrary
+
+    with SessionLocal() as db:
+        paths = [row.filepath for row in db.query(MusicLibrary.filepath).filter(MusicLibrary.filepath.isnot(None))]
+    for path in random.Random(seed).sample(paths, min(sample_size, len(paths))):
+        with tempfile.NamedTemporaryFile(suffix=Path(path).suffix, delete=False) as temp_file:
+            temp_path = temp_file.name
+        try:
+            minio_client.fget_object(DEFAULT_SETTINGS.minio_bucket_name, path, temp_path)
+            yield path, temp_path
+        finally:
+            os.unlink(temp_path)
+
+
+def iter_local_tracks(directory, sample_size, seed):
+    """Yields a random sample of the MP3 files of a local directory."""
+    paths = sorted(str(path) for path in Path(directory).expanduser().rglob("*.mp3"))
+    for path in random.Random(seed).sample(paths, min(sample_size, len(paths))):
+        yield path, path
+
+
+def cosine(a, b):
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def neighbor_ids(collection, embeddings, top_k):
+    """Top-k neighbor ids of each embedding in the Milvus collection, in one search."""
+    results = collection.search(
+        data=[embedding.tolist() for embedding in embeddings],
+        anns_field="embedding",
+        param={"nprobe": 16},
+        limit=top_k,
+    )
+    return [set(hits.ids) for hits in results]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sample", type=int, default=50, help="Number of tracks to evaluate.")
+    parser.add_argument("--excerpts", type=int, nargs="+", default=[2, 4, 8, 16], help="Numbers of excerpts to evaluate.")
+    parser.add_argument("--excerpt-seconds", type=float, default=3, help="Length of each excerpt in seconds.")
+    parser.add_argument("--selections", nargs="+", default=["even", "energy"], help="Excerpt selections to evaluate.")
+    parser.add_argument("--top-k", type=int, default=10, help="Number of Milvus neighbors compared.")
+    parser.add_argument("--local-dir", help="Evaluate the MP3 files of this directory instead of MegaSet.")
+    parser.add_argument("--graph", help="Local OpenL3 graph file, instead of the model stored in MinIO.")
+    parser.add_argument("--no-milvus", action="store_true", help="Skip the top-k neighbor overlap.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the track sampling.")
+    args = parser.parse_args()
+
+    if args.graph:
+        from core.extract_openl3_embeddings import EmbeddingsOpenL3
+        model = EmbeddingsOpenL3(args.graph)
+    else:
+        from services.minio import openl3_model_registry
+        model, _ = openl3_model_registry.get()
+
+    collection = None
+    if not args.no_milvus:
+        from services.milvus import get_milvus_512_collection
+        collection = get_milvus_512_collection()
+
+    if args.local_dir:
+        tracks = iter_local_tracks(args.local_dir, args.sample, args.seed)
+    else:
+        tracks = iter_megaset_tracks(args.sample, args.seed)
+
+    settings = [(selection, n_excerpts) for selection in args.selections for n_excerpts in args.excerpts]
+    similarities = defaultdict(list)
+    overlaps = defaultdict(list)
+    durations = defaultdict(list)
+    for name, audio_file in tracks:
+        start = time.perf_counter()
+        full = model.compute_mean(audio_file, window_seconds=60)
+        durations["full"].append(time.perf_counter() - start)
+
+        approximations = []
+        for selection, n_excerpts in settings:
+            start = time.perf_counter()
+            approximation = model.compute_sampled_mean(audio_file, n_excerpts=n_excerpts,
+                                                       excerpt_seconds=args.excerpt_seconds, selection=selection)
+            durations[selection, n_excerpts].append(time.perf_counter() - start)
+            similarities[selection, n_excerpts].append(cosine(full, approximation))
+            approximations.append(approximation)
+
+        if collection is not None:
+            full_ids, *approximation_ids = neighbor_ids(collection, [full] + approximations, args.top_k)
+            for setting, ids in zip(settings, approximation_ids):
+                overlaps[setting].append(len(full_ids & ids) / args.top_k)
+        print(f"{name}: full {durations['full'][-1]:.2f} s")
+
+    if not durations["full"]:
+        print("No track evaluated")
+        return
+
+    full_seconds = np.mean(durations["full"])
+    print(f"\n{len(durations['full'])} tracks, full-track extraction {full_seconds:.2f} s on average")
+    print(f"{'selection':>9} {'excerpts':>8} {'cos mean':>9} {'cos min':>8} {f'top-{args.top_k} overlap':>15} {'speedup':>8}")
+    for setting in settings:
+        overlap = f"{np.mean(overlaps[setting]):.3f}" if overlaps[setting] else "-"
+        print(f"{setting[0]:>9} {setting[1]:>8} {np.mean(similarities[setting]):>9.4f} {np.min(similarities[setting]):>8.4f} "
+              f"{overlap:>15} {full_seconds / np.mean(durations[setting]):>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
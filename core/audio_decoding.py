@@ -0,0 +1,298 @@
+import gc
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import NamedTuple
+
+import essentia
+import essentia.standard as es
+import essentia.streaming as ess
+import librosa
+import numpy as np
+import soundfile as sf
+
+
+class PcmFile(NamedTuple):
+    """
+    Already decoded audio: a raw mono float32 PCM file and its sample rate, e.g. an entry of the PCM cache
+    (core/pcm_cache.py). The decoding functions below accept it in place of an audio file, and read it directly.
+    """
+    path: str
+    sample_rate: int
+
+
+def _check_rate(pcm, sample_rate):
+    if pcm.sample_rate != sample_rate:
+        raise ValueError(f"The PCM file is sampled at {pcm.sample_rate} Hz, not {sample_rate} Hz")
+
+
+def load_mono(audio_file, sample_rate):
+    """
+    Loads the whole mono signal of an audio file, like essentia.standard.MonoLoader.
+
+    Args:
+        audio_file (str or PcmFile): The path to the audio file, or already decoded audio.
+        sample_rate (int): The sample rate to decode at.
+
+    Returns:
+        np.ndarray: The decoded samples.
+    """
+    if isinstance(audio_file, PcmFile):
+        _check_rate(audio_file, sample_rate)
+        return np.fromfile(audio_file.path, dtype=np.float32)
+    return es.MonoLoader(filename=audio_file, sampleRate=sample_rate)()
+
+
+def decode_to_pcm_file(audio_file, pcm_file, sample_rate):
+    """
+    Decodes an audio file to raw mono float32 PCM on disk, using Essentia's streaming MonoLoader.
+
+    The decoded samples are bit-identical to those of essentia.standard.MonoLoader, but they are written to disk
+    through the bounded buffers of the streaming network instead of being held in memory.
+
+    Args:
+        audio_file (str): The path to the audio file.
+        pcm_file (str): The path to the raw PCM file to write.
+        sample_rate (int): The sample rate to decode at.
+    """
+    loader = ess.MonoLoader(filename=audio_file, sampleRate=sample_rate)
+    output = ess.FileOutput(filename=pcm_file, mode="binary")
+    loader.audio >> output
+    essentia.run(loader)
+    # FileOutput only flushes and closes its file once the network is torn down
+    essentia.reset(loader)
+    del loader, output
+    gc.collect()
+
+
+def iter_pcm_blocks(pcm_file, block_samples):
+    """
+    Reads a raw mono float32 PCM file block by block.
+
+    Args:
+        pcm_file (str): The path to the raw PCM file.
+        block_samples (int): The number of samples per block.
+
+    Yields:
+        np.ndarray: The next block of samples (the last one may be shorter).
+    """
+    with open(pcm_file, "rb") as f:
+        yield from _read_blocks(f, block_samples)
+
+
+def _read_blocks(f, block_samples):
+    while True:
+        block = np.fromfile(f, dtype=np.float32, count=block_samples)
+        if not len(block):
+            break
+        yield block
+
+
+def _tail_pcm_blocks(pcm_file, block_samples, decoding, on_decoded=None, poll_seconds=0.05):
+    """
+    Reads a raw mono float32 PCM file block by block while it is being written: only whole blocks are read until
+    the decoding is done, then the rest of the file.
+
+    Args:
+        pcm_file (str): The path to the raw PCM file.
+        block_samples (int): The number of samples per block.
+        decoding (Future): The decoding writing the file.
+        on_decoded (callable): An optional callback called with the total number of samples once decoded.
+        poll_seconds (float): The delay between two checks of the size of the file.
+
+    Yields:
+        np.ndarray: The next block of samples (the last one may be shorter).
+    """
+    block_bytes = block_samples * np.dtype(np.float32).itemsize
+    with open(pcm_file, "rb") as f:
+        position = 0
+        while not decoding.done():
+            if os.fstat(f.fileno()).st_size - position >= block_bytes:
+                yield np.fromfile(f, dtype=np.float32, count=block_samples)
+                position += block_bytes
+            else:
+                wait([decoding], timeout=poll_seconds)
+        decoding.result()
+        if on_decoded is not None:
+            on_decoded(os.fstat(f.fileno()).st_size // np.dtype(np.float32).itemsize)
+        yield from _read_blocks(f, block_samples)
+
+
+class DecoderProcessPool:
+    """
+    Decodes audio files to raw PCM files in worker processes. Essentia holds the GIL while it decodes, so a decoding
+    thread would stall the other threads of the caller instead of overlapping with them.
+
+    The processes are spawned rather than forked, as the caller may already run TensorFlow threads, and started on
+    the first submission. They are reused across files, so that their start-up (importing Essentia, a few seconds)
+    is paid once per worker. A pool whose process died is replaced on the next submission.
+
+    Attributes:
+        max_workers (int): The number of decoding processes.
+    """
+
+    def __init__(self, max_workers=1):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, audio_file, pcm_file, sample_rate):
+        """
+        Starts decoding an audio file to a raw PCM file, written progressively (see decode_to_pcm_file).
+
+        Args:
+            audio_file (str): The path to the audio file.
+            pcm_file (str): The path to the raw PCM file to write.
+            sample_rate (int): The sample rate to decode at.
+
+        Returns:
+            Future: Resolved once the PCM file is complete.
+        """
+        with self._lock:
+            try:
+                return self._get_executor().submit(decode_to_pcm_file, audio_file, pcm_file, sample_rate)
+            except BrokenProcessPool:
+                self._executor = None
+                return self._get_executor().submit(decode_to_pcm_file, audio_file, pcm_file, sample_rate)
+
+    def shutdown(self):
+        """
+        Stops the decoding processes, once their current files are decoded.
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+
+def stream_audio_blocks(audio_file, sample_rate, block_samples, on_decoded=None, decoder=None):
+    """
+    Decodes an audio file and yields its mono samples block by block, keeping at most one block in memory.
+    The decoded signal is spooled to a temporary file, deleted once the generator is exhausted or closed.
+
+    With a decoder pool, the file is decoded in another process and its blocks are yielded as soon as they are
+    written, so that decoding overlaps with the processing of the first blocks. The samples are the same. If the
+    generator is closed early, a decoding already started still runs to its end, into the deleted file.
+
+    Args:
+        audio_file (str or PcmFile): The path to the audio file, or already decoded audio, read in place.
+        sample_rate (int): The sample rate to decode at.
+        block_samples (int): The number of samples per block.
+        on_decoded (callable): An optional callback called with the total number of samples once decoded.
+        decoder (DecoderProcessPool): The processes to decode in, or None to decode in the calling thread before the
+            first block is yielded.
+
+    Yields:
+        np.ndarray: The next block of samples (the last one may be shorter).
+    """
+    if isinstance(audio_file, PcmFile):
+        _check_rate(audio_file, sample_rate)
+        if on_decoded is not None:
+            on_decoded(os.path.getsize(audio_file.path) // np.dtype(np.float32).itemsize)
+        yield from iter_pcm_blocks(audio_file.path, block_samples)
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=".pcm", delete=False) as temp_file:
+        pcm_file = temp_file.name
+    try:
+        if decoder is not None:
+            decoding = decoder.submit(audio_file, pcm_file, sample_rate)
+            try:
+                yield from _tail_pcm_blocks(pcm_file, block_samples, decoding, on_decoded)
+            finally:
+                # Drops the decoding if it has not started yet
+                decoding.cancel()
+            return
+        decode_to_pcm_file(audio_file, pcm_file, sample_rate)
+        if on_decoded is not None:
+            on_decoded(os.path.getsize(pcm_file) // np.dtype(np.float32).itemsize)
+        yield from iter_pcm_blocks(pcm_file, block_samples)
+    finally:
+        os.unlink(pcm_file)
+
+
+@contextmanager
+def decoded_pcm(audio_file, sample_rate):
+    """
+    Decodes an audio file to a temporary file and maps its mono samples read-only in memory, so that parts of the
+    signal can be read without holding the whole signal in memory. The file is deleted on exit.
+
+    Args:
+        audio_file (str or PcmFile): The path to the audio file, or already decoded audio, mapped in place.
+        sample_rate (int): The sample rate to decode at.
+
+    Yields:
+        np.ndarray: The decoded signal, memory-mapped (empty if nothing was decoded).
+    """
+    if isinstance(audio_file, PcmFile):
+        _check_rate(audio_file, sample_rate)
+        yield _map_pcm_file(audio_file.path)
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=".pcm", delete=False) as temp_file:
+        pcm_file = temp_file.name
+    try:
+        decode_to_pcm_file(audio_file, pcm_file, sample_rate)
+        audio = _map_pcm_file(pcm_file)
+        yield audio
+        del audio
+    finally:
+        os.unlink(pcm_file)
+
+
+def _map_pcm_file(pcm_file):
+    if os.path.getsize(pcm_file):
+        return np.memmap(pcm_file, dtype=np.float32, mode="r")
+    return np.empty(0, dtype=np.float32)
+
+
+# Audio decoded before the start of a window and discarded: after a seek, the MP3 decoder of libsndfile returns wrong
+# samples for the first frames, until it has rebuilt its bit reservoir from the frames before the target
+SEEK_PREROLL_SECONDS = 0.5
+
+
+def decode_window(source, sample_rate, offset=0.0, duration=None):
+    """
+    Decodes a time window of an audio file to mono samples, seeking in the compressed stream shortly before the
+    start of the window instead of decoding the file from its beginning.
+
+    The samples are those of the window in a decode of the whole file with libsndfile, mixed down and resampled like
+    librosa.load(source, sr=sample_rate, offset=offset, duration=duration) does. Unlike librosa.load, the decoder
+    is started SEEK_PREROLL_SECONDS before the window, so that the first samples of MP3 windows are right. The
+    source can be a seekable binary file object, so that only the bytes the decoder reads need to be fetched (see
+    services.minio.ObjectRangeReader).
+
+    Args:
+        source (str or file): The path to the audio file, or a seekable binary file object.
+        sample_rate (int): The sample rate to decode at.
+        offset (float): The start of the window in seconds.
+        duration (float): The duration of the window in seconds, or None to decode until the end.
+
+    Returns:
+        np.ndarray: The decoded mono samples, as float32.
+
+    Raises:
+        sf.LibsndfileError: If libsndfile does not support the format of the file.
+    """
+    with sf.SoundFile(source) as f:
+        native_rate = f.samplerate
+        start = int(offset * native_rate)
+        preroll = min(start, int(SEEK_PREROLL_SECONDS * native_rate))
+        if start - preroll:
+            f.seek(start - preroll)
+        frames = int(duration * native_rate) + preroll if duration is not None else -1
+        y = f.read(frames=frames, dtype=np.float32, always_2d=True)[preroll:].T
+
+    y = librosa.to_mono(y)
+    if native_rate != sample_rate:
+        y = librosa.resample(y, orig_sr=native_rate, target_sr=sample_rate, res_type="soxr_hq")
+    return y
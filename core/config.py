@@ -24,6 +24,14 @@ class Settings(BaseSettings):
         milvus_api_key (str): API key for accessing Milvus.
         milvus_512_collection_name (str): Collection name in Milvus for 512-dimensional vectors.
         milvus_87_collection_name (str): Collection name in Milvus for 87-dimensional vectors.
+        milvus_health_check_interval_seconds (float): Minimum delay between two health checks of the Milvus connection.
+        milvus_path_index_reload_interval_seconds (float): Minimum delay between two loads of the path to Milvus id index.
+        similarity_backend (str): Backend of the 512-d similarity routes: "milvus", "local" (the local embedding mirror) or "fallback" (the mirror when Milvus fails).
+        embedding_mirror_dir (str): Directory of the local mirror of the 512-d collection.
+        similarity_cache_max_entries (int): Number of similarity results cached per worker (0 to disable the cache).
+        similarity_cache_check_interval_seconds (float): Minimum delay between two checks of the version of the cached similarity results.
+        similarity_batch_max_paths (int): Maximum number of paths of a batch similarity search.
+        similarity_batch_max_k (int): Maximum number of similar entities per path of a batch similarity search.
         minio_root_user (str): Root user for MinIO object storage.
         minio_bucket_name (str): Name of the primary bucket in MinIO.
         minio_temp_bucket_name (str): Name of the temporary bucket in MinIO.
@@ -36,6 +44,35 @@ class Settings(BaseSettings):
         spotify_client_id (str): Client ID for Spotify API.
         spotify_client_secret (str): Client secret for Spotify API.
         cyanite_token (str): Token for accessing Cyanite API.
+        openl3_model_check_interval_seconds (int): Minimum delay between two checks of the OpenL3 model ETag in MinIO.
+        music_net_model_check_interval_seconds (int): Minimum delay between two checks of the MusicNet artifact in MinIO.
+        music_net_backend (str): Inference backend of MusicNet: "eager", "torchscript" or "torchscript-int8".
+        music_net_batch_max_files (int): Maximum number of files in a batched MusicNet genre prediction.
+        music_net_preprocess_workers (int): Number of files preprocessed concurrently for a batched MusicNet prediction.
+        music_net_precomputed_top_k (int): Number of genres stored per track by the MusicNet catalog precomputation job.
+        openl3_stream_window_seconds (int): Length of audio the OpenL3 extraction processes at once (0 for whole tracks).
+        openl3_micro_batching (bool): Whether to pool the patches of concurrent OpenL3 extractions into shared model batches.
+        openl3_batch_max_size (int): Maximum number of patches in a pooled OpenL3 batch, a multiple of the 60-patch extraction batches.
+        openl3_batch_max_wait_ms (int): Maximum time a patch waits for its pooled OpenL3 batch to fill up.
+        openl3_pipeline_depth (int): Number of windows turned into mel patches ahead of the OpenL3 model in a worker thread (0 to disable).
+        openl3_decode_processes (int): Number of processes decoding audio while the OpenL3 model runs (0 to decode before the first window).
+        openl3_sampled_excerpts (int): Number of excerpts the OpenL3 mean embedding is approximated from (0 for whole tracks).
+        openl3_excerpt_seconds (float): Length of each OpenL3 excerpt in seconds.
+        openl3_excerpt_selection (str): Placement of the OpenL3 excerpts, "even" or "energy".
+        elo_metadata_timeout_seconds (float): Timeout of the metadata and artwork branch of /elo/compare_models.
+        elo_music_net_timeout_seconds (float): Timeout of the MusicNet prediction branch of /elo/compare_models.
+        elo_essentia_timeout_seconds (float): Timeout of the Essentia predictions plot branch of /elo/compare_models.
+        elo_k_factor (float): Maximum Elo rating change of a vote.
+        elo_initial_rating (float): Elo rating of a model before its first vote.
+        elo_flush_interval_seconds (float): Maximum delay before a vote is written to the database.
+        elo_flush_max_votes (int): Number of votes waiting to be written that triggers a write.
+        pcm_cache_max_mb (int): Size cap of the decoded audio cache shared by OpenL3 and MusicNet (0 to disable it).
+        pcm_cache_dir (str): Directory of the decoded audio cache, a temporary directory if empty.
+        embedding_jobs_backend (str): Backend of the embedding job queue ("local" runs the jobs in-process).
+        embedding_jobs_workers (int): Number of embedding jobs run concurrently.
+        embedding_jobs_max_queued (int): Maximum number of embedding jobs waiting for a worker.
+        embedding_jobs_ttl_seconds (int): How long finished embedding jobs can be looked up.
+        embedding_storage_dtype (str): Storage type of the embeddings saved to MinIO, "float32" or "float16".
     """
     secret_key: str = ""  
     algorithm: str = ""
@@ -49,6 +86,14 @@ class Settings(BaseSettings):
     milvus_api_key: str = ""
     milvus_512_collection_name: str = ""
     milvus_87_collection_name: str = ""
+    milvus_health_check_interval_seconds: float = 30
+    milvus_path_index_reload_interval_seconds: float = 300
+    similarity_backend: str = "milvus"
+    embedding_mirror_dir: str = "core/data/embedding_mirror"
+    similarity_cache_max_entries: int = 10000
+    similarity_cache_check_interval_seconds: float = 30
+    similarity_batch_max_paths: int = 32
+    similarity_batch_max_k: int = 100
     minio_root_user: str = ""
     minio_bucket_name: str = ""
     minio_temp_bucket_name: str = ""
@@ -62,6 +107,35 @@ class Settings(BaseSettings):
     spotify_client_id: str = "",
     spotify_client_secret: str = "",
     cyanite_token: str = ""
+    openl3_model_check_interval_seconds: int = 300
+    music_net_model_check_interval_seconds: int = 300
+    music_net_backend: str = "eager"
+    music_net_batch_max_files: int = 64
+    music_net_preprocess_workers: int = 4
+    music_net_precomputed_top_k: int = 5
+    openl3_stream_window_seconds: int = 60
+    openl3_micro_batching: bool = True
+    openl3_batch_max_size: int = 240
+    openl3_batch_max_wait_ms: int = 20
+    openl3_pipeline_depth: int = 2
+    openl3_decode_processes: int = 1
+    openl3_sampled_excerpts: int = 0
+    openl3_excerpt_seconds: float = 3
+    openl3_excerpt_selection: str = "even"
+    elo_metadata_timeout_seconds: float = 10
+    elo_music_net_timeout_seconds: float = 30
+    elo_essentia_timeout_seconds: float = 10
+    elo_k_factor: float = 32
+    elo_initial_rating: float = 1500
+    elo_flush_interval_seconds: float = 5
+    elo_flush_max_votes: int = 200
+    pcm_cache_max_mb: int = 2048
+    pcm_cache_dir: str = ""
+    embedding_jobs_backend: str = "local"
+    embedding_jobs_workers: int = 2
+    embedding_jobs_max_queued: int = 100
+    embedding_jobs_ttl_seconds: int = 3600
+    embedding_storage_dtype: str = "float32"
 
     model_config = {
         "env_file": ".env",
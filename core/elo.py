@@ -0,0 +1,231 @@
+import threading
+import time
+
+from core.metrics import ELO_FLUSH_SECONDS, ELO_PENDING_VOTES, ELO_VOTES
+
+
+STAT_FIELDS = ("rating", "wins", "losses", "draws", "votes")
+
+
+def expected_score(rating_a, rating_b):
+    """
+    Computes the expected score of a player against another under the Elo model.
+
+    Args:
+        rating_a (float): The rating of the player.
+        rating_b (float): The rating of the opponent.
+
+    Returns:
+        float: The probability of the player winning, between 0 and 1.
+    """
+    return 1 / (1 + 10 ** ((rating_b - rating_a) / 400))
+
+
+def rating_change(rating_a, rating_b, score, k_factor=32):
+    """
+    Computes the rating change of a player after a game. The opponent's change is its opposite.
+
+    Args:
+        rating_a (float): The rating of the player.
+        rating_b (float): The rating of the opponent.
+        score (float): The score of the player: 1 for a win, 0.5 for a draw, 0 for a loss.
+        k_factor (float): The maximum rating change of a game.
+
+    Returns:
+        float: The change of the player's rating.
+    """
+    return k_factor * (score - expected_score(rating_a, rating_b))
+
+
+def _empty_stats(rating=0.0):
+    return {"rating": rating, "wins": 0, "losses": 0, "draws": 0, "votes": 0}
+
+
+class EloStore:
+    """
+    In-memory Elo ratings of competing models, updated by votes and persisted by a write-behind flush.
+
+    Votes update the ratings in memory under a lock and are queued with the rating changes they caused. A
+    background thread, started on the first vote, hands the queued votes and changes to `persist` in one batch,
+    every `flush_interval_seconds` or as soon as `flush_max_votes` votes are queued, instead of one commit per vote.
+    Leaderboard reads are served from memory.
+
+    Changes are persisted as increments, so that several worker processes, each with its own store, add up their
+    votes in the database. After a flush, the store takes the persisted ratings, which include the votes of the
+    other processes, plus the changes of its votes not flushed yet. If a flush fails, its votes are queued again.
+
+    Attributes:
+        load (callable): Returns the persisted stats of each model, a dict of model -> dict of STAT_FIELDS.
+        persist (callable): Called with the queued votes and the changes of each model's stats; persists them and
+            returns the persisted stats of each model, like `load`.
+        k_factor (float): The maximum rating change of a vote.
+        initial_rating (float): The rating of a model before its first vote.
+        flush_interval_seconds (float): The maximum delay before a vote is persisted.
+        flush_max_votes (int): The number of queued votes that triggers a flush.
+    """
+
+    def __init__(self, load, persist, k_factor=32, initial_rating=1500, flush_interval_seconds=5, flush_max_votes=200):
+        """
+        Initializes the EloStore. The ratings are loaded lazily, on first use.
+
+        Args:
+            load (callable): Returns the persisted stats of each model.
+            persist (callable): Persists queued votes and stats changes, and returns the persisted stats.
+            k_factor (float): The maximum rating change of a vote.
+            initial_rating (float): The rating of a model before its first vote.
+            flush_interval_seconds (float): The maximum delay before a vote is persisted.
+            flush_max_votes (int): The number of queued votes that triggers a flush.
+        """
+        self.load = load
+        self.persist = persist
+        self.k_factor = k_factor
+        self.initial_rating = initial_rating
+        self.flush_interval_seconds = flush_interval_seconds
+        self.flush_max_votes = flush_max_votes
+
+        self._stats = None
+        self._pending_votes = []
+        self._pending_changes = {}
+        self._lock = threading.Lock()
+        # Serializes the flushes, so that batches are persisted in order
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._flusher = None
+
+    def vote(self, model_a, model_b, score, **details):
+        """
+        Records a vote between two models and updates their ratings.
+
+        Args:
+            model_a (str): The first model.
+            model_b (str): The second model.
+            score (float): The score of the first model: 1 if it won, 0.5 for a draw, 0 if it lost.
+            **details: Other fields of the vote, passed to `persist` (e.g. the file and the user).
+
+        Returns:
+            dict: The updated stats of both models, by model.
+        """
+        if model_a == model_b:
+            raise ValueError("A model cannot compete against itself")
+        if score not in (0, 0.5, 1):
+            raise ValueError(f"Invalid score {score}, expected 0, 0.5 or 1")
+
+        with self._lock:
+            if self._flusher is None and not self._closed:
+                self._flusher = threading.Thread(target=self._run, name="elo-flush", daemon=True)
+                self._flusher.start()
+            self._ensure_loaded()
+            stats_a, stats_b = self._get_stats(model_a), self._get_stats(model_b)
+            change = rating_change(stats_a["rating"], stats_b["rating"], score, self.k_factor)
+            for model, stats, delta, model_score in ((model_a, stats_a, change, score), (model_b, stats_b, -change, 1 - score)):
+                result = "wins" if model_score == 1 else "losses" if model_score == 0 else "draws"
+                for target in (stats, self._pending_changes.setdefault(model, _empty_stats())):
+                    target["rating"] += delta
+                    target[result] += 1
+                    target["votes"] += 1
+            self._pending_votes.append({"model_a": model_a, "model_b": model_b, "score": score, "rating_change": change,
+                                        "created_at": time.time(), **details})
+            pending = len(self._pending_votes)
+            updated = {model_a: dict(stats_a), model_b: dict(stats_b)}
+
+        ELO_VOTES.inc()
+        ELO_PENDING_VOTES.set(pending)
+        if pending >= self.flush_max_votes:
+            self._wake.set()
+        return updated
+
+    def leaderboard(self):
+        """
+        Ranks the models by rating, from the in-memory state.
+
+        Returns:
+            list: The stats of each model with its name, best rated first.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            entries = [{"model": model, **stats} for model, stats in self._stats.items()]
+        return sorted(entries, key=lambda entry: entry["rating"], reverse=True)
+
+    def has_model(self, model):
+        """
+        Whether a model has been rated, including by votes not persisted yet.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            return model in self._stats
+
+    def pending(self):
+        """
+        The number of votes not persisted yet.
+        """
+        return len(self._pending_votes)
+
+    def flush(self):
+        """
+        Persists the queued votes and rating changes in one batch.
+
+        Returns:
+            int: The number of votes persisted.
+        """
+        with self._flush_lock:
+            with self._lock:
+                votes, changes = self._pending_votes, self._pending_changes
+                self._pending_votes, self._pending_changes = [], {}
+            if not votes:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                persisted = self.persist(votes, changes)
+            except Exception:
+                with self._lock:
+                    # Queue the votes again, before the ones cast during the flush
+                    self._pending_votes = votes + self._pending_votes
+                    for model, delta in changes.items():
+                        target = self._pending_changes.setdefault(model, _empty_stats())
+                        for field in STAT_FIELDS:
+                            target[field] += delta[field]
+                raise
+            ELO_FLUSH_SECONDS.observe(time.perf_counter() - start)
+
+            with self._lock:
+                # The persisted stats include the votes of other processes, but not the votes cast during the flush
+                self._stats = {model: dict(stats) for model, stats in persisted.items()}
+                for model, delta in self._pending_changes.items():
+                    target = self._get_stats(model)
+                    for field in STAT_FIELDS:
+                        target[field] += delta[field]
+                pending = len(self._pending_votes)
+            ELO_PENDING_VOTES.set(pending)
+            return len(votes)
+
+    def close(self):
+        """
+        Stops the background flush thread and persists the queued votes.
+        """
+        self._closed = True
+        self._wake.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error persisting the Elo votes, retrying later: {e}")
+
+    def _ensure_loaded(self):
+        """Loads the persisted stats on first use. Must hold the lock."""
+        if self._stats is None:
+            self._stats = {model: dict(stats) for model, stats in self.load().items()}
+
+    def _get_stats(self, model):
+        """Returns the in-memory stats of a model, creating them at the initial rating. Must hold the lock."""
+        if model not in self._stats:
+            self._stats[model] = _empty_stats(self.initial_rating)
+        return self._stats[model]
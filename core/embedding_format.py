@@ -0,0 +1,124 @@
+import io
+import pickle
+import struct
+
+import numpy as np
+
+
+# Binary embedding format, version 1 (little-endian):
+#   magic             4 bytes   b"MEMB"
+#   format version    uint8
+#   dtype code        uint8     0 = float32, 1 = float16
+#   dimension         uint32
+#   segment count     uint32    number of segments averaged into the embedding
+#   hop time          float32   in seconds
+#   model version     uint16 length followed by as many bytes of UTF-8
+#   embedding         dimension values of the given dtype
+MAGIC = b"MEMB"
+FORMAT_VERSION = 1
+DTYPES = {0: np.dtype("<f4"), 1: np.dtype("<f2")}
+DTYPE_CODES = {"float32": 0, "float16": 1}
+_HEADER = struct.Struct("<4sBBIIfH")
+
+# Tag appended to the model version of the embeddings approximated from sampled excerpts of a track
+SAMPLED_VERSION_TAG = "+sampled-"
+
+
+def sampled_model_version(model_version: str, n_excerpts: int, excerpt_seconds: float, selection: str) -> str:
+    """
+    Tags the model version of an embedding approximated from sampled excerpts, so that it is stored and logged as
+    such, e.g. "<version>+sampled-8x3s-even".
+    """
+    return f"{model_version or ''}{SAMPLED_VERSION_TAG}{n_excerpts}x{excerpt_seconds:g}s-{selection}"
+
+
+def is_sampled_model_version(model_version) -> bool:
+    """
+    Whether a model version is the one of an embedding approximated from sampled excerpts.
+    """
+    return SAMPLED_VERSION_TAG in (model_version or "")
+
+
+def encode_embedding(embedding, model_version: str = "", hop_time: float = 1.0, segment_count: int = 0, dtype: str = "float32") -> bytes:
+    """
+    Encodes an embedding in the binary embedding format.
+
+    Args:
+        embedding (array-like): The embedding vector.
+        model_version (str): The version of the model that computed the embedding.
+        hop_time (float): The hop time in seconds used for the extraction.
+        segment_count (int): The number of segments averaged into the embedding.
+        dtype (str): The storage type of the values, "float32" or "float16".
+
+    Returns:
+        bytes: The encoded embedding.
+    """
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    values = np.asarray(embedding).ravel().astype(DTYPES[DTYPE_CODES[dtype]])
+    model_version = (model_version or "").encode("utf-8")
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, DTYPE_CODES[dtype], len(values), segment_count, hop_time, len(model_version))
+    return header + model_version + values.tobytes()
+
+
+def decode_embedding(data: bytes):
+    """
+    Decodes an embedding from the binary embedding format.
+
+    Args:
+        data (bytes): The encoded embedding.
+
+    Returns:
+        tuple: The embedding as a float32 numpy array, and a dictionary of its metadata
+            (format_version, dtype, model_version, hop_time, segment_count).
+
+    Raises:
+        ValueError: If the data is not a supported binary embedding.
+    """
+    if len(data) < _HEADER.size:
+        raise ValueError("Truncated embedding header")
+    magic, version, dtype_code, dimension, segment_count, hop_time, version_length = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a binary embedding")
+    if version != FORMAT_VERSION or dtype_code not in DTYPES:
+        raise ValueError(f"Unsupported embedding format version {version} or dtype {dtype_code}")
+
+    offset = _HEADER.size + version_length
+    dtype = DTYPES[dtype_code]
+    if len(data) != offset + dimension * dtype.itemsize:
+        raise ValueError("Truncated embedding values")
+    embedding = np.frombuffer(data, dtype=dtype, count=dimension, offset=offset).astype(np.float32)
+    metadata = {
+        "format_version": version,
+        "dtype": str(dtype.newbyteorder("=")),
+        "model_version": data[_HEADER.size:offset].decode("utf-8") or None,
+        "hop_time": round(hop_time, 6),
+        "segment_count": segment_count,
+    }
+    return embedding, metadata
+
+
+class _ListUnpickler(pickle.Unpickler):
+    """
+    Unpickler refusing to load any class or function, so that only plain values (lists, floats...) can be read.
+    """
+
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"Refusing to load {module}.{name} from an embedding pickle")
+
+
+def load_legacy_pickle(data: bytes):
+    """
+    Reads an embedding stored in the former format: a pickled list of floats.
+    Pickles referencing any class or function are rejected instead of being executed.
+
+    Args:
+        data (bytes): The content of the .pkl object.
+
+    Returns:
+        np.ndarray: The embedding as a float32 numpy array.
+    """
+    values = _ListUnpickler(io.BytesIO(data)).load()
+    if not isinstance(values, (list, tuple)) or not all(isinstance(x, (int, float)) for x in values):
+        raise ValueError("Embedding pickle does not contain a list of floats")
+    return np.asarray(values, dtype=np.float32)
@@ -0,0 +1,226 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from typing import NamedTuple
+
+import numpy as np
+
+from core.metrics import EMBEDDING_MIRROR_SEARCH_SECONDS
+
+
+METADATA_FILE = "metadata.json"
+
+# Fields of the entities stored in the metadata sidecar, along with their id
+METADATA_FIELDS = ("path", "title", "artist", "album", "top_5_genres")
+
+
+class MirrorHit(NamedTuple):
+    """
+    Search hit of the mirror, with the attributes of a Milvus hit that the routes use.
+    """
+    id: int
+    distance: float
+    entity: SimpleNamespace
+
+
+def write_mirror(directory, batches, dim):
+    """
+    Writes a mirror of an embedding collection: the embeddings as a raw float32 matrix, one row per entity, and the
+    ids and metadata of the entities as a JSON sidecar.
+
+    The matrix file is named after the sync, and the sidecar, which points to it, is replaced last: readers either
+    see the previous mirror or the new one, never a mix of both. The previous matrix is then deleted, processes that
+    mapped it keep reading it until they reload.
+
+    Args:
+        directory (str): The directory of the mirror.
+        batches (iterable): Lists of entities, as dicts with the id, METADATA_FIELDS and the embedding.
+        dim (int): The dimension of the embeddings.
+
+    Returns:
+        int: The number of entities written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    synced_at = datetime.now()
+    matrix_file = f"embeddings-{synced_at:%Y%m%d%H%M%S%f}.f32"
+    metadata = {"dim": dim, "matrix_file": matrix_file, "synced_at": synced_at.isoformat(), "ids": []}
+    metadata.update({field: [] for field in METADATA_FIELDS})
+
+    try:
+        with open(os.path.join(directory, matrix_file), "wb") as matrix:
+            for batch in batches:
+                embeddings = np.asarray([entity["embedding"] for entity in batch], dtype=np.float32).reshape(-1, dim)
+                matrix.write(embeddings.tobytes())
+                for entity in batch:
+                    metadata["ids"].append(entity["id"])
+                    for field in METADATA_FIELDS:
+                        metadata[field].append(entity.get(field))
+        metadata["count"] = len(metadata["ids"])
+
+        previous = read_metadata(directory)
+        temp_file = os.path.join(directory, f"{METADATA_FILE}.tmp")
+        with open(temp_file, "w") as f:
+            json.dump(metadata, f)
+        os.replace(temp_file, os.path.join(directory, METADATA_FILE))
+    except BaseException:
+        os.unlink(os.path.join(directory, matrix_file))
+        raise
+    if previous is not None and previous["matrix_file"] != matrix_file:
+        try:
+            os.unlink(os.path.join(directory, previous["matrix_file"]))
+        except FileNotFoundError:
+            pass
+    return metadata["count"]
+
+
+def read_metadata(directory):
+    """
+    Reads the metadata sidecar of a mirror.
+
+    Returns:
+        dict: The metadata, or None if the directory holds no mirror.
+    """
+    try:
+        with open(os.path.join(directory, METADATA_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class EmbeddingMirror:
+    """
+    Exact similarity search over a local mirror of an embedding collection, written by write_mirror().
+
+    The embedding matrix is memory-mapped, so the page cache is shared by the worker processes and only the pages
+    read are loaded. The norms of the rows are computed once per load. A search scores every row by cosine
+    similarity, a normalized dot product, and selects the top-k rows with argpartition, sorting only those.
+
+    The mirror is reloaded when a sync replaces it, checked at most once every `reload_interval_seconds`.
+
+    Attributes:
+        directory (str): The directory of the mirror.
+        reload_interval_seconds (float): The minimum delay between two checks for a new sync.
+    """
+
+    def __init__(self, directory, reload_interval_seconds=60):
+        self.directory = directory
+        self.reload_interval_seconds = reload_interval_seconds
+
+        # (metadata, matrix, inverse norms, row of each path, row of each id) of the loaded mirror, replaced as a whole
+        self._loaded = None
+        self._last_check = None
+        self._lock = threading.Lock()
+
+    def search(self, embeddings, limit, offset=0, output_fields=None):
+        """
+        Finds the entities most similar to each query embedding.
+
+        Args:
+            embeddings (list): The query embeddings.
+            limit (int): The number of hits returned per query.
+            offset (int): The number of best hits skipped, e.g. 1 to skip the query entity itself.
+            output_fields (list): The fields of the hit entities, METADATA_FIELDS and "embedding", or ["*"] for all.
+
+        Returns:
+            list: For each query, its hits, most similar first, with their cosine similarity as distance.
+        """
+        start = time.perf_counter()
+        _, matrix, inverse_norms, _, _ = loaded = self._get()
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(-1, matrix.shape[1])
+        query_norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(query_norms == 0, 1, query_norms)
+
+        k = min(offset + limit, matrix.shape[0])
+        results = []
+        if k > 0:
+            scores = (matrix @ queries.T).T * inverse_norms
+            for query_scores in scores:
+                top = np.argpartition(-query_scores, k - 1)[:k]
+                top = top[np.argsort(-query_scores[top], kind="stable")][offset:]
+                results.append([self._hit(loaded, row, float(query_scores[row]), output_fields) for row in top])
+        else:
+            results = [[] for _ in queries]
+        EMBEDDING_MIRROR_SEARCH_SECONDS.observe(time.perf_counter() - start)
+        return results
+
+    def query(self, paths=None, ids=None, output_fields=None):
+        """
+        Retrieves entities by path or by id.
+
+        Args:
+            paths (list): The paths of the entities.
+            ids (list): The ids of the entities, if no paths are given.
+            output_fields (list): The fields returned besides the id, METADATA_FIELDS and "embedding", or ["*"].
+
+        Returns:
+            list: The entities found, as dicts, in the order requested.
+        """
+        loaded = self._get()
+        metadata, matrix, _, rows_by_path, rows_by_id = loaded
+        keys, rows_by_key = (paths, rows_by_path) if paths is not None else (ids, rows_by_id)
+        rows = [rows_by_key[key] for key in keys if key in rows_by_key]
+        return [self._entity(loaded, row, output_fields) for row in rows]
+
+    def status(self):
+        """
+        Describes the loaded mirror.
+
+        Returns:
+            dict: The directory, the number of entities and their dimension, and when the mirror was synced.
+        """
+        loaded = self._loaded
+        if loaded is None:
+            metadata = read_metadata(self.directory)
+            return {"directory": self.directory, "loaded": False, "count": metadata["count"] if metadata else None,
+                    "synced_at": metadata["synced_at"] if metadata else None}
+        metadata = loaded[0]
+        return {"directory": self.directory, "loaded": True, "count": metadata["count"], "dim": metadata["dim"],
+                "synced_at": metadata["synced_at"]}
+
+    def _get(self):
+        """Returns the loaded mirror, loading it on first use and reloading it after a new sync."""
+        loaded = self._loaded
+        if loaded is not None and time.monotonic() - self._last_check < self.reload_interval_seconds:
+            return loaded
+        with self._lock:
+            if self._loaded is None or time.monotonic() - self._last_check >= self.reload_interval_seconds:
+                metadata = read_metadata(self.directory)
+                if metadata is None:
+                    raise FileNotFoundError(f"No embedding mirror in {self.directory}, run the sync job first")
+                if self._loaded is None or metadata["matrix_file"] != self._loaded[0]["matrix_file"]:
+                    self._loaded = self._load(metadata)
+                self._last_check = time.monotonic()
+            return self._loaded
+
+    def _load(self, metadata, chunk_rows=65536):
+        path = os.path.join(self.directory, metadata["matrix_file"])
+        if metadata["count"]:
+            matrix = np.memmap(path, dtype=np.float32, mode="r", shape=(metadata["count"], metadata["dim"]))
+        else:
+            matrix = np.zeros((0, metadata["dim"]), dtype=np.float32)
+        norms = np.concatenate([np.linalg.norm(matrix[start:start + chunk_rows], axis=1)
+                                for start in range(0, len(matrix), chunk_rows)] or [np.zeros(0, np.float32)])
+        inverse_norms = np.divide(1, norms, out=np.zeros_like(norms), where=norms > 0)
+        rows_by_path = {path: row for row, path in enumerate(metadata["path"])}
+        rows_by_id = {entity_id: row for row, entity_id in enumerate(metadata["ids"])}
+        return metadata, matrix, inverse_norms, rows_by_path, rows_by_id
+
+    @staticmethod
+    def _entity(loaded, row, output_fields):
+        metadata, matrix = loaded[0], loaded[1]
+        fields = METADATA_FIELDS + ("embedding",) if not output_fields or "*" in output_fields else output_fields
+        entity = {"id": metadata["ids"][row]}
+        for field in fields:
+            if field == "embedding":
+                entity[field] = matrix[row].tolist()
+            elif field in METADATA_FIELDS:
+                entity[field] = metadata[field][row]
+        return entity
+
+    @classmethod
+    def _hit(cls, loaded, row, score, output_fields):
+        entity = cls._entity(loaded, row, output_fields)
+        return MirrorHit(entity["id"], score, SimpleNamespace(**entity))
@@ -1,25 +1,100 @@
+import threading
+from collections import deque
 from pathlib import Path
 import essentia.standard as es
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 from essentia import Pool
 
+from core.audio_decoding import stream_audio_blocks, decoded_pcm, load_mono
+from core.pipeline import iter_prefetched
+
+
+def _frame_starts(n_samples, frame_size, hop_size, valid_frame_threshold_ratio=0):
+    """
+    Computes the start indices of the frames that Essentia's FrameGenerator would produce
+    (with startFromZero=False and lastFrameToEndOfFile=False) on a signal of a given length.
+
+    The first frame is centered on the first sample, a frame is only produced if it holds at least
+    `validFrameThresholdRatio * frame_size` samples (leading zeros included), and the generator stops
+    after the first zero-padded frame whose center lies past the end of the signal.
+
+    Args:
+        n_samples (int): The length of the signal.
+        frame_size (int): The size of a frame in samples.
+        hop_size (int): The hop size in samples between successive frames.
+        valid_frame_threshold_ratio (float): The minimum ratio of valid samples for a frame to be produced.
+
+    Returns:
+        np.ndarray: The (possibly negative) start index of each frame.
+    """
+    if n_samples <= 0:
+        return np.empty(0, dtype=np.int64)
+    first = -((frame_size + 1) // 2)
+    threshold = max(int(valid_frame_threshold_ratio * frame_size + 0.5), 1)
+    # Last frame still holding enough valid samples
+    last_valid = (n_samples - threshold - first) // hop_size
+    # First zero-padded frame centered past the end of the signal, which ends the generator
+    last_centered = -(-(n_samples - frame_size // 2 - first) // hop_size)
+    n_frames = min(last_valid, max(last_centered, 0)) + 1
+    return first + hop_size * np.arange(max(n_frames, 0), dtype=np.int64)
+
+
+def melspectrogram_to_patches(melspectrogram, patch_size, hop_size):
+    """
+    Splits a mel spectrogram into fixed-size patches without copying it.
+
+    Patches are windows into the mel spectrogram. It is only copied, once, when the last patch runs past its end
+    and has to be zero-padded.
+
+    Args:
+        melspectrogram (np.ndarray): The mel spectrogram of shape [frames, melbands].
+        patch_size (int): The number of frames in a patch.
+        hop_size (int): The number of frames between the starts of successive patches.
+
+    Returns:
+        np.ndarray: A read-only view of shape [npatches, patch_size, melbands].
+    """
+    melspectrogram = np.asarray(melspectrogram, dtype=np.float32)
+    npatches = int(np.ceil((melspectrogram.shape[0] - patch_size) / hop_size)) + 1
+    n_frames = (npatches - 1) * hop_size + patch_size
+    if n_frames > melspectrogram.shape[0]:
+        melspectrogram = np.pad(melspectrogram, ((0, n_frames - melspectrogram.shape[0]), (0, 0)))
+    row_stride, band_stride = melspectrogram.strides
+    return as_strided(melspectrogram, shape=(npatches, patch_size, melspectrogram.shape[1]),
+                      strides=(hop_size * row_stride, row_stride, band_stride), writeable=False)
+
 
 class MelSpectrogramOpenL3:
     """
     A class for computing mel spectrograms from audio files using Essentia.
 
+    Two engines produce the same spectrogram. The framewise engine runs Essentia's Windowing, Spectrum and
+    MelBands algorithms on every frame. The batched engine frames blocks of 1-second patches at once with
+    stride tricks, runs a single FFT over the frame matrix and applies the mel filterbank as one matrix
+    multiply. The filterbank and window are probed from the Essentia algorithms themselves, so both engines
+    agree to within float32 rounding: after dB scaling, the batched output stays within 1e-3 dB of the
+    framewise output (see tests/test_openl3.py).
+
     Attributes:
         hop_time (float): The hop time in seconds between successive audio frames.
+        batched (bool): Whether to use the batched engine instead of the framewise one.
+        block_size (int): The number of 1-second patches processed at once by the batched engine.
     """
 
-    def __init__(self, hop_time):
+    def __init__(self, hop_time, batched=True, block_size=32):
         """
         Initializes the MelSpectrogramOpenL3 with specified parameters for audio processing.
 
         Args:
             hop_time (float): The hop time in seconds between successive audio frames.
+            batched (bool): Whether to use the batched engine instead of the framewise one.
+            block_size (int): The number of 1-second patches processed at once by the batched engine.
+                Bounds the size of the intermediate frame matrix (about 1.6 MB per patch).
         """
         self.hop_time = hop_time
+        self.batched = batched
+        self.block_size = block_size
 
         # Audio processing parameters
         self.sr = 48000
@@ -48,31 +123,191 @@ class MelSpectrogramOpenL3:
                              warpingFormula="slaneyMel",
                              weighting="linear")
 
+        # Precomputed operators for the batched engine. MelBands is linear in its input spectrum, so probing it
+        # with the unit vectors yields its exact filterbank. The window is probed without zero-phase rotation,
+        # which only affects the phase of the spectrum.
+        self.window = es.Windowing(size=self.frame_size, normalized=False, zeroPhase=False)(
+            np.ones(self.frame_size, dtype=np.float32))
+        self.mel_filterbank = np.array([self.mb(unit) for unit in np.eye(self.frame_size // 2 + 1, dtype=np.float32)])
+        self.frame_starts = _frame_starts(self.patch_samples, self.frame_size, self.hop_size, 0.5)
+
     def compute(self, audio_file):
         """
         Computes the mel spectrogram for a given audio file.
 
         Args:
-            audio_file (str): The path to the audio file.
+            audio_file (str or PcmFile): The path to the audio file, or already decoded audio.
+
+        Returns:
+            np.ndarray: A numpy array containing the mel spectrogram.
+        """
+        audio = load_mono(audio_file, self.sr)
+        return self.compute_from_audio(audio)
+
+    def compute_from_audio(self, audio):
+        """
+        Computes the mel spectrogram for a mono audio signal sampled at 48 kHz.
+
+        Args:
+            audio (np.ndarray): The audio signal.
+
+        Returns:
+            np.ndarray: A numpy array containing the mel spectrogram.
+        """
+        if self.batched:
+            return self._compute_batched(audio)
+        return self._compute_framewise(audio)
+
+    def iter_compute(self, blocks, window_patches):
+        """
+        Computes the mel spectrogram of a mono 48 kHz audio stream, window by window.
+
+        Only the samples of the current window are held in memory. Concatenated, the yielded windows are identical
+        to the output of compute_from_audio() on the whole signal, since each patch is normalized on its own.
+
+        Args:
+            blocks (iterable): Successive blocks of audio samples.
+            window_patches (int): The number of 1-second patches per window.
+
+        Yields:
+            np.ndarray: The mel spectrogram of the next `window_patches` patches (fewer for the last window).
+        """
+        first_start = -((self.patch_samples + 1) // 2)
+        window_samples = window_patches * self.hop_samples
+
+        # Samples not consumed yet, starting with the zero padding of the first patch
+        pending = [np.zeros(-first_start, dtype=np.float32)]
+        pending_start = first_start
+        n_samples = 0
+        for block in blocks:
+            pending.append(np.asarray(block, dtype=np.float32))
+            n_samples += len(block)
+
+            # Patches lying entirely within the samples received so far are final
+            while n_samples - self.patch_samples - pending_start >= (window_patches - 1) * self.hop_samples:
+                audio = np.concatenate(pending)
+                yield self._patches_to_melspectrogram(self._strided_patches(audio, window_patches))
+                pending = [audio[window_samples:].copy()]
+                pending_start += window_samples
+
+        # Remaining patches, the last ones zero-padded, as decided by the length of the whole signal
+        npatches = len(_frame_starts(n_samples, self.patch_samples, self.hop_samples))
+        remaining = npatches - (pending_start - first_start) // self.hop_samples
+        if remaining > 0:
+            audio = np.concatenate(pending)
+            audio = np.pad(audio, (0, max(0, (remaining - 1) * self.hop_samples + self.patch_samples - len(audio))))
+            for start in range(0, remaining, window_patches):
+                count = min(window_patches, remaining - start)
+                yield self._patches_to_melspectrogram(self._strided_patches(audio[start * self.hop_samples:], count))
+
+    def _compute_framewise(self, audio):
+        """
+        Computes the mel spectrogram frame by frame with Essentia's algorithms.
+
+        Args:
+            audio (np.ndarray): The audio signal.
+
+        Returns:
+            np.ndarray: A numpy array containing the mel spectrogram.
+        """
+        batch = [self._compute_patch_framewise(audio_chunk) for audio_chunk in es.FrameGenerator(
+            audio, frameSize=self.patch_samples, hopSize=self.hop_samples)]
+        return np.vstack(batch)
+
+    def _compute_patch_framewise(self, audio_chunk):
+        """
+        Computes the mel spectrogram of a single 1-second patch frame by frame with Essentia's algorithms.
+
+        Args:
+            audio_chunk (np.ndarray): The audio samples of the patch.
+
+        Returns:
+            np.ndarray: A numpy array containing the mel spectrogram of the patch.
+        """
+        melbands = np.array([self.mb(self.s(self.w(frame))) for frame in es.FrameGenerator(
+            audio_chunk, frameSize=self.frame_size, hopSize=self.hop_size, validFrameThresholdRatio=0.5)])
+
+        # Logarithmic scaling and normalization
+        melbands = 10.0 * np.log10(np.maximum(self.a_min, melbands))
+        melbands -= 10.0 * np.log10(np.maximum(self.a_min, self.db_ref))
+        melbands = np.maximum(melbands, melbands.max() - self.d_range)
+        melbands -= np.max(melbands)
+
+        return melbands.copy()
+
+    def _compute_batched(self, audio):
+        """
+        Computes the mel spectrogram with one FFT and one filterbank product per block of patches.
+
+        Args:
+            audio (np.ndarray): The audio signal.
 
         Returns:
             np.ndarray: A numpy array containing the mel spectrogram.
         """
-        audio = es.MonoLoader(filename=audio_file, sampleRate=self.sr)()
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        patch_starts = _frame_starts(len(audio), self.patch_samples, self.hop_samples)
+
+        # Zero-pad the signal once so that every patch is a plain window into it
+        pad_left = -int(patch_starts[0])
+        pad_right = max(0, int(patch_starts[-1]) + self.patch_samples - len(audio))
+        padded = np.pad(audio, (pad_left, pad_right))
+        return self._patches_to_melspectrogram(self._strided_patches(padded, len(patch_starts)))
+
+    def _strided_patches(self, audio, npatches):
+        """
+        Views a signal as successive 1-second patches, the first one starting at its first sample.
+
+        Args:
+            audio (np.ndarray): The contiguous float32 signal, already zero-padded.
+            npatches (int): The number of patches.
+
+        Returns:
+            np.ndarray: A read-only view of shape [npatches, patch_samples].
+        """
+        return as_strided(audio, shape=(npatches, self.patch_samples),
+                          strides=(self.hop_samples * audio.itemsize, audio.itemsize), writeable=False)
+
+    def _patches_to_melspectrogram(self, patches):
+        """
+        Computes the mel spectrogram of successive 1-second patches.
+
+        Args:
+            patches (np.ndarray): The audio samples of the patches, of shape [npatches, patch_samples].
+
+        Returns:
+            np.ndarray: A numpy array containing the mel spectrogram of the patches, one after the other.
+        """
+        if not self.batched:
+            return np.vstack([self._compute_patch_framewise(patch) for patch in patches])
+
+        frames_per_patch = len(self.frame_starts)
+        frame_offset = -int(self.frame_starts[0])
+        padded_patch_size = max(frame_offset + self.patch_samples, int(self.frame_starts[-1]) + frame_offset + self.frame_size)
+
+        melspectrogram = np.empty((len(patches) * frames_per_patch, self.n_mels), dtype=np.float32)
+        for start in range(0, len(patches), self.block_size):
+            block = patches[start:start + self.block_size]
 
-        batch = []
-        for audio_chunk in es.FrameGenerator(audio, frameSize=self.patch_samples, hopSize=self.hop_samples):
-            melbands = np.array([self.mb(self.s(self.w(frame))) for frame in es.FrameGenerator(
-                audio_chunk, frameSize=self.frame_size, hopSize=self.hop_size, validFrameThresholdRatio=0.5)])
-            
-            # Logarithmic scaling and normalization
+            # Each patch is framed on its own, zero-padded at its edges like the framewise engine does
+            padded_block = np.zeros((len(block), padded_patch_size), dtype=np.float32)
+            padded_block[:, frame_offset:frame_offset + self.patch_samples] = block
+            frames = as_strided(padded_block, shape=(len(block), frames_per_patch, self.frame_size),
+                                strides=(padded_block.strides[0], self.hop_size * padded_block.itemsize, padded_block.itemsize),
+                                writeable=False)
+
+            spectrum = np.abs(np.fft.rfft(frames * self.window, axis=-1)).astype(np.float32)
+            melbands = spectrum @ self.mel_filterbank
+
+            # Logarithmic scaling and normalization, per patch
             melbands = 10.0 * np.log10(np.maximum(self.a_min, melbands))
             melbands -= 10.0 * np.log10(np.maximum(self.a_min, self.db_ref))
-            melbands = np.maximum(melbands, melbands.max() - self.d_range)
-            melbands -= np.max(melbands)
+            melbands = np.maximum(melbands, melbands.max(axis=(1, 2), keepdims=True) - self.d_range)
+            melbands -= melbands.max(axis=(1, 2), keepdims=True)
 
-            batch.append(melbands.copy())
-        return np.vstack(batch)
+            rows = slice(start * frames_per_patch, (start + len(block)) * frames_per_patch)
+            melspectrogram[rows] = melbands.reshape(-1, self.n_mels)
+        return melspectrogram
 
 
 class EmbeddingsOpenL3:
@@ -86,7 +321,8 @@ class EmbeddingsOpenL3:
         melbands (int): The number of mel bands to use.
     """
 
-    def __init__(self, graph_path, hop_time=1, batch_size=60, melbands=128):
+    def __init__(self, graph_path, hop_time=1, batch_size=60, melbands=128, batched_mel=True, scheduler=None,
+                 pipeline_depth=2, decoder=None):
         """
         Initializes the EmbeddingsOpenL3 with specified parameters for embeddings extraction.
 
@@ -95,9 +331,25 @@ class EmbeddingsOpenL3:
             hop_time (float): The hop time in seconds for the embeddings extraction.
             batch_size (int): The size of batches for processing.
             melbands (int): The number of mel bands to use.
+            batched_mel (bool): Whether to compute the mel spectrogram with the batched engine.
+            scheduler (MicroBatchScheduler): An optional scheduler pooling the patches of concurrent extractions
+                into shared model batches. If None, each extraction runs its own batches.
+            pipeline_depth (int): The number of windows decoded and turned into mel patches ahead of the model by a
+                worker thread in streaming mode, or 0 to run all the stages in sequence.
+            decoder (DecoderProcessPool): An optional pool of processes decoding the audio in streaming mode while
+                the first windows are processed. If None, the whole track is decoded before its first window.
+
+        Raises:
+            ValueError: If the batches of the scheduler cannot hold `batch_size` patches.
         """
+        if scheduler is not None and scheduler.max_batch_size < batch_size:
+            raise ValueError(f"The scheduler batches of at most {scheduler.max_batch_size} patches cannot hold the "
+                             f"{batch_size}-patch batches of the extraction")
         self.hop_time = hop_time
         self.batch_size = batch_size
+        self.scheduler = scheduler
+        self.pipeline_depth = pipeline_depth
+        self.decoder = decoder
 
         self.graph_path = Path(graph_path)
 
@@ -114,20 +366,22 @@ class EmbeddingsOpenL3:
         self.output_layer = "embeddings"
 
         # Mel spectrogram extractor
-        self.mel_extractor = MelSpectrogramOpenL3(hop_time=self.hop_time)
+        self.mel_extractor = MelSpectrogramOpenL3(hop_time=self.hop_time, batched=batched_mel)
 
         # TensorFlow model for embeddings extraction
         self.model = es.TensorflowPredict(graphFilename=str(self.graph_path),
                                           inputs=[self.input_layer],
                                           outputs=[self.output_layer],
                                           squeeze=self.squeeze)
+        # TensorflowPredict is not thread-safe, while a single model is shared by the request threads of a worker
+        self.model_lock = threading.Lock()
 
     def compute(self, audio_file):
         """
         Extracts embeddings from an audio file.
 
         Args:
-            audio_file (str): The path to the audio file.
+            audio_file (str or PcmFile): The path to the audio file, or already decoded audio.
 
         Returns:
             np.ndarray: A numpy array containing the extracted embeddings.
@@ -138,42 +392,221 @@ class EmbeddingsOpenL3:
 
         batch = self.__melspectrogram_to_batch(mel_spectrogram, hop_size_samples)
 
-        pool = Pool()
-        embeddings = []
-        nbatches = int(np.ceil(batch.shape[0] / self.batch_size))
-        for i in range(nbatches):
-            start = i * self.batch_size
-            end = min(batch.shape[0], (i + 1) * self.batch_size)
-            pool.set(self.input_layer, batch[start:end])
-            out_pool = self.model(pool)
-            embeddings.append(out_pool[self.output_layer].squeeze())
+        return self._predict(batch)
+
+    def compute_mean(self, audio_file, window_seconds=None, progress=None):
+        """
+        Extracts the mean embedding of an audio file.
+
+        In streaming mode (`window_seconds` set), the audio is decoded, turned into mel patches and run through the
+        model one window at a time, keeping only a running sum and count of the embeddings. Peak memory is then
+        bounded by the window size instead of the track length. The window is rounded up to a whole number of model
+        batches and the embeddings are summed in the same order as numpy does, so the result is identical to
+        `compute(audio_file).mean(axis=0)`. With a scheduler, patches may share model batches with other extractions,
+        which can only change the result at the float rounding level. Mel extraction runs in a worker thread, up to
+        `pipeline_depth` windows ahead of the model, so that it overlaps with inference while memory stays bounded.
+        Without a decoder, the whole track is decoded before its first window; with one, it is decoded in another
+        process and each window is processed as soon as it is decoded.
+
+        Args:
+            audio_file (str or PcmFile): The path to the audio file, or already decoded audio.
+            window_seconds (float): The length of audio processed at once, or None to process the whole track at once.
+            progress (callable): An optional callback called with the number of patches processed and the total number
+                of patches (0 until the track is fully decoded), after each window.
+
+        Returns:
+            np.ndarray: The mean of the extracted embeddings.
+        """
+        if not window_seconds:
+            vector = self.compute(audio_file)
+            if progress is not None:
+                progress(len(vector), len(vector))
+            return vector.mean(axis=0)
+
+        window_patches = self.batch_size * max(1, int(np.ceil(window_seconds / self.hop_time / self.batch_size)))
+        block_samples = window_patches * self.mel_extractor.hop_samples
+        npatches = 0
+
+        def on_decoded(n_samples):
+            nonlocal npatches
+            npatches = len(_frame_starts(n_samples, self.mel_extractor.patch_samples, self.mel_extractor.hop_samples))
+
+        blocks = stream_audio_blocks(audio_file, self.mel_extractor.sr, block_samples, on_decoded=on_decoded,
+                                     decoder=self.decoder)
+        batches = (np.ascontiguousarray(self.__melspectrogram_to_batch(mel_spectrogram, self.x_size))
+                   for mel_spectrogram in self.mel_extractor.iter_compute(blocks, window_patches))
+        if self.pipeline_depth:
+            # Decode and compute the mel patches of the next windows while the model runs on the current one
+            batches = iter_prefetched(batches, self.pipeline_depth, name="openl3-pipeline")
+
+        total = None
+        count = 0
+        for batch in batches:
+            embeddings = self._predict(batch)
+            if total is None:
+                total = np.zeros(embeddings.shape[1], dtype=embeddings.dtype)
+            # Row by row, like the reduction over the first axis of np.mean
+            for embedding in embeddings:
+                total += embedding
+            count += len(embeddings)
+            if progress is not None:
+                progress(count, npatches)
+
+        if not count:
+            raise ValueError(f"No audio could be decoded from {audio_file}")
+        return total / count
+
+    def compute_sampled_mean(self, audio_file, n_excerpts=8, excerpt_seconds=3, selection="even", progress=None):
+        """
+        Approximates the mean embedding of an audio file from a few excerpts of the track.
+
+        Only the patches of `n_excerpts` excerpts of `excerpt_seconds` each are turned into mel spectrograms and run
+        through the model, so the cost of the extraction depends on the number of excerpts instead of the track length.
+        The excerpts are laid on the patch grid of the whole track, so each sampled embedding is exactly the one of the
+        full extraction and the result is the mean of a subset of the full-track embeddings. Excerpts are either evenly
+        spaced ("even"), or the most energetic non-overlapping excerpts ("energy"). More and longer excerpts trade speed
+        for accuracy; when they cover the whole track, all patches are used. See benchmarks/openl3_sampling_eval.py.
+
+        Args:
+            audio_file (str or PcmFile): The path to the audio file, or already decoded audio.
+            n_excerpts (int): The number of excerpts.
+            excerpt_seconds (float): The length of each excerpt in seconds.
+            selection (str): How the excerpts are placed, "even" or "energy".
+            progress (callable): An optional callback called with the number of patches processed and the total number
+                of patches sampled, once done.
+
+        Returns:
+            np.ndarray: The mean of the embeddings of the sampled patches.
+        """
+        if selection not in ("even", "energy"):
+            raise ValueError(f"Unsupported excerpt selection: {selection}")
+
+        with decoded_pcm(audio_file, self.mel_extractor.sr) as audio:
+            npatches = len(_frame_starts(len(audio), self.mel_extractor.patch_samples, self.mel_extractor.hop_samples))
+            if not npatches:
+                raise ValueError(f"No audio could be decoded from {audio_file}")
+            excerpt_patches = max(1, int(round(excerpt_seconds / self.hop_time)))
+
+            if n_excerpts * excerpt_patches >= npatches:
+                excerpts = [(0, npatches)]
+            elif selection == "even":
+                # Excerpts centered in as many equal sections of the track
+                excerpts = [(int(round((i + 0.5) * npatches / n_excerpts - excerpt_patches / 2)), excerpt_patches)
+                            for i in range(n_excerpts)]
+            else:
+                excerpts = self._most_energetic_excerpts(audio, npatches, n_excerpts, excerpt_patches)
+
+            mel_spectrogram = np.vstack([self._excerpt_melspectrogram(audio, start, count) for start, count in excerpts])
+
+        embeddings = self._predict(self.__melspectrogram_to_batch(mel_spectrogram, self.x_size))
+        if progress is not None:
+            progress(len(embeddings), len(embeddings))
+        return embeddings.mean(axis=0)
+
+    def _most_energetic_excerpts(self, audio, npatches, n_excerpts, excerpt_patches):
+        """
+        Selects the most energetic excerpts among the non-overlapping excerpts of the track.
+
+        Args:
+            audio (np.ndarray): The (memory-mapped) audio signal.
+            npatches (int): The number of patches of the whole track.
+            n_excerpts (int): The number of excerpts to select.
+            excerpt_patches (int): The number of patches per excerpt.
+
+        Returns:
+            list: The (first patch, number of patches) of each selected excerpt, in track order.
+        """
+        hop_samples = self.mel_extractor.hop_samples
+        # Energy of each hop of the signal, read a few thousand hops at a time
+        hop_energies = np.zeros(npatches, dtype=np.float64)
+        for start in range(0, len(audio), 4096 * hop_samples):
+            block = np.asarray(audio[start:start + 4096 * hop_samples], dtype=np.float64)
+            block = np.pad(block, (0, -len(block) % hop_samples)).reshape(-1, hop_samples)
+            energies = np.einsum("ij,ij->i", block, block)
+            first = start // hop_samples
+            count = min(len(energies), npatches - first)
+            if count > 0:
+                hop_energies[first:first + count] = energies[:count]
+
+        n_candidates = npatches // excerpt_patches
+        candidate_energies = hop_energies[:n_candidates * excerpt_patches].reshape(n_candidates, excerpt_patches).sum(axis=1)
+        selected = np.sort(np.argsort(-candidate_energies, kind="stable")[:n_excerpts])
+        return [(int(candidate) * excerpt_patches, excerpt_patches) for candidate in selected]
+
+    def _excerpt_melspectrogram(self, audio, first_patch, npatches):
+        """
+        Computes the mel spectrogram of consecutive patches of the whole-track patch grid.
+
+        Args:
+            audio (np.ndarray): The (memory-mapped) audio signal.
+            first_patch (int): The index of the first patch in the whole track.
+            npatches (int): The number of patches.
+
+        Returns:
+            np.ndarray: The mel spectrogram of the patches, identical to their rows in the whole-track mel spectrogram.
+        """
+        extractor = self.mel_extractor
+        start = -((extractor.patch_samples + 1) // 2) + first_patch * extractor.hop_samples
+        stop = start + (npatches - 1) * extractor.hop_samples + extractor.patch_samples
+        excerpt = np.zeros(stop - start, dtype=np.float32)
+        excerpt[max(0, -start):min(stop, len(audio)) - start] = audio[max(0, start):min(stop, len(audio))]
+        return extractor._patches_to_melspectrogram(extractor._strided_patches(excerpt, npatches))
+
+    def _predict(self, batch):
+        """
+        Runs the model on a batch of mel spectrogram patches, `batch_size` patches at a time.
+
+        Args:
+            batch (np.ndarray): A batch of mel spectrogram patches of shape [npatches, melbands, x_size, 1].
+
+        Returns:
+            np.ndarray: A numpy array containing one embedding per patch.
+        """
+        # Slices are made contiguous one at a time, when they are fed to the model
+        slices = (np.ascontiguousarray(batch[start:start + self.batch_size])
+                  for start in range(0, batch.shape[0], self.batch_size))
+        if self.scheduler is None:
+            return np.vstack([self._run_model(patches) for patches in slices])
 
+        # Keep two slices in flight, so the next one is queued while the current one runs
+        embeddings = []
+        in_flight = deque()
+        for patches in slices:
+            in_flight.append(self.scheduler.submit(self._run_model, patches))
+            if len(in_flight) == 2:
+                embeddings.append(in_flight.popleft().result())
+        embeddings.extend(future.result() for future in in_flight)
         return np.vstack(embeddings)
 
+    def _run_model(self, batch):
+        """
+        Runs the TensorFlow model on a contiguous batch of mel spectrogram patches.
+
+        Args:
+            batch (np.ndarray): A batch of mel spectrogram patches of shape [npatches, melbands, x_size, 1].
+
+        Returns:
+            np.ndarray: A numpy array containing one embedding per patch.
+        """
+        pool = Pool()
+        pool.set(self.input_layer, batch)
+        with self.model_lock:
+            out_pool = self.model(pool)
+        return out_pool[self.output_layer].reshape(len(batch), -1)
+
     def __melspectrogram_to_batch(self, melspectrogram, hop_time):
         """
-        Converts a mel spectrogram into a batch of fixed-size patches.
+        Converts a mel spectrogram into a batch of fixed-size patches, laid out as expected by the TensorFlow model.
+
+        The batch is a strided view into the mel spectrogram (padded once if the last patch is partial), with the
+        tensor transposition folded into its strides. Slices of it are made contiguous one model batch at a time.
 
         Args:
             melspectrogram (np.ndarray): The mel spectrogram.
             hop_time (int): The hop time in samples for creating patches.
 
         Returns:
-            np.ndarray: A batch of mel spectrogram patches.
-        """
-        npatches = int(np.ceil((melspectrogram.shape[0] - self.x_size) / hop_time) + 1)
-        batch = np.zeros([npatches, self.x_size, self.y_size], dtype="float32")
-        for i in range(npatches):
-            last_frame = min(i * hop_time + self.x_size, melspectrogram.shape[0])
-            first_frame = i * hop_time
-            data_size = last_frame - first_frame
-
-            if data_size <= 0:
-                batch = np.delete(batch, i, axis=0)
-                break
-            else:
-                batch[i, :data_size] = melspectrogram[first_frame:last_frame]
-
-        batch = np.expand_dims(batch, 1)
-        batch = es.TensorTranspose(permutation=self.permutation)(batch)
-        return batch
+            np.ndarray: A batch of mel spectrogram patches of shape [npatches, melbands, x_size, 1].
+        """
+        batch = melspectrogram_to_patches(melspectrogram, self.x_size, hop_time)
+        return np.expand_dims(batch, 1).transpose(self.permutation)
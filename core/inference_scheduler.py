@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from core.metrics import SCHEDULER_QUEUE_DEPTH, SCHEDULER_BATCH_FILL_RATIO, SCHEDULER_WAIT_SECONDS
+
+
+class _Request:
+    def __init__(self, predict, batch):
+        self.predict = predict
+        self.batch = batch
+        self.future = Future()
+        self.submitted_at = time.monotonic()
+
+
+class MicroBatchScheduler:
+    """
+    Pools the inference requests of concurrent callers into batches run by a single worker thread.
+
+    A batch is started as soon as it is full, or when its oldest request has waited `max_wait_ms`. Requests are
+    never split across batches, and only requests for the same predict function are batched together, so a model
+    swapped in while requests for the previous one are queued is handled transparently. The outputs of each batch
+    are scattered back to the future of each request.
+
+    Attributes:
+        name (str): The name of the scheduler, used as the label of its Prometheus metrics.
+        max_batch_size (int): The maximum number of items in a batch.
+        max_wait_ms (float): The maximum time a request waits for its batch to fill up.
+    """
+
+    def __init__(self, name, max_batch_size=60, max_wait_ms=20):
+        """
+        Initializes the MicroBatchScheduler. Its worker thread is started on the first submission.
+
+        Args:
+            name (str): The name of the scheduler, used as the label of its Prometheus metrics.
+            max_batch_size (int): The maximum number of items in a batch.
+            max_wait_ms (float): The maximum time a request waits for its batch to fill up.
+        """
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self._pending = deque()
+        self._pending_items = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def submit(self, predict, batch):
+        """
+        Queues a batch of items for inference.
+
+        Args:
+            predict (callable): The function running the model on a batch, returning one output per item.
+            batch (np.ndarray): The items to run inference on, at most `max_batch_size` of them.
+
+        Returns:
+            Future: A future resolved with the outputs of the items of `batch`.
+        """
+        if len(batch) > self.max_batch_size:
+            raise ValueError(f"Cannot submit {len(batch)} items to a scheduler with a maximum batch size of {self.max_batch_size}")
+
+        request = _Request(predict, batch)
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"{self.name}-scheduler", daemon=True)
+                self._thread.start()
+            self._pending.append(request)
+            self._pending_items += len(batch)
+            SCHEDULER_QUEUE_DEPTH.labels(self.name).set(self._pending_items)
+            self._condition.notify()
+        return request.future
+
+    def _run(self):
+        while True:
+            requests = self._next_batch()
+            self._run_batch(requests)
+
+    def _next_batch(self):
+        """
+        Waits for the oldest request's batch to be full or for its maximum wait time, then dequeues the batch.
+
+        Returns:
+            list: The requests of the batch, in submission order.
+        """
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+
+            first = self._pending[0]
+            deadline = first.submitted_at + self.max_wait_ms / 1000
+            while self._batchable_items(first.predict) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            requests, size, kept = [], 0, deque()
+            for request in self._pending:
+                if request.predict == first.predict and size + len(request.batch) <= self.max_batch_size:
+                    requests.append(request)
+                    size += len(request.batch)
+                else:
+                    kept.append(request)
+            self._pending = kept
+            self._pending_items -= size
+            SCHEDULER_QUEUE_DEPTH.labels(self.name).set(self._pending_items)
+        return requests
+
+    def _batchable_items(self, predict):
+        return sum(len(request.batch) for request in self._pending if request.predict == predict)
+
+    def _run_batch(self, requests):
+        """
+        Runs one batch and resolves the future of each of its requests.
+
+        Args:
+            requests (list): The requests of the batch.
+        """
+        started_at = time.monotonic()
+        sizes = [len(request.batch) for request in requests]
+        for request in requests:
+            SCHEDULER_WAIT_SECONDS.labels(self.name).observe(started_at - request.submitted_at)
+        SCHEDULER_BATCH_FILL_RATIO.labels(self.name).observe(sum(sizes) / self.max_batch_size)
+
+        try:
+            outputs = requests[0].predict(np.concatenate([request.batch for request in requests]))
+            for request, output in zip(requests, np.split(outputs, np.cumsum(sizes)[:-1])):
+                request.future.set_result(output)
+        except Exception as e:
+            for request in requests:
+                if not request.future.done():
+                    request.future.set_exception(e)
@@ -0,0 +1,234 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+from core.metrics import JOB_QUEUE_LENGTH, JOB_STAGE_SECONDS
+
+
+class JobQueueFullError(Exception):
+    """
+    Raised when a job is submitted to a queue that already holds its maximum number of queued jobs.
+    """
+
+
+class Job:
+    """
+    A unit of background work, along with its state, progress and per-stage timings.
+
+    Attributes:
+        id (str): The unique identifier of the job.
+        key (str): The deduplication key of the job. Submissions sharing a key collapse into one job.
+        state (str): One of "queued", "running", "done" or "failed".
+        stage (str): The name of the stage being run, if any.
+        progress (float): The progress of the job, between 0 and 1.
+        timings (dict): The duration in seconds of each completed stage.
+        result: The result of the job, once done.
+        error (str): The error message, if the job failed.
+        revision (int): Incremented on every change, so that watchers can detect updates.
+    """
+
+    def __init__(self, queue_name, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.queue_name = queue_name
+        self.state = "queued"
+        self.stage = None
+        self.progress = 0.0
+        self.timings = {}
+        self.result = None
+        self.error = None
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.revision = 0
+
+    @property
+    def finished(self):
+        return self.state in ("done", "failed")
+
+    @contextmanager
+    def run_stage(self, name):
+        """
+        Context manager recording the duration of a stage of the job.
+
+        Args:
+            name (str): The name of the stage.
+        """
+        self.stage = name
+        self.revision += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - start
+            self.timings[name] = round(duration, 4)
+            JOB_STAGE_SECONDS.labels(self.queue_name, name).observe(duration)
+            self.revision += 1
+
+    def set_progress(self, done, total):
+        """
+        Updates the progress of the job.
+
+        Args:
+            done (int): The number of units of work done.
+            total (int): The total number of units of work.
+        """
+        self.progress = round(min(done / total, 1.0), 4) if total else 0.0
+        self.revision += 1
+
+    def to_dict(self):
+        """
+        Describes the job.
+
+        Returns:
+            dict: The identifier, state, stage, progress, timings, result and error of the job.
+        """
+        return {
+            "job_id": self.id,
+            "key": self.key,
+            "state": self.state,
+            "stage": self.stage,
+            "progress": self.progress,
+            "timings": self.timings,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class LocalJobQueue:
+    """
+    In-process job queue backend, running jobs on a bounded pool of worker threads.
+
+    It needs no external service, but its jobs only live in the memory of the worker process that received them.
+    Submissions whose key matches a queued, running or successful job return that job instead of creating a new
+    one. Finished jobs are forgotten after `ttl_seconds`.
+
+    Attributes:
+        name (str): The name of the queue, used as the label of its Prometheus metrics.
+        max_workers (int): The number of jobs run concurrently.
+        max_queued (int): The maximum number of jobs waiting for a worker.
+        ttl_seconds (float): How long finished jobs are kept.
+    """
+
+    def __init__(self, name, max_workers=2, max_queued=100, ttl_seconds=3600):
+        """
+        Initializes the LocalJobQueue.
+
+        Args:
+            name (str): The name of the queue, used as the label of its Prometheus metrics.
+            max_workers (int): The number of jobs run concurrently.
+            max_queued (int): The maximum number of jobs waiting for a worker.
+            ttl_seconds (float): How long finished jobs are kept.
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.ttl_seconds = ttl_seconds
+
+        self._jobs = {}
+        self._jobs_by_key = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-job")
+
+    def submit(self, key, fn, *args):
+        """
+        Submits a job, unless a job with the same key is queued, running or done.
+
+        Args:
+            key (str): The deduplication key of the job.
+            fn (callable): The function running the job. It is called with the job followed by `args`,
+                and its return value becomes the result of the job.
+            *args: The arguments of `fn`.
+
+        Returns:
+            tuple: The job and whether it was created by this submission.
+
+        Raises:
+            JobQueueFullError: If the queue already holds `max_queued` jobs waiting for a worker.
+        """
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(self._jobs_by_key.get(key))
+            if job is not None and job.state != "failed":
+                return job, False
+            if self._queue_length() >= self.max_queued:
+                raise JobQueueFullError(f"The {self.name} queue is full ({self.max_queued} jobs waiting)")
+
+            job = Job(self.name, key)
+            self._jobs[job.id] = job
+            self._jobs_by_key[key] = job.id
+            JOB_QUEUE_LENGTH.labels(self.name).set(self._queue_length())
+        self._executor.submit(self._run, job, fn, args)
+        return job, True
+
+    def get(self, job_id):
+        """
+        Retrieves a job by its identifier.
+
+        Args:
+            job_id (str): The identifier of the job.
+
+        Returns:
+            Job or None: The job, or None if it does not exist or has expired.
+        """
+        return self._jobs.get(job_id)
+
+    def stats(self):
+        """
+        Describes the state of the queue.
+
+        Returns:
+            dict: The number of queued, running and finished jobs, and the mean duration of each stage.
+        """
+        with self._lock:
+            jobs = list(self._jobs.values())
+        durations = {}
+        for job in jobs:
+            for stage, duration in job.timings.items():
+                durations.setdefault(stage, []).append(duration)
+        return {
+            "backend": "local",
+            "queued": sum(job.state == "queued" for job in jobs),
+            "running": sum(job.state == "running" for job in jobs),
+            "finished": sum(job.finished for job in jobs),
+            "max_workers": self.max_workers,
+            "mean_stage_seconds": {stage: round(sum(values) / len(values), 4) for stage, values in durations.items()},
+        }
+
+    def _run(self, job, fn, args):
+        job.state = "running"
+        job.started_at = datetime.now()
+        job.revision += 1
+        JOB_QUEUE_LENGTH.labels(self.name).set(self._queue_length())
+        try:
+            job.result = fn(job, *args)
+            job.progress = 1.0
+            job.state = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.state = "failed"
+        finally:
+            job.stage = None
+            job.finished_at = datetime.now()
+            job.revision += 1
+
+    def _queue_length(self):
+        return sum(job.state == "queued" for job in self._jobs.values())
+
+    def _prune(self):
+        """
+        Forgets the jobs finished for more than `ttl_seconds`. Must hold the lock.
+        """
+        now = datetime.now()
+        expired = [job for job in self._jobs.values()
+                   if job.finished and (now - job.finished_at).total_seconds() > self.ttl_seconds]
+        for job in expired:
+            del self._jobs[job.id]
+            if self._jobs_by_key.get(job.key) == job.id:
+                del self._jobs_by_key[job.key]
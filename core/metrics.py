@@ -0,0 +1,163 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+
+# Prometheus metrics exported on /metrics alongside the Instrumentator HTTP metrics.
+# Metrics shared by several components are labelled with the name of the component.
+
+# Process-resident models (core/model_registry.py)
+MODEL_REGISTRY_GET_SECONDS = Histogram(
+    "model_registry_get_seconds",
+    "Time to get the active model: cold calls load a model, warm hits reuse the resident one.",
+    ["model", "result"],
+    buckets=(0.0001, 0.001, 0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+MODEL_REGISTRY_LOAD_SECONDS = Histogram(
+    "model_registry_load_seconds",
+    "Duration of the model loads (download and deserialization).",
+    ["model"],
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+)
+MODEL_REGISTRY_VERSION = Gauge(
+    "model_registry_version",
+    "Version of the model active in this worker (always 1, the version is in the labels).",
+    ["model", "version"],
+)
+
+# Micro-batching inference schedulers (core/inference_scheduler.py)
+SCHEDULER_QUEUE_DEPTH = Gauge(
+    "inference_scheduler_queue_depth",
+    "Number of items waiting to be batched by the inference scheduler.",
+    ["scheduler"],
+)
+SCHEDULER_BATCH_FILL_RATIO = Histogram(
+    "inference_scheduler_batch_fill_ratio",
+    "Size of the batches run by the inference scheduler, relative to the maximum batch size.",
+    ["scheduler"],
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0),
+)
+SCHEDULER_WAIT_SECONDS = Histogram(
+    "inference_scheduler_wait_seconds",
+    "Time spent by a request in the inference scheduler queue before its batch starts.",
+    ["scheduler"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+# Background job queues (core/jobs.py)
+JOB_QUEUE_LENGTH = Gauge(
+    "job_queue_length",
+    "Number of jobs waiting for a worker.",
+    ["queue"],
+)
+JOB_STAGE_SECONDS = Histogram(
+    "job_stage_seconds",
+    "Duration of each stage of the background jobs.",
+    ["queue", "stage"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+
+# Content-hash deduplication of the embeddings (services/content_index.py)
+EMBEDDING_DEDUP_LOOKUPS = Counter(
+    "embedding_dedup_lookups_total",
+    "Embedding lookups by content hash, by result (upload or library hit, miss).",
+    ["result"],
+)
+EMBEDDING_DEDUP_SAVED_SECONDS = Counter(
+    "embedding_dedup_saved_seconds_total",
+    "Estimated OpenL3 extraction time saved by reusing the embeddings of identical audio.",
+)
+
+# Partial reads of the audio objects (services/minio.py)
+AUDIO_OBJECT_BYTES_READ = Counter(
+    "audio_object_bytes_read_total",
+    "Bytes of audio objects read from MinIO to decode time windows, by mode (range requests or full download).",
+    ["mode"],
+)
+
+# Decoded audio cache (core/pcm_cache.py)
+PCM_CACHE_LOOKUPS = Counter(
+    "pcm_cache_lookups_total",
+    "Lookups of decoded audio, by result (hit, resample of a cached native decode, miss).",
+    ["result"],
+)
+PCM_CACHE_BYTES = Gauge(
+    "pcm_cache_bytes",
+    "Total size of the decoded audio cache files.",
+)
+PCM_CACHE_EVICTIONS = Counter(
+    "pcm_cache_evictions_total",
+    "Decoded audio cache files evicted to stay within the size cap.",
+)
+
+# Elo ratings of the compared models (core/elo.py)
+ELO_VOTES = Counter(
+    "elo_votes_total",
+    "Votes between models recorded by the Elo store.",
+)
+ELO_PENDING_VOTES = Gauge(
+    "elo_pending_votes",
+    "Votes applied to the in-memory Elo ratings but not persisted yet.",
+)
+ELO_FLUSH_SECONDS = Histogram(
+    "elo_flush_seconds",
+    "Duration of the batched writes of the Elo votes and ratings.",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+# Precomputed MusicNet genres of the catalog (services/music_net_catalog.py)
+MUSIC_NET_PRECOMPUTED_LOOKUPS = Counter(
+    "music_net_precomputed_lookups_total",
+    "Lookups of catalog tracks in the precomputed MusicNet genres, by result (hit or miss, which runs inference).",
+    ["result"],
+)
+
+# Milvus connection and collection handles (core/milvus_pool.py)
+MILVUS_OPERATION_SECONDS = Histogram(
+    "milvus_operation_seconds",
+    "Duration of the Milvus collection operations, by collection, operation and result (ok, retried or error).",
+    ["collection", "operation", "result"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+MILVUS_RECONNECTS = Counter(
+    "milvus_reconnects_total",
+    "Reconnections to Milvus after a failed health check.",
+)
+MILVUS_CONNECTED = Gauge(
+    "milvus_connected",
+    "Whether the Milvus connection of the worker is open and passed its last health check.",
+)
+
+# Local embedding mirror and similarity search backends (core/embedding_mirror.py, services/similarity.py)
+EMBEDDING_MIRROR_SEARCH_SECONDS = Histogram(
+    "embedding_mirror_search_seconds",
+    "Duration of the exact similarity searches over the local embedding mirror.",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+SIMILARITY_BACKEND_REQUESTS = Counter(
+    "similarity_backend_requests_total",
+    "Embedding lookups and similarity searches, by backend that served them (milvus, local or fallback to local).",
+    ["backend", "operation"],
+)
+
+# Query result caches (core/result_cache.py)
+RESULT_CACHE_LOOKUPS = Counter(
+    "result_cache_lookups_total",
+    "Result cache lookups, by cache and result (hit or miss).",
+    ["cache", "result"],
+)
+RESULT_CACHE_ENTRIES = Gauge(
+    "result_cache_entries",
+    "Number of results held by the cache.",
+    ["cache"],
+)
+RESULT_CACHE_INVALIDATIONS = Counter(
+    "result_cache_invalidations_total",
+    "Times the cache was emptied because the version of its source changed.",
+    ["cache"],
+)
+
+# Path to Milvus id index (services/milvus_ids.py)
+MILVUS_PATH_ID_LOOKUPS = Counter(
+    "milvus_path_id_lookups_total",
+    "Paths resolved to Milvus primary keys, by collection and result (hit, or miss filtered by path instead).",
+    ["collection", "result"],
+)
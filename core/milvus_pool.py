@@ -0,0 +1,209 @@
+import threading
+import time
+from datetime import datetime
+
+from pymilvus import Collection, connections, utility
+
+from core.metrics import MILVUS_CONNECTED, MILVUS_OPERATION_SECONDS, MILVUS_RECONNECTS
+
+
+# Collection methods timed by the handles, and those retried once after a reconnection because they are idempotent
+TIMED_OPERATIONS = ("query", "search", "insert", "upsert", "delete", "flush", "load")
+RETRIED_OPERATIONS = ("query", "search", "upsert", "delete", "load")
+
+
+class MilvusPool:
+    """
+    Keeps a single connection to Milvus per worker process and caches the Collection handles by name, instead of
+    connecting and describing the collection on every request.
+
+    The connection is opened lazily, on the first handle requested. It is health-checked with a lightweight request
+    at most once every `health_check_interval_seconds`, and whenever an operation fails: if the check fails too, the
+    connection is reopened and the handles are rebuilt, and idempotent operations are retried once. An operation that
+    fails on a healthy connection (e.g. an invalid expression) is not retried.
+
+    The latency of each operation is exported by collection, operation and result.
+
+    Attributes:
+        uri (str): The URI of the Milvus server.
+        token (str): The API key of the Milvus server.
+        alias (str): The name of the pymilvus connection.
+        health_check_interval_seconds (float): The minimum delay between two periodic health checks.
+    """
+
+    def __init__(self, uri, token, alias="default", health_check_interval_seconds=30):
+        """
+        Initializes the MilvusPool. The connection is opened on first use.
+
+        Args:
+            uri (str): The URI of the Milvus server.
+            token (str): The API key of the Milvus server.
+            alias (str): The name of the pymilvus connection.
+            health_check_interval_seconds (float): The minimum delay between two periodic health checks.
+        """
+        self.uri = uri
+        self.token = token
+        self.alias = alias
+        self.health_check_interval_seconds = health_check_interval_seconds
+
+        self._collections = {}
+        self._connected_at = None
+        self._last_check = None
+        self._last_checked_at = None
+        self._last_error = None
+        self._reconnects = 0
+        self._lock = threading.Lock()
+
+    def get_collection(self, name):
+        """
+        Returns the handle of a collection, connecting on first use and reconnecting if the connection is unhealthy.
+
+        Args:
+            name (str): The name of the collection.
+
+        Returns:
+            PooledCollection: The timed handle of the collection.
+        """
+        with self._lock:
+            if self._connected_at is None:
+                self._connect()
+            elif self._is_stale() and not self._check():
+                self._reconnect()
+            if name not in self._collections:
+                self._collections[name] = PooledCollection(self, Collection(name=name, using=self.alias))
+            return self._collections[name]
+
+    def status(self):
+        """
+        Describes the state of the pool.
+
+        Returns:
+            dict: Whether the connection is open, when it was opened and last checked, the number of reconnections,
+                the last connection error and the names of the cached collection handles.
+        """
+        return {
+            "connected": self._connected_at is not None,
+            "connected_at": self._connected_at.isoformat() if self._connected_at else None,
+            "last_checked_at": self._last_checked_at.isoformat() if self._last_checked_at else None,
+            "reconnects": self._reconnects,
+            "last_error": self._last_error,
+            "collections": sorted(self._collections),
+            "health_check_interval_seconds": self.health_check_interval_seconds,
+        }
+
+    def close(self):
+        """
+        Closes the connection and drops the collection handles.
+        """
+        with self._lock:
+            self._disconnect()
+
+    def recover(self, reconnects):
+        """
+        Checks the connection after a failed operation, and reopens it if it is unhealthy.
+
+        Args:
+            reconnects (int): The number of reconnections when the operation started.
+
+        Returns:
+            bool: Whether the connection was reopened since the operation started, in which case it can be retried.
+        """
+        with self._lock:
+            if self._reconnects != reconnects:
+                return True
+            if self._connected_at is not None and self._check():
+                return False
+            self._reconnect()
+            return True
+
+    def _is_stale(self):
+        return self._last_check is None or time.monotonic() - self._last_check >= self.health_check_interval_seconds
+
+    def _connect(self):
+        """Opens the connection. Must hold the lock."""
+        try:
+            connections.connect(self.alias, uri=self.uri, token=self.token)
+        except Exception as e:
+            self._last_error = str(e)
+            raise
+        self._connected_at = datetime.now()
+        self._last_check = time.monotonic()
+        self._last_checked_at = self._connected_at
+        MILVUS_CONNECTED.set(1)
+
+    def _disconnect(self):
+        """Closes the connection and drops the collection handles, bound to it. Must hold the lock."""
+        try:
+            connections.disconnect(self.alias)
+        except Exception:
+            pass
+        self._collections.clear()
+        self._connected_at = None
+        MILVUS_CONNECTED.set(0)
+
+    def _reconnect(self):
+        """Reopens the connection. Must hold the lock."""
+        self._disconnect()
+        self._reconnects += 1
+        MILVUS_RECONNECTS.inc()
+        self._connect()
+
+    def _check(self):
+        """
+        Sends a lightweight request to the server. Must hold the lock.
+
+        Returns:
+            bool: Whether the connection is healthy.
+        """
+        try:
+            utility.get_server_version(using=self.alias)
+            return True
+        except Exception as e:
+            self._last_error = str(e)
+            MILVUS_CONNECTED.set(0)
+            return False
+        finally:
+            self._last_check = time.monotonic()
+            self._last_checked_at = datetime.now()
+
+
+class PooledCollection:
+    """
+    Handle of a Milvus collection provided by a MilvusPool. It behaves like the pymilvus Collection, and times its
+    operations and recovers them from connection failures.
+    """
+
+    def __init__(self, pool, collection):
+        self._pool = pool
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if name not in TIMED_OPERATIONS:
+            return attribute
+
+        def operation(*args, **kwargs):
+            return self._run(name, *args, **kwargs)
+        return operation
+
+    def _run(self, operation, *args, **kwargs):
+        reconnects = self._pool._reconnects
+        start = time.perf_counter()
+        try:
+            result = getattr(self._collection, operation)(*args, **kwargs)
+        except Exception:
+            MILVUS_OPERATION_SECONDS.labels(collection=self._collection.name, operation=operation, result="error").observe(time.perf_counter() - start)
+            if not self._pool.recover(reconnects) or operation not in RETRIED_OPERATIONS:
+                raise
+            # The previous handle was bound to the closed connection
+            self._collection = self._pool.get_collection(self._collection.name)._collection
+            start = time.perf_counter()
+            try:
+                result = getattr(self._collection, operation)(*args, **kwargs)
+            except Exception:
+                MILVUS_OPERATION_SECONDS.labels(collection=self._collection.name, operation=operation, result="error").observe(time.perf_counter() - start)
+                raise
+            MILVUS_OPERATION_SECONDS.labels(collection=self._collection.name, operation=operation, result="retried").observe(time.perf_counter() - start)
+            return result
+        MILVUS_OPERATION_SECONDS.labels(collection=self._collection.name, operation=operation, result="ok").observe(time.perf_counter() - start)
+        return result
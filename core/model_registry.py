@@ -0,0 +1,157 @@
+import threading
+import time
+from datetime import datetime
+
+from core.metrics import MODEL_REGISTRY_GET_SECONDS, MODEL_REGISTRY_LOAD_SECONDS, MODEL_REGISTRY_VERSION
+
+
+class ModelRegistry:
+    """
+    Keeps a single instance of a model per worker process and hot-reloads it when its source changes.
+
+    The version of the model source (e.g. the ETag of an object in MinIO) is checked at most once every
+    `check_interval_seconds`. When it changes, the new model is loaded and swapped in atomically: callers that
+    already hold the previous model keep using it until they are done, and only one thread reloads at a time
+    while the others keep being served the active model.
+
+    The latency of get() is exported separately for cold calls (which loaded a model) and warm hits, along with the
+    duration of each load and the active version.
+
+    Attributes:
+        name (str): The name of the model, used in logs and status reports.
+        fetch_version (callable): Returns the current version of the model source.
+        load_model (callable): Loads the model and returns a (model, version) tuple.
+        check_interval_seconds (float): The minimum delay between two version checks.
+    """
+
+    def __init__(self, name, fetch_version, load_model, check_interval_seconds=300):
+        """
+        Initializes the ModelRegistry. The model is loaded lazily, on the first call to get().
+
+        Args:
+            name (str): The name of the model, used in logs and status reports.
+            fetch_version (callable): Returns the current version of the model source.
+            load_model (callable): Loads the model and returns a (model, version) tuple.
+            check_interval_seconds (float): The minimum delay between two version checks.
+        """
+        self.name = name
+        self.fetch_version = fetch_version
+        self.load_model = load_model
+        self.check_interval_seconds = check_interval_seconds
+
+        # (model, version, loaded_at) of the active model, replaced as a whole on reload
+        self._active = None
+        self._last_check = None
+        self._last_checked_at = None
+        self._last_load_seconds = None
+        # (version, monotonic time) of the last check made by peek_version() without loading the model
+        self._peeked = None
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        """
+        The version of the active model, or None if no model has been loaded yet.
+        """
+        active = self._active
+        return active[1] if active else None
+
+    def get(self):
+        """
+        Returns the active model, loading it on first use and reloading it if its source changed.
+
+        Returns:
+            tuple: The active model and its version.
+        """
+        start = time.perf_counter()
+        loaded = False
+        if self._active is None:
+            with self._lock:
+                if self._active is None:
+                    loaded = self._refresh()
+        elif self._is_stale() and self._lock.acquire(blocking=False):
+            try:
+                if self._is_stale():
+                    loaded = self._refresh()
+            finally:
+                self._lock.release()
+
+        model, version, _ = self._active
+        MODEL_REGISTRY_GET_SECONDS.labels(model=self.name, result="cold" if loaded else "warm").observe(time.perf_counter() - start)
+        return model, version
+
+    def peek_version(self):
+        """
+        Returns the version get() would serve, without loading the model, e.g. to look up results precomputed by
+        that version before deciding whether the model is needed. The version of the model source is checked at
+        most once every `check_interval_seconds`, like in get().
+
+        Returns:
+            str: The version of the active model while it is fresh, or the current version of the model source.
+        """
+        active = self._active
+        if active is not None and not self._is_stale():
+            return active[1]
+        peeked = self._peeked
+        if peeked is not None and time.monotonic() - peeked[1] < self.check_interval_seconds:
+            return peeked[0]
+        try:
+            version = self.fetch_version()
+        except Exception as e:
+            if active is None:
+                raise
+            print(f"Error checking the {self.name} model, keeping version {active[1]}: {e}")
+            return active[1]
+        self._peeked = (version, time.monotonic())
+        return version
+
+    def status(self):
+        """
+        Describes the state of the registry.
+
+        Returns:
+            dict: The name and version of the active model, when it was loaded and how long it took, and when its
+                source was last checked.
+        """
+        active = self._active
+        return {
+            "name": self.name,
+            "version": active[1] if active else None,
+            "loaded_at": active[2].isoformat() if active else None,
+            "last_checked_at": self._last_checked_at.isoformat() if self._last_checked_at else None,
+            "last_load_seconds": self._last_load_seconds,
+            "check_interval_seconds": self.check_interval_seconds,
+        }
+
+    def _is_stale(self):
+        return self._last_check is None or time.monotonic() - self._last_check >= self.check_interval_seconds
+
+    def _refresh(self):
+        """
+        Checks the version of the model source and swaps in a new model if it changed. Must hold the lock.
+        If the check fails while a model is active, that model keeps being served until the next check.
+
+        Returns:
+            bool: Whether a new model was loaded.
+        """
+        try:
+            version = self.fetch_version()
+            if self._active is None or version != self._active[1]:
+                start = time.perf_counter()
+                model, version = self.load_model()
+                self._last_load_seconds = time.perf_counter() - start
+                MODEL_REGISTRY_LOAD_SECONDS.labels(model=self.name).observe(self._last_load_seconds)
+                if self._active is not None:
+                    MODEL_REGISTRY_VERSION.remove(self.name, self._active[1])
+                MODEL_REGISTRY_VERSION.labels(model=self.name, version=version).set(1)
+                self._active = (model, version, datetime.now())
+                return True
+            return False
+        except Exception as e:
+            if self._active is None:
+                raise
+            print(f"Error reloading the {self.name} model, keeping version {self._active[1]}: {e}")
+            return False
+        finally:
+            self._last_check = time.monotonic()
+            self._last_checked_at = datetime.now()
@@ -0,0 +1,243 @@
+import hashlib
+import os
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import essentia.standard as es
+import numpy as np
+import soundfile as sf
+
+from core.audio_decoding import PcmFile, decode_to_pcm_file, iter_pcm_blocks
+from core.metrics import PCM_CACHE_BYTES, PCM_CACHE_EVICTIONS, PCM_CACHE_LOOKUPS
+
+
+class PcmCache:
+    """
+    Disk cache of decoded audio, shared by the consumers that decode the same files at different sample rates
+    (OpenL3 at 48 kHz, MusicNet at 22.05 kHz).
+
+    A file is decoded once to mono float32 at its native sample rate, stored as a WAV file. Each consumer rate is
+    then resampled from that native decode on first use and stored as raw PCM, which consumers memory-map. Both
+    steps go through Essentia's MonoLoader, so the samples are identical to a direct MonoLoader decode at the
+    consumer rate.
+
+    Entries are keyed by a caller-provided key, e.g. the ETag of the object, so that a modified file is never served
+    from the cache. The total size of the entries is capped at `max_bytes`, evicting the least recently used first.
+    Entries in use are pinned and only evicted once released, so the cap can be exceeded while they are. The
+    directory can be shared by several worker processes: each keeps its own usage order, and a file evicted by
+    another process is decoded again. A pin is a hard link to the entry, private to its user, so that an entry
+    evicted by another process while in use stays readable until it is released.
+
+    Attributes:
+        directory (str): The directory of the cache files.
+        max_bytes (int): The maximum total size of the cache files.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        # File name -> size, least recently used first
+        self._entries = OrderedDict()
+        self._pinned = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        files = [entry for entry in os.scandir(directory) if entry.is_file() and not entry.name.startswith("tmp")]
+        for entry in sorted(files, key=lambda entry: entry.stat().st_mtime):
+            self._entries[entry.name] = entry.stat().st_size
+        PCM_CACHE_BYTES.set(self.size)
+
+    @property
+    def size(self):
+        """
+        The total size of the cache files in bytes.
+        """
+        return sum(self._entries.values())
+
+    @contextmanager
+    def open(self, key, sample_rate, fetch, suffix="", decode_on_miss=True):
+        """
+        Provides the decoded samples of an audio file at a sample rate, decoding or resampling them on a miss.
+
+        Args:
+            key (str): The key of the audio file, which must change when its content does.
+            sample_rate (int): The sample rate of the samples.
+            fetch (callable): Writes the audio file to the path it is given, called on a miss of the native decode.
+            suffix (str): The extension of the audio file, which the metadata reader relies on.
+            decode_on_miss (bool): Whether to download and decode the file on a miss of the native decode, or to
+                yield None, e.g. for callers that only need part of the file and can decode it faster themselves.
+
+        Yields:
+            PcmFile: The raw mono float32 samples, valid until the context exits, or None on a miss without
+                decode_on_miss.
+        """
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        native_name = f"{digest}.wav"
+        name = f"{digest}.{int(sample_rate)}.pcm"
+
+        with self._key_lock(digest):
+            pin = self._acquire(name)
+            if pin is not None:
+                PCM_CACHE_LOOKUPS.labels(result="hit").inc()
+            else:
+                native_pin = self._acquire(native_name)
+                PCM_CACHE_LOOKUPS.labels(result="resample" if native_pin is not None else "miss").inc()
+                if native_pin is not None or decode_on_miss:
+                    if native_pin is None:
+                        native_pin = self._store(native_name, lambda path: self._decode_native(fetch, suffix, path))
+                    # The native decode stays pinned while it is resampled
+                    try:
+                        pin = self._store(name, lambda path: decode_to_pcm_file(native_pin, path, sample_rate))
+                    finally:
+                        self._release(native_name, native_pin)
+        if pin is None:
+            yield None
+            return
+        try:
+            yield PcmFile(pin, sample_rate)
+        finally:
+            self._release(name, pin)
+
+    @contextmanager
+    def open_native(self, key, fetch, suffix="", decode_on_miss=True):
+        """
+        Provides the native decode of an audio file, the mono float32 WAV file the other sample rates are resampled
+        from, decoding it on a miss.
+
+        Args:
+            key (str): The key of the audio file, which must change when its content does.
+            fetch (callable): Writes the audio file to the path it is given, called on a miss.
+            suffix (str): The extension of the audio file, which the metadata reader relies on.
+            decode_on_miss (bool): Whether to download and decode the file on a miss, or to yield None.
+
+        Yields:
+            str: The path to the WAV file, valid until the context exits, or None on a miss without decode_on_miss.
+        """
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        native_name = f"{digest}.wav"
+
+        with self._key_lock(digest):
+            pin = self._acquire(native_name)
+            PCM_CACHE_LOOKUPS.labels(result="hit" if pin is not None else "miss").inc()
+            if pin is None and decode_on_miss:
+                pin = self._store(native_name, lambda path: self._decode_native(fetch, suffix, path))
+        if pin is None:
+            yield None
+            return
+        try:
+            yield pin
+        finally:
+            self._release(native_name, pin)
+
+    @contextmanager
+    def _key_lock(self, digest):
+        """Serializes the decodes of a file, so that concurrent misses decode it once."""
+        with self._lock:
+            lock, users = self._key_locks.get(digest, (threading.Lock(), 0))
+            self._key_locks[digest] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                lock, users = self._key_locks[digest]
+                if users == 1:
+                    del self._key_locks[digest]
+                else:
+                    self._key_locks[digest] = (lock, users - 1)
+
+    def _pin_path(self, name):
+        """A new path for a pin of an entry, skipped like the temporary files when the directory is scanned."""
+        return os.path.join(self.directory, f"tmp{uuid.uuid4().hex}-{name}")
+
+    def _acquire(self, name):
+        """
+        Pins an entry if it exists, marking it as recently used. Files written by other processes are adopted.
+
+        Returns:
+            str or None: The path of the pin to read the entry from, or None if the entry does not exist.
+        """
+        path = os.path.join(self.directory, name)
+        pin = self._pin_path(name)
+        with self._lock:
+            # Linking both checks that the entry exists and keeps it from being removed by another process
+            try:
+                os.link(path, pin)
+            except FileNotFoundError:
+                self._entries.pop(name, None)
+                return None
+            if name not in self._entries:
+                self._entries[name] = os.path.getsize(pin)
+            self._entries.move_to_end(name)
+            os.utime(pin)
+            self._pinned[name] = self._pinned.get(name, 0) + 1
+            return pin
+
+    def _release(self, name, pin):
+        """Unpins an entry, then evicts the entries over the size cap that are not in use."""
+        os.unlink(pin)
+        with self._lock:
+            self._pinned[name] -= 1
+            if not self._pinned[name]:
+                del self._pinned[name]
+            self._evict()
+
+    def _store(self, name, write):
+        """
+        Writes an entry through a temporary file, so that other processes never see a partial file. The new entry is
+        pinned, like an acquired one.
+
+        Returns:
+            str: The path of the pin to read the entry from.
+        """
+        fd, temp_path = tempfile.mkstemp(prefix="tmp", dir=self.directory)
+        os.close(fd)
+        pin = self._pin_path(name)
+        try:
+            write(temp_path)
+            os.link(temp_path, pin)
+            os.replace(temp_path, os.path.join(self.directory, name))
+        except BaseException:
+            for path in (temp_path, pin):
+                if os.path.exists(path):
+                    os.unlink(path)
+            raise
+        with self._lock:
+            self._entries[name] = os.path.getsize(pin)
+            self._pinned[name] = self._pinned.get(name, 0) + 1
+            PCM_CACHE_BYTES.set(self.size)
+        return pin
+
+    def _evict(self):
+        """Removes the least recently used entries that are not in use until the cache fits. Must hold the lock."""
+        size = self.size
+        for name in list(self._entries):
+            if size <= self.max_bytes:
+                break
+            if name in self._pinned:
+                continue
+            size -= self._entries.pop(name)
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            PCM_CACHE_EVICTIONS.inc()
+        PCM_CACHE_BYTES.set(size)
+
+    def _decode_native(self, fetch, suffix, wav_path):
+        """Decodes an audio file to a mono float32 WAV file at its native sample rate."""
+        with tempfile.TemporaryDirectory(dir=self.directory, prefix="tmp") as temp_dir:
+            audio_file = os.path.join(temp_dir, f"audio{suffix}")
+            pcm_file = os.path.join(temp_dir, "audio.pcm")
+            fetch(audio_file)
+            sample_rate = int(es.MetadataReader(filename=audio_file)()[-2])
+            if not sample_rate:
+                raise ValueError("The sample rate of the audio file could not be read")
+            decode_to_pcm_file(audio_file, pcm_file, sample_rate)
+            with sf.SoundFile(wav_path, "w", samplerate=sample_rate, channels=1, subtype="FLOAT", format="WAV") as wav:
+                for block in iter_pcm_blocks(pcm_file, 1 << 20):
+                    wav.write(block.astype(np.float32, copy=False))
@@ -0,0 +1,71 @@
+import queue
+import threading
+
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def iter_prefetched(iterable, max_pending=2, name="prefetch"):
+    """
+    Iterates over an iterable in a worker thread, so that producing the next items overlaps with the consumption
+    of the current one.
+
+    The worker puts items in a queue bounded to `max_pending` items, and blocks once it is full: the producer never
+    runs more than `max_pending` items ahead of the consumer, which bounds memory. Exceptions raised by the producer
+    are raised again in the consumer. Closing the generator (or leaving the loop early) stops the worker after its
+    current item.
+
+    Args:
+        iterable (iterable): The items to produce, e.g. a generator decoding audio and computing mel spectrograms.
+        max_pending (int): The maximum number of items produced but not consumed yet.
+        name (str): The name of the worker thread.
+
+    Yields:
+        The items of the iterable, in order.
+    """
+    items = queue.Queue(maxsize=max(1, max_pending))
+    stopped = threading.Event()
+
+    def put(item):
+        # Wait for room in the queue, unless the consumer is gone
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    break
+        except BaseException as e:
+            put(_Failure(e))
+            return
+        finally:
+            # Runs the cleanup of a generator (e.g. deleting temporary files) in the worker
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                close()
+        put(_DONE)
+
+    worker = threading.Thread(target=produce, name=name, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+        worker.join()
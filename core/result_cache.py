@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import OrderedDict
+
+from core.metrics import RESULT_CACHE_ENTRIES, RESULT_CACHE_INVALIDATIONS, RESULT_CACHE_LOOKUPS
+
+
+# Results being computed by ResultCache.get() in each thread, innermost last
+_computations = threading.local()
+
+
+def skip_caching():
+    """
+    Keeps the result being computed by ResultCache.get() in the current thread out of the cache, e.g. a degraded
+    result served while the source is unavailable. Does nothing outside of a computation.
+    """
+    stack = getattr(_computations, "stack", None)
+    if stack:
+        stack[-1]["store"] = False
+
+
+class ResultCache:
+    """
+    In-memory LRU cache of deterministic query results, invalidated as a whole when the version of their source
+    changes.
+
+    The version of the source (e.g. a stamp bumped whenever a collection is written) is checked at most once every
+    `check_interval_seconds`, so that hits do not pay for the check. When it changes, every entry is dropped. A
+    result computed while the version changed, or whose computation called skip_caching(), is returned but not
+    stored.
+
+    Results are shared between callers and must not be modified. Errors are not cached.
+
+    Attributes:
+        name (str): The name of the cache, used in the metrics.
+        max_entries (int): The maximum number of results kept, the least recently used evicted first.
+        fetch_version (callable): Returns the current version of the source of the results.
+        check_interval_seconds (float): The minimum delay between two version checks.
+    """
+
+    def __init__(self, name, max_entries, fetch_version, check_interval_seconds=30):
+        self.name = name
+        self.max_entries = max_entries
+        self.fetch_version = fetch_version
+        self.check_interval_seconds = check_interval_seconds
+
+        self._entries = OrderedDict()
+        self._version = None
+        self._last_check = None
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        """
+        Returns the cached result of a key, computing and storing it on a miss.
+
+        Args:
+            key (tuple): The key of the result, hashable.
+            compute (callable): Computes the result on a miss.
+
+        Returns:
+            The result.
+        """
+        if self.max_entries <= 0:
+            return compute()
+
+        version = self._check_version()
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                RESULT_CACHE_LOOKUPS.labels(cache=self.name, result="hit").inc()
+                return self._entries[key]
+        RESULT_CACHE_LOOKUPS.labels(cache=self.name, result="miss").inc()
+
+        computation = {"store": True}
+        stack = _computations.__dict__.setdefault("stack", [])
+        stack.append(computation)
+        try:
+            result = compute()
+        finally:
+            stack.pop()
+        with self._lock:
+            if computation["store"] and self._version == version:
+                self._entries[key] = result
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                RESULT_CACHE_ENTRIES.labels(cache=self.name).set(len(self._entries))
+        return result
+
+    def clear(self):
+        """
+        Drops every entry.
+        """
+        with self._lock:
+            self._entries.clear()
+            RESULT_CACHE_ENTRIES.labels(cache=self.name).set(0)
+
+    def status(self):
+        """
+        Describes the state of the cache.
+
+        Returns:
+            dict: The name, number of entries, maximum number of entries and version of the cache.
+        """
+        return {"name": self.name, "entries": len(self._entries), "max_entries": self.max_entries, "version": self._version}
+
+    def _check_version(self):
+        """
+        Checks the version of the source if the last check is older than the interval, and drops the entries if it
+        changed. If the check fails, the entries are dropped too, as the source may have changed.
+
+        Returns:
+            The version the results are computed from.
+        """
+        if self._last_check is not None and time.monotonic() - self._last_check < self.check_interval_seconds:
+            return self._version
+        try:
+            version = self.fetch_version()
+        except Exception as e:
+            print(f"Error checking the version of the {self.name} cache, emptying it: {e}")
+            version = f"unknown-{time.monotonic()}"
+        with self._lock:
+            self._last_check = time.monotonic()
+            if version != self._version:
+                if self._version is not None or self._entries:
+                    RESULT_CACHE_INVALIDATIONS.labels(cache=self.name).inc()
+                self._entries.clear()
+                self._version = version
+                RESULT_CACHE_ENTRIES.labels(cache=self.name).set(0)
+            return self._version
@@ -0,0 +1,52 @@
+from typing import Literal
+
+from pydantic import BaseModel
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+
+from core.config import Base
+
+
+class EloRating(Base):
+    """
+    Elo rating of a model compared by the users, and the results of its votes.
+    """
+    __tablename__ = "elo_ratings"
+
+    model = Column(String, primary_key=True)
+    rating = Column(Float, nullable=False)
+    wins = Column(Integer, nullable=False, default=0)
+    losses = Column(Integer, nullable=False, default=0)
+    draws = Column(Integer, nullable=False, default=0)
+    votes = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime)
+
+
+class EloVote(Base):
+    """
+    Vote of a user between the predictions of two models for a track.
+    """
+    __tablename__ = "elo_votes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey('users.id'))
+    file_path = Column(String)
+    model_a = Column(String, nullable=False)
+    model_b = Column(String, nullable=False)
+    score = Column(Float, nullable=False)
+    rating_change = Column(Float, nullable=False)
+    created_at = Column(DateTime)
+
+
+class VoteRequest(BaseModel):
+    file_path: str
+    music_net_version: str
+    winner: Literal["music_net", "essentia", "draw"]
+
+
+class LeaderboardEntry(BaseModel):
+    model: str
+    rating: float
+    wins: int
+    losses: int
+    draws: int
+    votes: int
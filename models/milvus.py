@@ -1,5 +1,36 @@
 from pydantic import BaseModel, validator
 from typing import List, Optional
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, UniqueConstraint
+
+from core.config import Base
+
+
+class CollectionVersion(Base):
+    """
+    Version stamp of a Milvus collection, bumped whenever its entities are written, so that the caches of the
+    results read from it are invalidated.
+    """
+    __tablename__ = "collection_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime)
+
+
+class MilvusEntityId(Base):
+    """
+    Primary key of the Milvus entity of a track in a collection, so that entities are fetched by id rather than by
+    filtering their path. Linked to the music_library row of the track when there is one.
+    """
+    __tablename__ = "milvus_entity_ids"
+    __table_args__ = (UniqueConstraint("collection", "path"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    collection = Column(String, nullable=False)
+    path = Column(String, nullable=False)
+    milvus_id = Column(BigInteger, nullable=False)
+    music_id = Column(Integer, ForeignKey('music_library.id'), index=True)
+    updated_at = Column(DateTime)
 
 
 class Entity(BaseModel):
@@ -55,3 +86,35 @@ class FilePathsQuery(BaseModel):
 
 class SanitizedFilePathsQuery(BaseModel):
     filepath: str
+
+
+class BatchSimilarityQuery(BaseModel):
+    paths: List[str]
+    k: int = 9
+    max_per_artist: Optional[int] = None
+    fuse: bool = False
+
+
+class BatchSimilarityHit(BaseModel):
+    id: str
+    distance: float
+    title: str
+    album: str
+    artist: str
+    path: str
+
+
+class FusedSimilarityHit(BatchSimilarityHit):
+    score: float
+    matches: int
+
+
+class BatchSimilarityResult(BaseModel):
+    path: str
+    hits: Optional[List[BatchSimilarityHit]] = None
+    error: Optional[str] = None
+
+
+class BatchSimilarityResponse(BaseModel):
+    results: List[BatchSimilarityResult]
+    fused: Optional[List[FusedSimilarityHit]] = None
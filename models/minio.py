@@ -1,5 +1,23 @@
 from pydantic import BaseModel, Field
 from typing import List, Optional
+from sqlalchemy import Column, Integer, String, DateTime
+
+from core.config import Base
+
+
+class AudioContentHash(Base):
+    """
+    Content-addressed index of the audio objects stored in MinIO: the SHA-256 of each object's content.
+    Objects sharing a hash are the same audio, and share their embeddings.
+    """
+    __tablename__ = "audio_content_hashes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String(64), index=True)
+    bucket = Column(String)
+    object_name = Column(String, index=True)
+    size = Column(Integer)
+    created_at = Column(DateTime)
 
 
 class S3Object(BaseModel):
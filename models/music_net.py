@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, UniqueConstraint
+
+from core.config import Base
+
+
+class MusicNetGenres(Base):
+    """
+    MusicNet genre predictions of a music_library track, precomputed offline by a version of the model.
+    `genres` holds the top-k genres and their probabilities as a JSON list of [genre, probability], most probable
+    first.
+    """
+    __tablename__ = "music_net_genres"
+    __table_args__ = (UniqueConstraint("filepath", "model_version"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    music_id = Column(Integer, ForeignKey('music_library.id'), index=True)
+    filepath = Column(String, nullable=False, index=True)
+    model_version = Column(String, nullable=False)
+    genres = Column(Text, nullable=False)
+    created_at = Column(DateTime)
@@ -1,3 +1,5 @@
+from typing import Dict, Optional
+
 from pydantic import BaseModel, Field
 from sqlalchemy import Column, Integer, ForeignKey, DateTime, Float, String, Text
 from sqlalchemy.orm import relationship
@@ -30,3 +32,17 @@ class EmbeddingResponse(BaseModel):
 
 class PathForEmbedding(BaseModel):
     file_path: str = Field(..., json_schema_extra={'example': "MegaSet/Soweto String Quartet/Soweto String Quartet -1994 Zebra Crossing-/04 Kwela.mp3"})
+
+
+class EmbeddingJobResponse(BaseModel):
+    job_id: str
+    key: str
+    state: str
+    stage: Optional[str] = None
+    progress: float
+    timings: Dict[str, float]
+    result: Optional[EmbeddingResponse] = None
+    error: Optional[str] = None
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
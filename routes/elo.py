@@ -1,81 +1,171 @@
-import os
+import asyncio
+import time
+
+from typing import List
 
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import JSONResponse
 
+from models.elo import LeaderboardEntry, VoteRequest
 from models.music import SongPath
-from core.config import login_manager, DEFAULT_SETTINGS
-from services.minio import get_temp_file_from_minio, get_metadata_and_artwork
+from core.config import login_manager, DEFAULT_SETTINGS, SessionLocal
+from services.elo import ESSENTIA_MODEL_ID, elo_store, get_music_net_model_id
+from services.minio import get_metadata_and_artwork
 from services.milvus import get_milvus_87_collection, extract_plot_data, create_plot, convert_plot_to_base64
-from services.music_net import create_preprocessed_spectrogram, get_production_model, predict_with_production_music_net
+from services.milvus_ids import query_by_paths
+from services.music_net import create_spectrogram_tensor_from_minio, music_net_model_registry, predict_with_production_music_net
+from services.music_net_catalog import get_precomputed_genres
 
 
 router = APIRouter(prefix="/elo")
 
 
-async def get_mlflow_model_predictions(file_path: str):
-    model = get_production_model()
+def get_metadata(file_path: str):
+    if file_path.startswith("MegaSet/"):
+        return get_metadata_and_artwork(DEFAULT_SETTINGS.minio_bucket_name, file_path)
+    return get_default_metadata(file_path)
+
+
+def get_default_metadata(file_path: str):
+    return {
+        "file_path": file_path,
+        "artist": "Unknown",
+        "artwork": None,
+    }
+
+
+def get_mlflow_model_predictions(file_path: str):
+    # The model is only loaded if the genre was not precomputed by its version
+    model_version = music_net_model_registry.peek_version()
+    with SessionLocal() as db:
+        precomputed = get_precomputed_genres(db, [file_path], model_version)
+    if file_path in precomputed:
+        return precomputed[file_path][0][0], model_version
+
+    model, model_version = music_net_model_registry.get()
     if model is None:
         raise HTTPException(status_code=500, detail="Failed to load the production model.")
-    
-    temp_file_path = get_temp_file_from_minio(file_path)
+
     try:
-        img_tensor = create_preprocessed_spectrogram(temp_file_path)
-        if img_tensor is None:
-            raise HTTPException(status_code=500, detail="Failed to create the preprocessed spectrogram.")
-        genre = predict_with_production_music_net(model, img_tensor)
-    finally:
-        os.remove(temp_file_path)
-    
-    return genre
+        img_tensor = create_spectrogram_tensor_from_minio(file_path)
+    except ValueError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    genre = predict_with_production_music_net(model, img_tensor)
 
+    return genre, model_version
 
-async def get_essentia_predictions(file_path: str):
-    if file_path.startswith("MegaSet/"):
-        try:
-            collection_87 = get_milvus_87_collection()
-            entity = collection_87.query(
-                expr=f"path in ['{file_path}']",
-                output_fields=["predictions", "title", "artist"], 
-                limit=1
-            )
-            if not entity:
-                raise HTTPException(status_code=404, detail="Entity not found")
-            
-            class_names, top_5_activations, title, artist = await extract_plot_data(entity)
-            fig = await create_plot(class_names, top_5_activations, title, artist)
-            predictions_plot = await convert_plot_to_base64(fig)
-        except:
-            predictions_plot = None
-    else:
-        predictions_plot = None
-    
-    return predictions_plot
 
+def get_essentia_predictions(file_path: str):
+    if not file_path.startswith("MegaSet/"):
+        return None
 
-@router.post("/compare_models", tags=["elo"])
-async def get_comparison(query: SongPath, user=Depends(login_manager)):
+    collection_87 = get_milvus_87_collection()
+    entity = query_by_paths(collection_87, [file_path], output_fields=["predictions", "title", "artist"], limit=1)
+    if not entity:
+        raise HTTPException(status_code=404, detail="Entity not found")
+
+    class_names, top_5_activations, title, artist = extract_plot_data(entity)
+    fig = create_plot(class_names, top_5_activations, title, artist)
+    return convert_plot_to_base64(fig)
+
+
+async def run_branch(function, file_path: str, timeout: float):
+    """
+    Runs a blocking branch of the comparison in a worker thread, so that it does not block the event loop.
+
+    A branch that times out keeps running in its thread until it returns, but its result is dropped.
+
+    Args:
+        function (callable): The branch, called with the file path.
+        file_path (str): The path of the audio file compared.
+        timeout (float): The time allowed to the branch, in seconds.
+
+    Returns:
+        tuple: The result of the branch (None on failure), the error message (None on success) and the duration of
+            the branch in seconds.
+    """
+    start = time.perf_counter()
     try:
-        # 1. Get the metadata and artwork from MinIO
-        if query.file_path.startswith("MegaSet/"):
-            metadata = get_metadata_and_artwork(DEFAULT_SETTINGS.minio_bucket_name, query.file_path)
-        else:
-            metadata = {
-                "file_path": query.file_path,
-                "artist": "Unknown",
-                "artwork": None, 
-            }
-
-        # 2. Get the predictions from the model from mlflow and add them to the metadata
-        metadata['prediction_model_1'] = await get_mlflow_model_predictions(query.file_path)
-
-        # 3. Get the predictions from the model from essentia
-        metadata['predictions_openl3'] = await get_essentia_predictions(query.file_path)
-
-        # Return the combined metadata and predictions
-        return JSONResponse(content=metadata)
+        result = await asyncio.wait_for(asyncio.to_thread(function, file_path), timeout)
+        return result, None, time.perf_counter() - start
+    except asyncio.TimeoutError:
+        return None, f"Timed out after {timeout} s", time.perf_counter() - start
     except HTTPException as e:
-        raise e
+        return None, str(e.detail), time.perf_counter() - start
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    
\ No newline at end of file
+        return None, str(e) or type(e).__name__, time.perf_counter() - start
+
+
+@router.post("/compare_models", tags=["elo"])
+async def get_comparison(query: SongPath, user=Depends(login_manager)):
+    """
+    Gathers the metadata of a track and the genre predictions of the models to compare.
+
+    The metadata and artwork, the MusicNet prediction and the Essentia predictions plot are retrieved concurrently,
+    each with its own timeout. A branch that fails or times out does not fail the others: its fields are null (the
+    metadata falls back to defaults) and its error is reported in `errors`.
+
+    - **file_path**: str - The path to the audio file in MinIO.
+    - **return**: dict - The metadata, `prediction_model_1` and its version, `predictions_openl3` (a base64 plot),
+      the duration of each branch in seconds in `timings` and the error of each failed branch in `errors`.
+    """
+    (metadata, metadata_error, metadata_seconds), \
+        (music_net, music_net_error, music_net_seconds), \
+        (plot, plot_error, plot_seconds) = await asyncio.gather(
+            run_branch(get_metadata, query.file_path, DEFAULT_SETTINGS.elo_metadata_timeout_seconds),
+            run_branch(get_mlflow_model_predictions, query.file_path, DEFAULT_SETTINGS.elo_music_net_timeout_seconds),
+            run_branch(get_essentia_predictions, query.file_path, DEFAULT_SETTINGS.elo_essentia_timeout_seconds),
+        )
+
+    metadata = metadata or get_default_metadata(query.file_path)
+    metadata['prediction_model_1'], metadata['prediction_model_1_version'] = music_net or (None, None)
+    metadata['predictions_openl3'] = plot
+    metadata['timings'] = {
+        "metadata": round(metadata_seconds, 3),
+        "music_net": round(music_net_seconds, 3),
+        "essentia": round(plot_seconds, 3),
+    }
+    errors = {"metadata": metadata_error, "music_net": music_net_error, "essentia": plot_error}
+    metadata['errors'] = {branch: error for branch, error in errors.items() if error is not None}
+    return JSONResponse(content=metadata)
+
+
+@router.post("/vote", tags=["elo"])
+def vote(query: VoteRequest, user=Depends(login_manager)):
+    """
+    Records the vote of a user between the MusicNet prediction and the Essentia predictions for a track.
+
+    The ratings are updated in memory and the vote is written to the database in a later batch.
+
+    - **file_path**: str - The path to the audio file compared.
+    - **music_net_version**: str - The version of the MusicNet model that made the prediction
+      (`prediction_model_1_version` of /elo/compare_models): the active version, or one already rated.
+    - **winner**: str - "music_net", "essentia" or "draw".
+    - **return**: dict - The updated stats of both models, by model.
+    """
+    model_id = get_music_net_model_id(query.music_net_version)
+    if not elo_store.has_model(model_id):
+        active_version = music_net_model_registry.status()["version"]
+        if active_version is None:
+            _, active_version = music_net_model_registry.get()
+        if query.music_net_version != active_version:
+            raise HTTPException(status_code=400, detail=f"Unknown MusicNet version {query.music_net_version}.")
+
+    score = {"music_net": 1, "essentia": 0, "draw": 0.5}[query.winner]
+    return elo_store.vote(
+        model_id,
+        ESSENTIA_MODEL_ID,
+        score,
+        user_id=user.id if user else None,
+        file_path=query.file_path,
+    )
+
+
+@router.get("/leaderboard", tags=["elo"], response_model=List[LeaderboardEntry])
+def get_leaderboard():
+    """
+    Ranks the compared models by Elo rating, including the votes not written to the database yet.
+
+    - **return**: list - The rating, wins, losses, draws and number of votes of each model, best rated first.
+    """
+    return elo_store.leaderboard()
@@ -2,11 +2,10 @@ import json
 
 from fastapi import APIRouter, HTTPException, Depends, Response
 
-from core.config import login_manager
-from models.milvus import EmbeddingResponse, SimilarFullEntitiesResponse, FilePathsQuery, SimilarShortEntitiesResponse, SanitizedFilePathsQuery
+from core.config import login_manager, DEFAULT_SETTINGS
+from models.milvus import EmbeddingResponse, SimilarFullEntitiesResponse, FilePathsQuery, SimilarShortEntitiesResponse, SanitizedFilePathsQuery, BatchSimilarityQuery, BatchSimilarityResponse
 from models.music import SongPath
 from services.milvus import (
-    get_milvus_512_collection,
     get_milvus_87_collection,
     full_hit_to_dict,
     sort_entities,
@@ -15,7 +14,17 @@ from services.milvus import (
     convert_plot_to_base64,
     ping_milvus,
 )
-from services.minio import get_embedding_pkl
+from services.milvus_ids import query_by_paths
+from services.minio import get_embedding
+from services.similarity import (
+    embedding_mirror,
+    get_entities_by_id,
+    get_entities_by_paths,
+    get_similarity_cache_key,
+    search_similar,
+    search_similar_batch,
+    similarity_cache,
+)
 import numpy as np
 import matplotlib.pyplot as plt
 
@@ -32,8 +41,7 @@ def get_entity_by_id(id: str, user=Depends(login_manager)):
     - **user**: User - The authenticated user making the request.
     - **return**: EmbeddingResponse - The embedding vector of the entity.
     """
-    collection_512 = get_milvus_512_collection()
-    entities = collection_512.query(expr=f"id in [{id}]", output_fields=["embedding"])
+    entities = get_entities_by_id(id)
     if not entities:
         raise HTTPException(status_code=404, detail="Entity not found")
     
@@ -44,62 +52,51 @@ def get_entity_by_id(id: str, user=Depends(login_manager)):
 @router.get("/similar/{id}", tags=["milvus"], response_model=SimilarFullEntitiesResponse)
 def get_similar_entities(id: str, user=Depends(login_manager)):
     """
-    Retrieves the top 3 most similar entities to a given entity ID.
+    Retrieves the top 3 most similar entities to a given entity ID. Results are cached until the collection changes.
 
     - **id**: str - The unique identifier of the entity to compare.
     - **user**: User - The authenticated user making the request.
     - **return**: SimilarFullEntitiesResponse - A list of the most similar entities.
     """
-    collection_512 = get_milvus_512_collection()
-    entities = collection_512.query(expr=f"id in [{id}]", output_fields=["embedding"])
-    if not entities:
-        raise HTTPException(status_code=404, detail="Entity not found")
+    def search():
+        entities = get_entities_by_id(id)
+        if not entities:
+            raise HTTPException(status_code=404, detail="Entity not found")
 
-    embedding = [float(x) for x in entities[0]["embedding"]]
-    entities = collection_512.search(
-        data=[embedding],
-        anns_field="embedding",
-        param={"nprobe": 16},
-        limit=3,
-        offset=1,
-        output_fields=["*"],
-    )
-
-    response_list = [full_hit_to_dict(hit) for hit in entities[0]]
+        embedding = [float(x) for x in entities[0]["embedding"]]
+        entities = search_similar([embedding], limit=3, offset=1, output_fields=["*"])
+        return [full_hit_to_dict(hit) for hit in entities[0]]
+
+    response_list = similarity_cache.get(get_similarity_cache_key("id", id, 3, 1, ["*"]), search)
     return SimilarFullEntitiesResponse(hits=response_list)
 
 
 @router.post("/similar_full_entity", tags=["milvus"], response_model=SimilarFullEntitiesResponse)
 def get_similar_entities_by_path(query: FilePathsQuery, user=Depends(login_manager)):
     """
-    Retrieves the top 3 most similar entities based on the file path of an entity.
+    Retrieves the top 3 most similar entities based on the file path of an entity. Results are cached until the
+    collection changes.
 
     - **query**: FilePathsQuery - The query containing the file path(s) of the entity.
     - **user**: User - The authenticated user making the request.
     - **return**: SimilarFullEntitiesResponse - A list of the most similar entities with full details.
     """
-    try:
-        collection_512 = get_milvus_512_collection()
-        entities = collection_512.query(expr=f"path in {query.path}", output_fields=["embedding"])
+    def search():
+        entities = get_entities_by_paths(query.path)
         embeddings = [[float(x) for x in entity["embedding"]] for entity in entities]
 
         try:
-            entities = collection_512.search(
-                data=embeddings,
-                anns_field="embedding",
-                param={"nprobe": 16},
-                limit=3,
-                offset=1,
-                output_fields=["*"],
-            )
+            entities = search_similar(embeddings, limit=3, offset=1, output_fields=["*"])
         except Exception as e:
             raise HTTPException(status_code=500, detail="Internal server error: SEARCH_ERROR")
 
         try:
-            response_list = [full_hit_to_dict(hit) for hit in entities[0]]
+            return [full_hit_to_dict(hit) for hit in entities[0]]
         except Exception as e:
             raise HTTPException(status_code=500, detail="Internal server error: RESULT_PROCESS_ERROR")
 
+    try:
+        response_list = similarity_cache.get(get_similarity_cache_key("path", query.path, 3, 1, ["*"]), search)
         return SimilarFullEntitiesResponse(hits=response_list)
     except Exception as e:
         raise HTTPException(status_code=500, detail="Internal server error: UNEXPECTED_ERROR")
@@ -108,56 +105,76 @@ def get_similar_entities_by_path(query: FilePathsQuery, user=Depends(login_manag
 @router.post("/similar_short_entity", tags=["milvus"], response_model=SimilarShortEntitiesResponse)
 def get_similar_9_entities_by_path(query: FilePathsQuery, user=Depends(login_manager)):
     """
-    Retrieves the 9 most similar entities (by title, artist, album) based on the file path of an entity.
+    Retrieves the 9 most similar entities (by title, artist, album) based on the file path of an entity. Results are
+    cached until the collection changes.
 
     - **query**: FilePathsQuery - The query containing the file path(s) of the entity.
     - **user**: User - The authenticated user making the request.
     - **return**: A list of the 9 most similar entities with short details.
     """
-    collection_512 = get_milvus_512_collection()
-    entities = collection_512.query(expr=f"path in {query.path}", output_fields=["embedding"])
-    if not entities:
-        raise HTTPException(status_code=404, detail="Entity not found")
-    
-    embeddings = [[float(x) for x in entity["embedding"]] for entity in entities]
-    entities = collection_512.search(
-        data=embeddings,
-        anns_field="embedding",
-        param={"nprobe": 16},
-        limit=30,
-        offset=1,
-        output_fields=["title", "album", "artist", "path"],
-    )
-    
-    sorted_entities = sort_entities(entities)
+    output_fields = ["title", "album", "artist", "path"]
+
+    def search():
+        entities = get_entities_by_paths(query.path)
+        if not entities:
+            raise HTTPException(status_code=404, detail="Entity not found")
+
+        embeddings = [[float(x) for x in entity["embedding"]] for entity in entities]
+        entities = search_similar(embeddings, limit=30, offset=1, output_fields=output_fields)
+        return sort_entities(entities)
+
+    sorted_entities = similarity_cache.get(get_similarity_cache_key("path", query.path, 30, 1, output_fields), search)
     return {"entities": sorted_entities}
 
 
+@router.post("/similar_batch", tags=["milvus"], response_model=BatchSimilarityResponse)
+def get_similar_entities_batch(query: BatchSimilarityQuery, user=Depends(login_manager)):
+    """
+    Retrieves the most similar entities to each of several entities, with one lookup and one search of the collection
+    for all of them. Results are cached until the collection changes.
+
+    - **paths**: List[str] - The file paths of the entities.
+    - **k**: int - The number of similar entities returned for each path (the query entities are never returned).
+    - **max_per_artist**: int - The maximum number of entities of an artist in each list, none by default. Lists
+      are completed with entities of the same artists if there are too few others.
+    - **fuse**: bool - Whether to also return the entities most similar to the set of paths as a whole, ranked by
+      reciprocal rank fusion of the lists of each path.
+    - **user**: User - The authenticated user making the request.
+    - **return**: BatchSimilarityResponse - The similar entities of each path, in order, with an error for the
+      paths not found, and the fused ranking if requested.
+    """
+    if not query.paths:
+        raise HTTPException(status_code=400, detail="No path given.")
+    if len(query.paths) > DEFAULT_SETTINGS.similarity_batch_max_paths:
+        raise HTTPException(status_code=400, detail=f"At most {DEFAULT_SETTINGS.similarity_batch_max_paths} paths can be searched at once.")
+    if not 1 <= query.k <= DEFAULT_SETTINGS.similarity_batch_max_k:
+        raise HTTPException(status_code=400, detail=f"k must be between 1 and {DEFAULT_SETTINGS.similarity_batch_max_k}.")
+    if query.max_per_artist is not None and query.max_per_artist < 1:
+        raise HTTPException(status_code=400, detail="max_per_artist must be at least 1.")
+
+    key = get_similarity_cache_key("batch", query.paths, query.k, max_per_artist=query.max_per_artist, fuse=query.fuse)
+    return similarity_cache.get(key, lambda: search_similar_batch(query.paths, query.k, query.max_per_artist, query.fuse))
+
+
 @router.post("/similar_short_entity_to_temp", tags=["milvus"], response_model=SimilarShortEntitiesResponse)
 def get_similar_9_entities_by_user_uploaded_filename(query: SanitizedFilePathsQuery, user=Depends(login_manager)):
     """
     Retrieves the 9 most similar entities (by title, artist, album) based on the file path of an entity.
-    This version reads the query embedding from a pkl in the temp bucket.
+    This version reads the query embedding stored in the temp bucket.
 
     - **query**: SanitizedFilePathsQuery - The query containing the file path(s) of the entity.
     - **user**: User - The authenticated user making the request.
     - **return**: A list of the 9 most similar entities with short details.
     """
     try:
-        embeddings = get_embedding_pkl(query.filepath)
+        embeddings = get_embedding(query.filepath)
     except Exception as e:
         raise HTTPException(status_code=404, detail="embedding not found")
+    if not embeddings:
+        raise HTTPException(status_code=404, detail="embedding not found")
     
     try:
-        collection_512 = get_milvus_512_collection()
-        entities = collection_512.search(
-            data=[embeddings],
-            anns_field="embedding",
-            param={"nprobe": 16},
-            limit=30,
-            offset=1,
-            output_fields=["title", "album", "artist", "path"],
-        )
+        entities = search_similar([embeddings], limit=30, offset=1, output_fields=["title", "album", "artist", "path"])
         
         sorted_entities = sort_entities(entities)
         return {"entities": sorted_entities}
@@ -175,17 +192,13 @@ async def get_genres_plot(query: SongPath, user=Depends(login_manager)):
     - **return**: A base64 encoded string of the plot image.
     """
     collection_87 = get_milvus_87_collection()
-    entity = collection_87.query(
-        expr=f"path == '{query.file_path}'",
-        output_fields=["predictions", "title", "artist"], 
-        limit=1
-    )
+    entity = query_by_paths(collection_87, [query.file_path], output_fields=["predictions", "title", "artist"], limit=1)
     if not entity:
         raise HTTPException(status_code=404, detail="Entity not found")
     
-    class_names, top_5_activations, title, artist = await extract_plot_data(entity)
-    fig = await create_plot(class_names, top_5_activations, title, artist)
-    image_base64 = await convert_plot_to_base64(fig)
+    class_names, top_5_activations, title, artist = extract_plot_data(entity)
+    fig = create_plot(class_names, top_5_activations, title, artist)
+    image_base64 = convert_plot_to_base64(fig)
 
     return Response(content=image_base64, media_type="text/plain")
 
@@ -198,4 +211,15 @@ def ping_milvus_collection():
     - **return**: The status of the Milvus service.
     """
     milvus_status = ping_milvus()
-    return milvus_status
\ No newline at end of file
+    return milvus_status
+
+
+@router.get("/mirror", tags=["milvus"])
+def get_mirror_status(user=Depends(login_manager)):
+    """
+    Retrieves the state of the local mirror of the 512-d collection and the backend of the similarity routes.
+
+    - **user**: User - The authenticated user making the request.
+    - **return**: dict - The similarity backend, and the number of entities of the mirror and when it was synced.
+    """
+    return {"backend": DEFAULT_SETTINGS.similarity_backend, **embedding_mirror.status()}
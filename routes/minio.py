@@ -11,7 +11,8 @@ from core.config import login_manager, minio_client, DEFAULT_SETTINGS
 from core.database import get_db
 from models.minio import S3Object, UploadMP3ResponseList, UploadDetail, TempPath, PathsRequest
 from models.music import AlbumResponse, SongPath, MusicLibrary
-from services.minio import get_metadata_and_artwork, sanitize_filename, create_zip_from_minio_paths, delete_file_background_task
+from services.minio import get_metadata_and_artwork, sanitize_filename, create_zip_from_minio_paths, delete_file_background_task, embedding_exists
+from services.content_index import HashingReader, register_object, unregister_object
 from services.uploaded import store_upload_info, get_user_uploads, delete_user_upload_from_db
 
 
@@ -158,14 +159,16 @@ async def upload_file(file: UploadFile = File(...), user=Depends(login_manager),
         file_size = file.file.tell() 
         file.file.seek(0)  
 
-        # Stream the file directly to MinIO
+        # Stream the file directly to MinIO, hashing it on the way for the content index
+        reader = HashingReader(file.file)
         minio_client.put_object(
             bucket_name=DEFAULT_SETTINGS.minio_temp_bucket_name,
             object_name=secure_filename,
-            data=file.file,
+            data=reader,
             length=file_size,
             content_type=file.content_type
         )
+        register_object(db, reader.hexdigest(), DEFAULT_SETTINGS.minio_temp_bucket_name, secure_filename, reader.size)
 
         # Store upload information in the database and return the updated list of uploaded songs by the user
         # song_path_in_minio = f"{DEFAULT_SETTINGS.minio_temp_bucket_name}/{secure_filename}"
@@ -189,6 +192,7 @@ async def delete_temp_file(query: TempPath, user=Depends(login_manager), db: Ses
     """
     try:
         minio_client.remove_object(DEFAULT_SETTINGS.minio_temp_bucket_name, query.file_path)
+        unregister_object(db, DEFAULT_SETTINGS.minio_temp_bucket_name, query.file_path)
         # Also delete the upload information from the database and return the updated list of uploaded songs by the user
         delete_user_upload_from_db(db, user.id, query.file_path)
 
@@ -208,14 +212,9 @@ async def check_embeddings_extracted(filename: str):
     - **return**: dict - A dictionary containing the status of embeddings extraction.
     """
     try:
-        pkl_file = filename.rsplit(".", 1)[0] + ".pkl"
-        minio_client.get_object(DEFAULT_SETTINGS.minio_temp_bucket_name, pkl_file)
-        embeddings_extracted = True
+        embeddings_extracted = embedding_exists(filename)
     except S3Error as e:
-        if e.code == "NoSuchKey":
-            embeddings_extracted = False
-        else:
-            raise HTTPException(status_code=500, detail="Unexpected server error")
+        raise HTTPException(status_code=500, detail="Unexpected server error")
     except Exception as e:
         print(f"Unexpected error when checking embeddings for {filename}: {e}")
         embeddings_extracted = False
@@ -1,43 +1,77 @@
-import os
+from typing import List, Optional
+
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
+from sqlalchemy.orm import Session
 import torch
 
-from core.config import login_manager
+from core.config import login_manager, DEFAULT_SETTINGS
+from core.database import get_db
 from models.openl3 import PathForEmbedding
-from services.minio import get_temp_file_from_minio
-from services.music_net import create_preprocessed_spectrogram, get_production_model, predict_with_production_music_net
+from services.music_net import create_spectrogram_tensor_from_minio, music_net_model_registry, predict_genres, predict_with_production_music_net
+from services.music_net_catalog import get_precomputed_genres
 
 router = APIRouter(prefix="/music_net")
 
 
 class GenrePredictionResponse(BaseModel):
     genre: str
+    model_version: str
+    precomputed: bool = False
+
+
+class GenreBatchRequest(BaseModel):
+    file_paths: List[str]
+    top_k: int = 3
+
+
+class GenreProbability(BaseModel):
+    genre: str
+    probability: float
+
+
+class FileGenrePrediction(BaseModel):
+    file_path: str
+    genres: Optional[List[GenreProbability]] = None
+    error: Optional[str] = None
+    precomputed: bool = False
+
+
+class GenreBatchPredictionResponse(BaseModel):
+    predictions: List[FileGenrePrediction]
+    model_version: str
 
 @router.post("/predict-genre/", response_model=GenrePredictionResponse, tags=["music_net"])
-def predict_genre(query: PathForEmbedding, user=Depends(login_manager)):
+def predict_genre(query: PathForEmbedding, user=Depends(login_manager), db: Session = Depends(get_db)):
     """
-    Predicts the genre of a music segment using a pre-trained MusicNet model.
+    Predicts the genre of a music segment using a pre-trained MusicNet model. The genres of the catalog tracks are
+    served from the predictions precomputed by the active model version, inference only runs for the other files.
 
     - **audio_path**: str - The path to the audio file in the MinIO bucket.
-    - **return**: dict - A dictionary containing the predicted genre.
+    - **return**: dict - A dictionary containing the predicted genre, the version of the model used and whether
+      the genre was precomputed.
     """
     try:
-        # Load the production model
-        model = get_production_model()
+        # The version of the production model, resolved without loading it
+        model_version = music_net_model_registry.peek_version()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error loading model: {e}")
+
+    precomputed = get_precomputed_genres(db, [query.file_path], model_version)
+    if query.file_path in precomputed:
+        return {"genre": precomputed[query.file_path][0][0], "model_version": model_version, "precomputed": True}
+
+    try:
+        # Get the production model held by this worker, loaded on the first request that needs inference
+        model, model_version = music_net_model_registry.get()
         if model is None:
             raise HTTPException(status_code=500, detail="Failed to load the production model.")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error loading model: {e}")
 
     try:
-        # Retrieve the MP3 file from MinIO and write it to a temporary file
-        temp_file_path = get_temp_file_from_minio(query.file_path)
-
-        # Create a preprocessed spectrogram
-        img_tensor = create_preprocessed_spectrogram(temp_file_path)
-        if img_tensor is None:
-            raise HTTPException(status_code=500, detail="Failed to create the preprocessed spectrogram.")
+        # Decode the segment from the parts of the file read from MinIO and create a preprocessed spectrogram
+        img_tensor = create_spectrogram_tensor_from_minio(query.file_path)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating spectrogram: {e}")
 
@@ -46,8 +80,71 @@ def predict_genre(query: PathForEmbedding, user=Depends(login_manager)):
         genre = predict_with_production_music_net(model, img_tensor)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error predicting genre: {e}")
-    finally:
-        # Clean up the temporary file
-        os.remove(temp_file_path)
 
-    return {"genre": genre}
\ No newline at end of file
+    return {"genre": genre, "model_version": model_version}
+
+
+@router.post("/predict-genres/", response_model=GenreBatchPredictionResponse, tags=["music_net"])
+def predict_genres_batch(query: GenreBatchRequest, user=Depends(login_manager), db: Session = Depends(get_db)):
+    """
+    Predicts the genres of several music files at once: the files are preprocessed in parallel and classified by
+    the MusicNet model in a single batch. A file that fails is reported with its error, without failing the others.
+    The genres of the catalog tracks precomputed by the active model version are served without inference.
+
+    - **file_paths**: List[str] - The paths to the audio files in the MinIO buckets.
+    - **top_k**: int - The number of genres returned for each file, with their probabilities.
+    - **return**: dict - The predictions of each file, in order, and the version of the model used.
+    """
+    if not query.file_paths:
+        raise HTTPException(status_code=400, detail="No file path given.")
+    if len(query.file_paths) > DEFAULT_SETTINGS.music_net_batch_max_files:
+        raise HTTPException(status_code=400, detail=f"At most {DEFAULT_SETTINGS.music_net_batch_max_files} files can be predicted at once.")
+    if query.top_k < 1:
+        raise HTTPException(status_code=400, detail="top_k must be at least 1.")
+
+    try:
+        # The version of the production model, resolved without loading it
+        model_version = music_net_model_registry.peek_version()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error loading model: {e}")
+
+    precomputed = get_precomputed_genres(db, query.file_paths, model_version, k=query.top_k)
+    remaining = [file_path for file_path in query.file_paths if file_path not in precomputed]
+    if remaining:
+        try:
+            # The model is only loaded for the files that were not precomputed
+            model, active_version = music_net_model_registry.get()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error loading model: {e}")
+        if active_version != model_version:
+            # A new version was loaded in between: serve its own precomputed genres instead
+            model_version = active_version
+            precomputed = get_precomputed_genres(db, query.file_paths, model_version, k=query.top_k)
+            remaining = [file_path for file_path in query.file_paths if file_path not in precomputed]
+
+    results = predict_genres(model, remaining, k=query.top_k, max_workers=DEFAULT_SETTINGS.music_net_preprocess_workers) if remaining else []
+    results = {result["file_path"]: result for result in results}
+    for file_path, genres in precomputed.items():
+        results[file_path] = {"file_path": file_path, "genres": genres, "error": None, "precomputed": True}
+
+    predictions = [
+        {
+            "file_path": file_path,
+            "genres": [{"genre": genre, "probability": probability} for genre, probability in results[file_path]["genres"]] if results[file_path]["genres"] else None,
+            "error": results[file_path]["error"],
+            "precomputed": results[file_path].get("precomputed", False),
+        }
+        for file_path in query.file_paths
+    ]
+    return {"predictions": predictions, "model_version": model_version}
+
+
+@router.get("/model", tags=["music_net"])
+def get_model_status(user=Depends(login_manager)):
+    """
+    Retrieves the state of the MusicNet model held by this worker.
+
+    - **user**: User - The authenticated user making the request.
+    - **return**: dict - The active model version (fingerprint of the artifact in MinIO), its inference backend, when it was loaded and when it was last checked.
+    """
+    return {**music_net_model_registry.status(), "backend": DEFAULT_SETTINGS.music_net_backend}
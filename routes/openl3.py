@@ -1,16 +1,19 @@
-import os
-import pickle
-import tempfile
+import json
+import asyncio
 from datetime import datetime
 import time
 
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
-from core.config import login_manager
+from core.config import login_manager, DEFAULT_SETTINGS
 from core.database import get_db
-from models.openl3 import EmbeddingResponse, OpenL3ComputationLog, PathForEmbedding
-from services.minio import load_model_from_minio, get_temp_file_from_minio, get_embedding_pkl, save_embedding_pkl
+from core.jobs import JobQueueFullError
+from models.openl3 import EmbeddingResponse, OpenL3ComputationLog, PathForEmbedding, EmbeddingJobResponse
+from services.minio import openl3_model_registry, get_embedding
+from services.content_index import reuse_duplicate_embedding
+from services.embedding_jobs import embedding_job_queue, run_embedding_job, compute_and_save_embedding
 
 
 router = APIRouter(prefix="/openl3")
@@ -21,10 +24,11 @@ def get_embeddings(query: PathForEmbedding, user=Depends(login_manager), db: Ses
     """
     Retrieves or computes the embeddings for a specified audio file.
 
-    This function first checks if the embeddings for the specified audio file already exist as a .pkl file in MinIO.
-    If they do, it returns them. If not, it loads a model from MinIO, retrieves the specified audio file as a temporary file,
-    computes the embeddings using the loaded model, saves the embeddings to a .pkl file in MinIO, cleans up the temporary file,
-    and then returns the embeddings. If the process fails, it raises an HTTPException with status code 500.
+    This function first checks if the embeddings for the specified audio file already exist in MinIO (as a binary .emb
+    file, or a former .pkl file). If they do, it returns them. If an identical file (same content hash) was already embedded,
+    as another upload or as a MegaSet file in Milvus, its embeddings are reused. If not, it takes the OpenL3 model held by the worker (loaded from
+    MinIO on first use), retrieves the specified audio file as a temporary file, computes the embeddings using the model, saves
+    the embeddings to a binary .emb file in MinIO, cleans up the temporary file, and then returns the embeddings. If the process fails, it raises an HTTPException with status code 500.
 
     Parameters:
     - file_path (str): The path to the audio file for which embeddings are to be computed or retrieved.
@@ -36,21 +40,12 @@ def get_embeddings(query: PathForEmbedding, user=Depends(login_manager), db: Ses
     """
     start_time = time.time()
     try:
-        existing_embeddings = get_embedding_pkl(query.file_path)
+        existing_embeddings = (get_embedding(query.file_path, exact=not DEFAULT_SETTINGS.openl3_sampled_excerpts)
+                               or reuse_duplicate_embedding(db, query.file_path))
         if existing_embeddings:
             return EmbeddingResponse(file_name=query.file_path, embedding=existing_embeddings)
 
-        embedding_512_model = load_model_from_minio()
-        temp_file_path = get_temp_file_from_minio(query.file_path)
-        vector = embedding_512_model.compute(temp_file_path)
-        embedding = vector.mean(axis=0)
-        
-        with tempfile.NamedTemporaryFile(delete=False) as temp_pkl:
-            pickle.dump(embedding.tolist(), temp_pkl)
-            temp_pkl.seek(0)
-            save_embedding_pkl(query.file_path.replace(".mp3", ".pkl"), temp_pkl.name)
-        
-        os.unlink(temp_file_path)
+        embedding, model_version = compute_and_save_embedding(query.file_path)
 
         # Log the computation activity
         computation_time_ms = (time.time() - start_time) * 1000
@@ -58,7 +53,7 @@ def get_embeddings(query: PathForEmbedding, user=Depends(login_manager), db: Ses
             user_id=user.id,
             datetime=datetime.now(),
             file_path=query.file_path,
-            model_version="V1", # Hardcoded model version for now
+            model_version=model_version,
             response_time_ms=computation_time_ms
         )
         db.add(log_entry)
@@ -73,10 +68,91 @@ def get_embeddings(query: PathForEmbedding, user=Depends(login_manager), db: Ses
             user_id=user.id,
             datetime=datetime.now(),
             file_path=query.file_path,
-            model_version="V1",  # 
+            model_version=openl3_model_registry.version,
             response_time_ms=0,  # Set to 0 since the computation failed
             error_message=error_message 
         )
         db.add(log_entry)
         db.commit()
-        raise HTTPException(status_code=500, detail=f"Failed to process the request: {error_message}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to process the request: {error_message}")
+
+
+@router.get("/model", tags=["OpenL3"])
+def get_model_status(user=Depends(login_manager)):
+    """
+    Retrieves the state of the OpenL3 model held by this worker.
+
+    - **user**: User - The authenticated user making the request.
+    - **return**: dict - The active model version (ETag of the graph in MinIO), when it was loaded and when it was last checked.
+    """
+    return openl3_model_registry.status()
+
+
+@router.post("/jobs/", response_model=EmbeddingJobResponse, tags=["OpenL3"])
+def submit_embedding_job(query: PathForEmbedding, user=Depends(login_manager)):
+    """
+    Submits a background job retrieving or computing the embeddings for a specified audio file.
+
+    Submissions for a file whose job is already queued, running or done return that job instead of creating a new one.
+
+    - **query**: PathForEmbedding - The path to the audio file for which embeddings are to be computed or retrieved.
+    - **user**: User - The authenticated user making the request.
+    - **return**: EmbeddingJobResponse - The state of the job, to be followed with its job_id.
+    """
+    try:
+        job, _ = embedding_job_queue.submit(query.file_path, run_embedding_job, query.file_path, user.id)
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return job.to_dict()
+
+
+@router.get("/jobs/stats", tags=["OpenL3"])
+def get_embedding_jobs_stats(user=Depends(login_manager)):
+    """
+    Retrieves the state of the embedding job queue of this worker.
+
+    - **user**: User - The authenticated user making the request.
+    - **return**: dict - The number of queued, running and finished jobs, and the mean duration of each job stage.
+    """
+    return embedding_job_queue.stats()
+
+
+@router.get("/jobs/{job_id}", response_model=EmbeddingJobResponse, tags=["OpenL3"])
+def get_embedding_job(job_id: str, user=Depends(login_manager)):
+    """
+    Retrieves the state, progress and per-stage timings of an embedding job.
+
+    - **job_id**: str - The identifier of the job.
+    - **user**: User - The authenticated user making the request.
+    - **return**: EmbeddingJobResponse - The state of the job, with the embeddings once done.
+    """
+    job = embedding_job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@router.get("/jobs/{job_id}/events", tags=["OpenL3"])
+async def stream_embedding_job(job_id: str, user=Depends(login_manager)):
+    """
+    Streams the state of an embedding job as Server-Sent Events, one event per change, until the job is finished.
+
+    - **job_id**: str - The identifier of the job.
+    - **user**: User - The authenticated user making the request.
+    - **return**: StreamingResponse - A text/event-stream of job states.
+    """
+    job = embedding_job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        revision = None
+        while True:
+            if job.revision != revision:
+                revision = job.revision
+                yield f"data: {json.dumps(job.to_dict())}\n\n"
+                if job.finished:
+                    break
+            await asyncio.sleep(0.25)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
@@ -0,0 +1,217 @@
+import argparse
+import hashlib
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from core.config import DEFAULT_SETTINGS, SessionLocal, minio_client
+from core.metrics import EMBEDDING_DEDUP_LOOKUPS, EMBEDDING_DEDUP_SAVED_SECONDS
+from models.minio import AudioContentHash
+from models.openl3 import OpenL3ComputationLog
+from services.milvus import get_milvus_512_collection
+from services.milvus_ids import query_by_paths
+from services.minio import get_embedding, save_embedding
+
+
+class HashingReader:
+    """
+    File-like wrapper computing the SHA-256 and size of a stream while it is read, so that an upload
+    is hashed as it streams to MinIO, without a second pass over the file.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.hash.update(data)
+        self.size += len(data)
+        return data
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+def register_object(db: Session, sha256: str, bucket: str, object_name: str, size: int):
+    """
+    Records the content hash of an object stored in MinIO, replacing the previous hash of the object if it was overwritten.
+
+    Args:
+        db (Session): The SQLAlchemy session object.
+        sha256 (str): The SHA-256 of the object's content, in hexadecimal.
+        bucket (str): The bucket of the object.
+        object_name (str): The name of the object.
+        size (int): The size of the object in bytes.
+    """
+    db.query(AudioContentHash).filter_by(bucket=bucket, object_name=object_name).delete()
+    db.add(AudioContentHash(sha256=sha256, bucket=bucket, object_name=object_name, size=size, created_at=datetime.now()))
+    db.commit()
+
+
+def unregister_object(db: Session, bucket: str, object_name: str):
+    """
+    Removes an object deleted from MinIO from the content index.
+
+    Args:
+        db (Session): The SQLAlchemy session object.
+        bucket (str): The bucket of the object.
+        object_name (str): The name of the object.
+    """
+    db.query(AudioContentHash).filter_by(bucket=bucket, object_name=object_name).delete()
+    db.commit()
+
+
+def get_object_hash(db: Session, bucket: str, object_name: str):
+    """
+    Retrieves the content hash of an object stored in MinIO.
+
+    Args:
+        db (Session): The SQLAlchemy session object.
+        bucket (str): The bucket of the object.
+        object_name (str): The name of the object.
+
+    Returns:
+        str or None: The SHA-256 of the object's content, or None if the object is not indexed.
+    """
+    entry = db.query(AudioContentHash).filter_by(bucket=bucket, object_name=object_name).first()
+    return entry.sha256 if entry else None
+
+
+def get_mean_computation_seconds(db: Session):
+    """
+    Computes the mean duration of the successful OpenL3 computations, used to estimate the compute time saved by a hit.
+
+    Args:
+        db (Session): The SQLAlchemy session object.
+
+    Returns:
+        float: The mean duration in seconds, 0 if no computation was logged.
+    """
+    mean_ms = db.query(func.avg(OpenL3ComputationLog.response_time_ms)).filter(
+        OpenL3ComputationLog.error_message.is_(None),
+        OpenL3ComputationLog.response_time_ms > 0,
+    ).scalar()
+    return (mean_ms or 0) / 1000
+
+
+def find_duplicate_embedding(db: Session, file_path: str):
+    """
+    Looks for the embedding of an audio file identical to an uploaded file, by content hash.
+
+    The embeddings already extracted for other uploads with the same content are looked up first, then the
+    embeddings of the MegaSet files with the same content, in the 512-d Milvus collection. Embeddings approximated
+    from sampled excerpts are not reused, as they would be saved as exact ones.
+
+    Args:
+        db (Session): The SQLAlchemy session object.
+        file_path (str): The path of the uploaded file in the temp bucket.
+
+    Returns:
+        tuple or None: The embedding (a list of floats) and its source ("upload" or "library"), or None if no
+            identical audio has an embedding.
+    """
+    sha256 = get_object_hash(db, DEFAULT_SETTINGS.minio_temp_bucket_name, file_path)
+    if sha256 is None:
+        return None
+
+    duplicates = db.query(AudioContentHash).filter(
+        AudioContentHash.sha256 == sha256,
+        AudioContentHash.object_name != file_path,
+    ).all()
+    uploads = [entry.object_name for entry in duplicates if entry.bucket == DEFAULT_SETTINGS.minio_temp_bucket_name]
+    library = [entry.object_name for entry in duplicates if entry.bucket == DEFAULT_SETTINGS.minio_bucket_name]
+
+    for object_name in uploads:
+        embedding = get_embedding(object_name, exact=True)
+        if embedding:
+            return embedding, "upload"
+
+    if library:
+        collection_512 = get_milvus_512_collection()
+        entities = query_by_paths(collection_512, library, output_fields=["embedding"])
+        if entities:
+            return [float(value) for value in entities[0]["embedding"]], "library"
+    return None
+
+
+def reuse_duplicate_embedding(db: Session, file_path: str):
+    """
+    Reuses the embedding of identical audio for an uploaded file, saving it under the file's own name so that
+    later lookups are direct. Hits, misses and the estimated compute time saved are tracked as metrics.
+
+    Args:
+        db (Session): The SQLAlchemy session object.
+        file_path (str): The path of the uploaded file in the temp bucket.
+
+    Returns:
+        list or False: The embedding (a list of floats) if identical audio has one, otherwise False.
+    """
+    duplicate = find_duplicate_embedding(db, file_path)
+    if duplicate is None:
+        EMBEDDING_DEDUP_LOOKUPS.labels(result="miss").inc()
+        return False
+
+    embedding, source = duplicate
+    save_embedding(file_path, embedding, model_version=f"dedup-{source}")
+    EMBEDDING_DEDUP_LOOKUPS.labels(result=source).inc()
+    EMBEDDING_DEDUP_SAVED_SECONDS.inc(get_mean_computation_seconds(db))
+    return embedding
+
+
+def hash_object(bucket: str, object_name: str, chunk_size: int = 1024 * 1024):
+    """
+    Computes the SHA-256 of an object stored in MinIO, streaming it chunk by chunk.
+
+    Args:
+        bucket (str): The bucket of the object.
+        object_name (str): The name of the object.
+        chunk_size (int): The size of the chunks read from MinIO.
+
+    Returns:
+        tuple: The SHA-256 in hexadecimal and the size of the object in bytes.
+    """
+    response = minio_client.get_object(bucket, object_name)
+    try:
+        reader = HashingReader(response)
+        while reader.read(chunk_size):
+            pass
+        return reader.hexdigest(), reader.size
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def index_bucket(db: Session, bucket: str, prefix: str = ""):
+    """
+    Adds the objects of a bucket not yet in the content index, e.g. to index the MegaSet files of the music bucket.
+
+    Args:
+        db (Session): The SQLAlchemy session object.
+        bucket (str): The bucket to index.
+        prefix (str): Only index the objects whose name starts with this prefix.
+
+    Returns:
+        int: The number of objects indexed.
+    """
+    indexed = {entry.object_name for entry in db.query(AudioContentHash.object_name).filter_by(bucket=bucket)}
+    count = 0
+    for obj in minio_client.list_objects(bucket, prefix=prefix, recursive=True):
+        if obj.is_dir or obj.object_name in indexed or not obj.object_name.lower().endswith(".mp3"):
+            continue
+        sha256, size = hash_object(bucket, obj.object_name)
+        register_object(db, sha256, bucket, obj.object_name, size)
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Adds the MP3 files of a MinIO bucket to the content-hash index.")
+    parser.add_argument("--bucket", default=DEFAULT_SETTINGS.minio_bucket_name, help="The bucket to index.")
+    parser.add_argument("--prefix", default="", help="Only index the objects under this prefix.")
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        print(f"Indexed {index_bucket(db, args.bucket, args.prefix)} objects of {args.bucket}")
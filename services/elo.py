@@ -0,0 +1,95 @@
+import atexit
+from datetime import datetime
+
+from core.config import DEFAULT_SETTINGS, SessionLocal
+from core.elo import STAT_FIELDS, EloStore
+from models.elo import EloRating, EloVote
+
+
+# Model compared with MusicNet: the genre head of the Essentia models (predictions of the 87-d Milvus collection)
+ESSENTIA_MODEL_ID = "essentia:mtg_jamendo_genre"
+
+
+def get_music_net_model_id(version: str):
+    """
+    Names a version of the MusicNet model as a competitor in the Elo ratings.
+
+    Args:
+        version (str): The version of the MusicNet model, as reported with its predictions.
+
+    Returns:
+        str: The identifier of the model.
+    """
+    return f"music_net:{version}"
+
+
+def _to_stats(row):
+    return {field: getattr(row, field) for field in STAT_FIELDS}
+
+
+def load_ratings(session_factory=SessionLocal):
+    """
+    Loads the persisted Elo stats of the models.
+
+    Args:
+        session_factory (callable): Creates the SQLAlchemy sessions.
+
+    Returns:
+        dict: The stats of each model (rating, wins, losses, draws, votes), by model.
+    """
+    with session_factory() as db:
+        return {row.model: _to_stats(row) for row in db.query(EloRating)}
+
+
+def persist_votes(votes, changes, session_factory=SessionLocal, initial_rating=DEFAULT_SETTINGS.elo_initial_rating):
+    """
+    Writes a batch of votes and the changes of the models' stats they caused, in a single transaction. The changes
+    are added to the persisted stats, so that the batches of several processes add up.
+
+    Args:
+        votes (list): The votes, as dicts with the models, score, rating change, creation time, user and file.
+        changes (dict): The changes of the stats of each model, by model.
+        session_factory (callable): Creates the SQLAlchemy sessions.
+        initial_rating (float): The rating of a model before its first vote.
+
+    Returns:
+        dict: The persisted stats of each model after the batch, by model.
+    """
+    now = datetime.now()
+    with session_factory() as db:
+        rows = {row.model: row for row in db.query(EloRating).filter(EloRating.model.in_(list(changes))).with_for_update()}
+        for model, delta in changes.items():
+            row = rows.get(model)
+            if row is None:
+                row = EloRating(model=model, rating=initial_rating, wins=0, losses=0, draws=0, votes=0)
+                db.add(row)
+            for field in STAT_FIELDS:
+                setattr(row, field, getattr(row, field) + delta[field])
+            row.updated_at = now
+
+        db.bulk_insert_mappings(EloVote, [
+            {
+                "user_id": vote.get("user_id"),
+                "file_path": vote.get("file_path"),
+                "model_a": vote["model_a"],
+                "model_b": vote["model_b"],
+                "score": vote["score"],
+                "rating_change": vote["rating_change"],
+                "created_at": datetime.fromtimestamp(vote["created_at"]),
+            }
+            for vote in votes
+        ])
+        db.commit()
+        return {row.model: _to_stats(row) for row in db.query(EloRating)}
+
+
+# Elo ratings of this worker process, written to the database in batches
+elo_store = EloStore(
+    load_ratings,
+    persist_votes,
+    k_factor=DEFAULT_SETTINGS.elo_k_factor,
+    initial_rating=DEFAULT_SETTINGS.elo_initial_rating,
+    flush_interval_seconds=DEFAULT_SETTINGS.elo_flush_interval_seconds,
+    flush_max_votes=DEFAULT_SETTINGS.elo_flush_max_votes,
+)
+atexit.register(elo_store.close)
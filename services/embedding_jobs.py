@@ -0,0 +1,148 @@
+import time
+from contextlib import ExitStack, nullcontext
+from datetime import datetime
+
+from core.config import DEFAULT_SETTINGS, SessionLocal
+from core.embedding_format import sampled_model_version
+from core.jobs import LocalJobQueue
+from models.openl3 import OpenL3ComputationLog
+from services.content_index import reuse_duplicate_embedding
+from services.minio import openl3_model_registry, open_audio, get_embedding, save_embedding
+
+
+def create_job_queue(name: str):
+    """
+    Creates a job queue with the backend and limits set in the configuration.
+
+    Args:
+        name (str): The name of the queue.
+
+    Returns:
+        LocalJobQueue: The job queue.
+
+    Raises:
+        ValueError: If the configured backend is not supported.
+    """
+    if DEFAULT_SETTINGS.embedding_jobs_backend == "local":
+        return LocalJobQueue(
+            name,
+            max_workers=DEFAULT_SETTINGS.embedding_jobs_workers,
+            max_queued=DEFAULT_SETTINGS.embedding_jobs_max_queued,
+            ttl_seconds=DEFAULT_SETTINGS.embedding_jobs_ttl_seconds,
+        )
+    raise ValueError(f"Unsupported job queue backend: {DEFAULT_SETTINGS.embedding_jobs_backend}")
+
+
+embedding_job_queue = create_job_queue("openl3_embeddings")
+
+
+def log_openl3_computation(user_id: int, file_path: str, model_version: str, response_time_ms: float, error_message: str = None):
+    """
+    Logs an OpenL3 computation in the openl3_computation_log table.
+
+    Args:
+        user_id (int): The ID of the user who requested the computation.
+        file_path (str): The path to the audio file.
+        model_version (str): The version of the OpenL3 model used.
+        response_time_ms (float): The duration of the computation in milliseconds, 0 if it failed.
+        error_message (str): The error message, if the computation failed.
+    """
+    with SessionLocal() as db:
+        db.add(OpenL3ComputationLog(
+            user_id=user_id,
+            datetime=datetime.now(),
+            file_path=file_path,
+            model_version=model_version,
+            response_time_ms=response_time_ms,
+            error_message=error_message,
+        ))
+        db.commit()
+
+
+def compute_and_save_embedding(file_path: str, job=None):
+    """
+    Computes the mean OpenL3 embedding of an audio file and saves it to MinIO in the binary embedding format.
+    If `openl3_sampled_excerpts` is set, the mean is approximated from that many excerpts of the track, and its model
+    version is tagged as such (see sampled_model_version), so that it is not reused where an exact one is expected.
+
+    Args:
+        file_path (str): The path to the audio file in MinIO.
+        job (Job): The job to time the stages of and report the progress to, if run as a background job.
+
+    Returns:
+        tuple: The embedding as a numpy array, and the version of the model that computed it.
+    """
+    stage = job.run_stage if job is not None else lambda name: nullcontext()
+    segments = {"count": 0}
+
+    def progress(done, total):
+        segments["count"] = done
+        if job is not None:
+            job.set_progress(done, total)
+
+    with stage("model"):
+        embedding_512_model, model_version = openl3_model_registry.get()
+    with ExitStack() as stack:
+        with stage("download"):
+            audio_file = stack.enter_context(open_audio(file_path, embedding_512_model.mel_extractor.sr))
+        with stage("extract"):
+            if DEFAULT_SETTINGS.openl3_sampled_excerpts:
+                embedding = embedding_512_model.compute_sampled_mean(
+                    audio_file,
+                    n_excerpts=DEFAULT_SETTINGS.openl3_sampled_excerpts,
+                    excerpt_seconds=DEFAULT_SETTINGS.openl3_excerpt_seconds,
+                    selection=DEFAULT_SETTINGS.openl3_excerpt_selection,
+                    progress=progress,
+                )
+                model_version = sampled_model_version(
+                    model_version,
+                    DEFAULT_SETTINGS.openl3_sampled_excerpts,
+                    DEFAULT_SETTINGS.openl3_excerpt_seconds,
+                    DEFAULT_SETTINGS.openl3_excerpt_selection,
+                )
+            else:
+                embedding = embedding_512_model.compute_mean(
+                    audio_file,
+                    window_seconds=DEFAULT_SETTINGS.openl3_stream_window_seconds,
+                    progress=progress,
+                )
+
+    with stage("upload"):
+        save_embedding(file_path, embedding, model_version=model_version,
+                       hop_time=embedding_512_model.hop_time, segment_count=segments["count"])
+    return embedding, model_version
+
+
+def run_embedding_job(job, file_path: str, user_id: int):
+    """
+    Retrieves or computes the embeddings of an audio file, as a background job.
+
+    The stages of the job (lookup of existing embeddings, including those of identical audio, model, download, extract, upload) are timed,
+    and the progress of the extraction is reported window by window.
+
+    Args:
+        job (Job): The job being run.
+        file_path (str): The path to the audio file in MinIO.
+        user_id (int): The ID of the user who submitted the job.
+
+    Returns:
+        dict: The file name and its embeddings.
+    """
+    start_time = time.time()
+    model_version = None
+    try:
+        with job.run_stage("lookup"):
+            existing_embeddings = get_embedding(file_path, exact=not DEFAULT_SETTINGS.openl3_sampled_excerpts)
+            if not existing_embeddings:
+                with SessionLocal() as db:
+                    existing_embeddings = reuse_duplicate_embedding(db, file_path)
+        if existing_embeddings:
+            return {"file_name": file_path, "embedding": existing_embeddings}
+
+        embedding, model_version = compute_and_save_embedding(file_path, job)
+
+        log_openl3_computation(user_id, file_path, model_version, (time.time() - start_time) * 1000)
+        return {"file_name": file_path, "embedding": embedding.tolist()}
+    except Exception as e:
+        log_openl3_computation(user_id, file_path, model_version or openl3_model_registry.version, 0, error_message=str(e))
+        raise
@@ -0,0 +1,52 @@
+import argparse
+import time
+
+from core.config import DEFAULT_SETTINGS
+from core.embedding_mirror import METADATA_FIELDS, write_mirror
+from services.milvus import get_milvus_512_collection
+
+
+def iter_collection(collection, batch_size=1000):
+    """
+    Reads all the entities of a Milvus collection, batch by batch.
+
+    Args:
+        collection (Collection): The collection to read.
+        batch_size (int): The number of entities per batch.
+
+    Yields:
+        list: The entities of a batch, as dicts with their id, METADATA_FIELDS and embedding.
+    """
+    iterator = collection.query_iterator(batch_size=batch_size, output_fields=["id", *METADATA_FIELDS, "embedding"])
+    try:
+        while batch := iterator.next():
+            yield batch
+    finally:
+        iterator.close()
+
+
+def sync_mirror(collection, directory, dim=512, batch_size=1000):
+    """
+    Exports a Milvus collection to a local embedding mirror, replacing the previous one once complete.
+
+    Args:
+        collection (Collection): The collection to export.
+        directory (str): The directory of the mirror.
+        dim (int): The dimension of the embeddings.
+        batch_size (int): The number of entities read at once.
+
+    Returns:
+        int: The number of entities exported.
+    """
+    return write_mirror(directory, iter_collection(collection, batch_size), dim)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exports the 512-d Milvus collection to the local embedding mirror.")
+    parser.add_argument("--output-dir", default=DEFAULT_SETTINGS.embedding_mirror_dir, help="Directory of the mirror.")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Number of entities read from Milvus at once.")
+    args = parser.parse_args()
+
+    start = time.time()
+    count = sync_mirror(get_milvus_512_collection(), args.output_dir, batch_size=args.batch_size)
+    print(f"Exported {count} entities to {args.output_dir} in {time.time() - start:.0f} s")
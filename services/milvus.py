@@ -1,67 +1,100 @@
 import io
 import base64
+from datetime import datetime
 from typing import List
 import json
 
 import numpy as np
-import matplotlib.pyplot as plt
-from pymilvus import Collection, connections
+from matplotlib.figure import Figure
+from sqlalchemy.orm import Session
 
 from core.config import DEFAULT_SETTINGS
+from core.milvus_pool import MilvusPool
+from models.milvus import CollectionVersion
+
+
+# Connection and collection handles of this worker process, opened on first use
+milvus_pool = MilvusPool(
+    DEFAULT_SETTINGS.milvus_uri,
+    DEFAULT_SETTINGS.milvus_api_key,
+    health_check_interval_seconds=DEFAULT_SETTINGS.milvus_health_check_interval_seconds,
+)
 
 
 def ping_milvus():
     """
-    Attempts to connect to the Milvus database using settings from the configuration and performs a simple query to check if the connection is successful.
+    Performs a simple query on the 512-dimensional collection through the worker's Milvus connection, which keeps the
+    database from going idle, and reports the state of the connection.
 
     Returns:
-        A dictionary with a status message indicating the outcome of the connection attempt.
+        A dictionary with a status message indicating the outcome of the query, and the state of the connection pool.
     """
     try:
-        connections.connect(
-            "default",
-            uri=DEFAULT_SETTINGS.milvus_uri,
-            token=DEFAULT_SETTINGS.milvus_api_key,
-        )
-        embedding_512 = Collection(name=DEFAULT_SETTINGS.milvus_512_collection_name)
-        response = embedding_512.query(
+        embedding_512 = get_milvus_512_collection()
+        embedding_512.query(
             expr="id in [0]",
             output_fields=["artist"],
         )
-        if response:
-            return {"status": "success", "message": "Milvus is running"}
+        return {"status": "success", "message": "Milvus is running", "pool": milvus_pool.status()}
     except Exception as e:
-        return {"status": "error", "message": str(e)}
+        return {"status": "error", "message": str(e), "pool": milvus_pool.status()}
 
 
 def get_milvus_512_collection():
     """
-    Connects to the Milvus database and retrieves the collection specified for 512-dimensional vectors.
+    Retrieves the collection specified for 512-dimensional vectors, from the worker's Milvus connection.
 
     Returns:
-        The Milvus Collection object corresponding to the 512-dimensional vector collection.
+        The handle of the Milvus Collection corresponding to the 512-dimensional vector collection.
     """
-    connections.connect(
-        "default",
-        uri=DEFAULT_SETTINGS.milvus_uri,
-        token=DEFAULT_SETTINGS.milvus_api_key,
-    )
-    return Collection(name=DEFAULT_SETTINGS.milvus_512_collection_name)
+    return milvus_pool.get_collection(DEFAULT_SETTINGS.milvus_512_collection_name)
 
 
 def get_milvus_87_collection():
     """
-    Connects to the Milvus database and retrieves the collection specified for 87-dimensional vectors.
+    Retrieves the collection specified for 87-dimensional vectors, from the worker's Milvus connection.
+
+    Returns:
+        The handle of the Milvus Collection corresponding to the 87-dimensional vector collection.
+    """
+    return milvus_pool.get_collection(DEFAULT_SETTINGS.milvus_87_collection_name)
+
+
+def get_collection_version(db: Session, name: str):
+    """
+    Retrieves the version stamp of a Milvus collection.
+
+    Args:
+        db (Session): The SQLAlchemy session object.
+        name (str): The name of the collection.
+
+    Returns:
+        int: The version of the collection, 0 if it was never written through the API.
+    """
+    row = db.query(CollectionVersion).filter_by(name=name).first()
+    return row.version if row else 0
+
+
+def bump_collection_version(db: Session, name: str):
+    """
+    Increments the version stamp of a Milvus collection after its entities were written, which invalidates the
+    cached results read from it.
+
+    Args:
+        db (Session): The SQLAlchemy session object.
+        name (str): The name of the collection.
 
     Returns:
-        The Milvus Collection object corresponding to the 87-dimensional vector collection.
+        int: The new version of the collection.
     """
-    connections.connect(
-        "default",
-        uri=DEFAULT_SETTINGS.milvus_uri,
-        token=DEFAULT_SETTINGS.milvus_api_key,
-    )
-    return Collection(name=DEFAULT_SETTINGS.milvus_87_collection_name)
+    row = db.query(CollectionVersion).filter_by(name=name).with_for_update().first()
+    if row is None:
+        row = CollectionVersion(name=name, version=0)
+        db.add(row)
+    row.version += 1
+    row.updated_at = datetime.now()
+    db.commit()
+    return row.version
 
 
 def full_hit_to_dict(hit):
@@ -134,7 +167,7 @@ def sort_entities(entities):
     return response_list
 
 
-async def extract_plot_data(entity):
+def extract_plot_data(entity):
     """
     Extracts data from a single entity for the purpose of generating a genre prediction plot.
 
@@ -166,9 +199,10 @@ async def extract_plot_data(entity):
     return class_names, top_5_activations, title, artist
 
 
-async def create_plot(class_names: List[str], top_5_activations: List[float], title: str, artist: str):
+def create_plot(class_names: List[str], top_5_activations: List[float], title: str, artist: str):
     """
-    Generates a horizontal bar plot visualizing the top 5 music genre predictions for a given track.
+    Generates a horizontal bar plot visualizing the top 5 music genre predictions for a given track. The figure is
+    built without pyplot's global state, so that plots can be created from several threads.
 
     Args:
         class_names: The names of the top 5 predicted genres.
@@ -179,16 +213,17 @@ async def create_plot(class_names: List[str], top_5_activations: List[float], ti
     Returns:
         A matplotlib figure object containing the generated plot.
     """
-    fig, ax = plt.subplots(figsize=(6, 2))
-    plt.barh(class_names, top_5_activations, color='#60a5fa', edgecolor='#cbd5e1')
-    plt.title(f'Genres for {title} by {artist}', color='#cbd5e1')
-    plt.tick_params(colors='#cbd5e1')
+    fig = Figure(figsize=(6, 2))
+    ax = fig.subplots()
+    ax.barh(class_names, top_5_activations, color='#60a5fa', edgecolor='#cbd5e1')
+    ax.set_title(f'Genres for {title} by {artist}', color='#cbd5e1')
+    ax.tick_params(colors='#cbd5e1')
     ax.set_facecolor('#111827')
     fig.patch.set_facecolor('#111827')
     return fig
 
 
-async def convert_plot_to_base64(fig):
+def convert_plot_to_base64(fig):
     """
     Converts a matplotlib plot to a base64-encoded string for embedding in web pages or other digital formats.
 
@@ -0,0 +1,225 @@
+import argparse
+import json
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy.orm import Session
+
+from core.config import DEFAULT_SETTINGS, SessionLocal
+from core.metrics import MILVUS_PATH_ID_LOOKUPS
+from models.milvus import MilvusEntityId
+from models.music import MusicLibrary
+
+
+class PathIdIndex:
+    """
+    In-memory index of the Milvus primary keys of the tracks, by collection and path, loaded from the
+    milvus_entity_ids table on first use and reloaded at most once every `reload_interval_seconds` to pick up the
+    mappings written by the sync job.
+
+    If the table cannot be read, the index stays empty (or keeps its previous content) until the next reload, and
+    lookups fall back to path filters. Ids found by path filter are added to the index, so that a stale mapping is
+    only looked up once.
+
+    Attributes:
+        session_factory (callable): Creates the SQLAlchemy sessions.
+        reload_interval_seconds (float): The minimum delay between two loads of the table.
+    """
+
+    def __init__(self, session_factory=SessionLocal, reload_interval_seconds=300):
+        self.session_factory = session_factory
+        self.reload_interval_seconds = reload_interval_seconds
+
+        # Collection -> path -> Milvus id, replaced as a whole on reload
+        self._ids = {}
+        self._last_load = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def get_ids(self, collection, paths):
+        """
+        Resolves paths to the Milvus primary keys of their entities in a collection.
+
+        Args:
+            collection (str): The name of the collection.
+            paths (list): The paths.
+
+        Returns:
+            tuple: The ids of the paths found, by path, and the paths missing from the index.
+        """
+        ids = self._get().get(collection, {})
+        found = {path: ids[path] for path in paths if path in ids}
+        missing = [path for path in paths if path not in ids]
+        return found, missing
+
+    def update(self, collection, ids):
+        """
+        Adds or replaces the ids of paths in a collection until the next reload.
+
+        Args:
+            collection (str): The name of the collection.
+            ids (dict): The Milvus ids by path.
+        """
+        self._get()
+        with self._lock:
+            self._ids.setdefault(collection, {}).update(ids)
+
+    def status(self):
+        """
+        Describes the state of the index.
+
+        Returns:
+            dict: The number of paths indexed per collection and when the index was loaded.
+        """
+        return {
+            "collections": {collection: len(ids) for collection, ids in self._ids.items()},
+            "loaded_at": self._loaded_at.isoformat() if self._loaded_at else None,
+        }
+
+    def _get(self):
+        if self._last_load is not None and time.monotonic() - self._last_load < self.reload_interval_seconds:
+            return self._ids
+        with self._lock:
+            if self._last_load is None or time.monotonic() - self._last_load >= self.reload_interval_seconds:
+                try:
+                    with self.session_factory() as db:
+                        ids = {}
+                        for row in db.query(MilvusEntityId.collection, MilvusEntityId.path, MilvusEntityId.milvus_id):
+                            ids.setdefault(row.collection, {})[row.path] = row.milvus_id
+                    self._ids = ids
+                    self._loaded_at = datetime.now()
+                except Exception as e:
+                    print(f"Error loading the Milvus id index, filtering by path until the next reload: {e}")
+                self._last_load = time.monotonic()
+            return self._ids
+
+
+# Milvus ids of the tracks, shared by the lookups of this worker process
+path_id_index = PathIdIndex(reload_interval_seconds=DEFAULT_SETTINGS.milvus_path_index_reload_interval_seconds)
+
+
+def format_string_list(values):
+    """
+    Formats strings as a list literal of a Milvus expression, escaping their quotes and backslashes.
+    """
+    return "[" + ", ".join(json.dumps(value, ensure_ascii=False) for value in values) + "]"
+
+
+def query_by_paths(collection, paths, output_fields, index=None, **kwargs):
+    """
+    Retrieves the entities of paths in a collection: by primary key for the paths in the id index, and by a filter on
+    the path field, with the paths escaped, for the others.
+
+    The indexed paths whose entity is not returned by the primary key lookup, e.g. deleted or re-inserted under a new
+    id since the index was synced, are stale: they are looked up by path too, and their new ids added to the index.
+    Lookups are counted as hits, stale or misses of the index.
+
+    Args:
+        collection (Collection): The collection.
+        paths (list): The paths.
+        output_fields (list): The fields returned besides the id. The path is always returned.
+        index (PathIdIndex): The id index, path_id_index by default.
+        **kwargs: Other arguments of the queries, e.g. limit.
+
+    Returns:
+        list: The entities found, as dicts.
+    """
+    index = index or path_id_index
+    output_fields = list(output_fields)
+    if "*" not in output_fields and "path" not in output_fields:
+        output_fields.append("path")
+
+    ids, missing = index.get_ids(collection.name, list(paths))
+    MILVUS_PATH_ID_LOOKUPS.labels(collection=collection.name, result="miss").inc(len(missing))
+    entities = []
+    if ids:
+        entities = collection.query(expr=f"id in [{', '.join(str(milvus_id) for milvus_id in ids.values())}]",
+                                    output_fields=output_fields, **kwargs)
+        found = {entity["path"] for entity in entities}
+        stale = [path for path in ids if path not in found]
+        MILVUS_PATH_ID_LOOKUPS.labels(collection=collection.name, result="hit").inc(len(ids) - len(stale))
+        MILVUS_PATH_ID_LOOKUPS.labels(collection=collection.name, result="stale").inc(len(stale))
+        missing += stale
+    if missing:
+        by_path = collection.query(expr=f"path in {format_string_list(missing)}", output_fields=output_fields, **kwargs)
+        index.update(collection.name, {entity["path"]: entity["id"] for entity in by_path})
+        entities += by_path
+    return entities
+
+
+def save_path_ids(db: Session, collection_name, ids, index=None):
+    """
+    Stores the Milvus ids of paths in a collection, e.g. after an upsert that gave their entities new ids, and adds
+    them to the index of this process.
+
+    Args:
+        db (Session): The SQLAlchemy session object.
+        collection_name (str): The name of the collection.
+        ids (dict): The Milvus ids by path.
+        index (PathIdIndex): The id index, path_id_index by default.
+    """
+    if not ids:
+        return
+    now = datetime.now()
+    rows = {
+        row.path: row
+        for row in db.query(MilvusEntityId).filter(MilvusEntityId.collection == collection_name, MilvusEntityId.path.in_(list(ids)))
+    }
+    new_paths = [path for path in ids if path not in rows]
+    music_ids = {}
+    if new_paths:
+        music_ids = dict(db.query(MusicLibrary.filepath, MusicLibrary.id).filter(MusicLibrary.filepath.in_(new_paths)))
+    for path, milvus_id in ids.items():
+        if path in rows:
+            rows[path].milvus_id = milvus_id
+            rows[path].updated_at = now
+        else:
+            db.add(MilvusEntityId(collection=collection_name, path=path, milvus_id=milvus_id,
+                                  music_id=music_ids.get(path), updated_at=now))
+    db.commit()
+    (index or path_id_index).update(collection_name, ids)
+
+
+def sync_path_ids(db: Session, collection, batch_size=1000):
+    """
+    Stores the Milvus id of every entity of a collection by path, linked to the music_library row of the path.
+
+    Args:
+        db (Session): The SQLAlchemy session object.
+        collection (Collection): The collection.
+        batch_size (int): The number of entities read from Milvus at once.
+
+    Returns:
+        int: The number of entities indexed.
+    """
+    music_ids = {row.filepath: row.id for row in db.query(MusicLibrary.id, MusicLibrary.filepath).filter(MusicLibrary.filepath.isnot(None))}
+    rows = {}
+    iterator = collection.query_iterator(batch_size=batch_size, output_fields=["id", "path"])
+    try:
+        while batch := iterator.next():
+            for entity in batch:
+                rows[entity["path"]] = entity["id"]
+    finally:
+        iterator.close()
+
+    now = datetime.now()
+    db.query(MilvusEntityId).filter_by(collection=collection.name).delete(synchronize_session=False)
+    db.bulk_insert_mappings(MilvusEntityId, [
+        {"collection": collection.name, "path": path, "milvus_id": milvus_id, "music_id": music_ids.get(path), "updated_at": now}
+        for path, milvus_id in rows.items()
+    ])
+    db.commit()
+    return len(rows)
+
+
+if __name__ == "__main__":
+    from services.milvus import get_milvus_512_collection, get_milvus_87_collection
+
+    parser = argparse.ArgumentParser(description="Indexes the Milvus ids of the entities of the 512-d and 87-d collections by path.")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Number of entities read from Milvus at once.")
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        for collection in (get_milvus_512_collection(), get_milvus_87_collection()):
+            print(f"Indexed {sync_path_ids(db, collection, args.batch_size)} entities of {collection.name}")
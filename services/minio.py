@@ -1,29 +1,97 @@
+import io
 import os
 import tempfile
-import pickle
+import threading
 import base64
 import zipfile
+from collections import OrderedDict
+from contextlib import contextmanager
 
+import librosa
 import music_tag
+import soundfile as sf
 from minio.error import S3Error
 
 from core.extract_openl3_embeddings import EmbeddingsOpenL3
+from core.embedding_format import encode_embedding, decode_embedding, is_sampled_model_version, load_legacy_pickle
+from core.audio_decoding import DecoderProcessPool, decode_window
+from core.metrics import AUDIO_OBJECT_BYTES_READ
+from core.pcm_cache import PcmCache
 from core.config import minio_client, DEFAULT_SETTINGS
+from core.model_registry import ModelRegistry
+from core.inference_scheduler import MicroBatchScheduler
+
+
+# Pools the patches of concurrent OpenL3 extractions into shared model batches
+openl3_scheduler = MicroBatchScheduler(
+    "openl3",
+    max_batch_size=DEFAULT_SETTINGS.openl3_batch_max_size,
+    max_wait_ms=DEFAULT_SETTINGS.openl3_batch_max_wait_ms,
+) if DEFAULT_SETTINGS.openl3_micro_batching else None
+
+# Decodes the tracks of the streaming OpenL3 extractions while the model runs, started on the first extraction
+openl3_decoder = DecoderProcessPool(
+    max_workers=DEFAULT_SETTINGS.openl3_decode_processes,
+) if DEFAULT_SETTINGS.openl3_decode_processes else None
+
+
+def get_openl3_model_etag():
+    """
+    Retrieves the ETag of the OpenL3 model graph stored in MinIO, used as the version of the model.
+
+    Returns:
+        str: The ETag of the model graph object.
+    """
+    return minio_client.stat_object(DEFAULT_SETTINGS.minio_openl3_bucket_name, DEFAULT_SETTINGS.minio_openl3_file_name).etag
 
 
 def load_model_from_minio():
     """
-    Loads a model from MinIO into a temporary file and returns the model.
+    Loads a model from MinIO into a temporary file and returns the model along with its version.
+    The temporary file is deleted once the graph has been loaded by TensorFlow.
 
     Returns:
-        EmbeddingsOpenL3: The loaded model.
+        tuple: The loaded EmbeddingsOpenL3 model and the ETag of the graph it was built from.
     """
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        response = minio_client.get_object(DEFAULT_SETTINGS.minio_openl3_bucket_name, DEFAULT_SETTINGS.minio_openl3_file_name)
-        temp_file.write(response.read())
-        temp_file.flush()
-        embedding_512_model = EmbeddingsOpenL3(graph_path=temp_file.name)
-    return embedding_512_model
+    response = minio_client.get_object(DEFAULT_SETTINGS.minio_openl3_bucket_name, DEFAULT_SETTINGS.minio_openl3_file_name)
+    try:
+        etag = response.headers.get("etag", "").replace('"', "")
+        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+            for data in response.stream(32 * 1024):
+                temp_file.write(data)
+    finally:
+        response.close()
+        response.release_conn()
+
+    try:
+        embedding_512_model = EmbeddingsOpenL3(graph_path=temp_file.name, scheduler=openl3_scheduler,
+                                               pipeline_depth=DEFAULT_SETTINGS.openl3_pipeline_depth,
+                                               decoder=openl3_decoder)
+    finally:
+        os.unlink(temp_file.name)
+    return embedding_512_model, etag
+
+
+# Process-resident OpenL3 model, reloaded when the graph in MinIO changes
+openl3_model_registry = ModelRegistry(
+    "openl3",
+    fetch_version=get_openl3_model_etag,
+    load_model=load_model_from_minio,
+    check_interval_seconds=DEFAULT_SETTINGS.openl3_model_check_interval_seconds,
+)
+
+
+def get_audio_bucket_name(file_name: str) -> str:
+    """
+    Determines the bucket of an audio file: the music bucket for the MegaSet files, the temp bucket for the uploads.
+
+    Args:
+        file_name (str): The name of the audio file.
+
+    Returns:
+        str: The name of the bucket.
+    """
+    return DEFAULT_SETTINGS.minio_bucket_name if file_name.startswith("MegaSet/") else DEFAULT_SETTINGS.minio_temp_bucket_name
 
 
 def get_temp_file_from_minio(file_name: str) -> str:
@@ -37,8 +105,7 @@ def get_temp_file_from_minio(file_name: str) -> str:
         str: The path to the temporary file.
     """
     try:
-        # Determine the bucket name based on the file name
-        bucket_name = DEFAULT_SETTINGS.minio_bucket_name if file_name.startswith("MegaSet/") else DEFAULT_SETTINGS.minio_temp_bucket_name
+        bucket_name = get_audio_bucket_name(file_name)
         # Retrieve the file from MinIO
         response = minio_client.get_object(bucket_name, file_name)
 
@@ -53,6 +120,230 @@ def get_temp_file_from_minio(file_name: str) -> str:
         raise
 
 
+class ObjectRangeReader(io.RawIOBase):
+    """
+    Seekable read-only file object over a MinIO object, fetching only the parts that are read with HTTP range
+    requests. Reads are aligned to chunks of `chunk_size` bytes, and the last `max_chunks` chunks are kept in memory,
+    so that the many small reads of a decoder scanning the stream cost one request per chunk.
+
+    Attributes:
+        bucket_name (str): The bucket of the object.
+        object_name (str): The name of the object.
+        size (int): The size of the object in bytes.
+        bytes_fetched (int): The number of bytes fetched from MinIO so far.
+        requests (int): The number of range requests made so far.
+    """
+
+    def __init__(self, bucket_name, object_name, chunk_size=256 * 1024, max_chunks=4):
+        super().__init__()
+        self.bucket_name = bucket_name
+        self.object_name = object_name
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.size = minio_client.stat_object(bucket_name, object_name).size
+        self.bytes_fetched = 0
+        self.requests = 0
+        self._position = 0
+        self._chunks = OrderedDict()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        self._position = max(0, self._position)
+        return self._position
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast("B")
+        count = 0
+        while count < len(view) and self._position < self.size:
+            index, start = divmod(self._position, self.chunk_size)
+            chunk = self._get_chunk(index)[start:start + len(view) - count]
+            view[count:count + len(chunk)] = chunk
+            count += len(chunk)
+            self._position += len(chunk)
+        return count
+
+    def _get_chunk(self, index):
+        if index in self._chunks:
+            self._chunks.move_to_end(index)
+            return self._chunks[index]
+
+        offset = index * self.chunk_size
+        response = minio_client.get_object(self.bucket_name, self.object_name, offset=offset,
+                                           length=min(self.chunk_size, self.size - offset))
+        try:
+            chunk = response.read()
+        finally:
+            response.close()
+            response.release_conn()
+        self.bytes_fetched += len(chunk)
+        self.requests += 1
+        AUDIO_OBJECT_BYTES_READ.labels(mode="range").inc(len(chunk))
+
+        self._chunks[index] = chunk
+        if len(self._chunks) > self.max_chunks:
+            self._chunks.popitem(last=False)
+        return chunk
+
+
+def decode_object_window(file_name, sample_rate, offset=0.0, duration=None):
+    """
+    Decodes a time window of an audio file stored in MinIO, without downloading the whole file: the decoder seeks in
+    the compressed stream and only the byte ranges it reads are fetched. Formats libsndfile cannot read are
+    downloaded to a temporary file and decoded with librosa instead.
+
+    Args:
+        file_name (str): The name of the audio file.
+        sample_rate (int): The sample rate to decode at.
+        offset (float): The start of the window in seconds.
+        duration (float): The duration of the window in seconds, or None to decode until the end.
+
+    Returns:
+        np.ndarray: The decoded mono samples, as float32.
+    """
+    bucket_name = get_audio_bucket_name(file_name)
+    reader = ObjectRangeReader(bucket_name, file_name)
+    try:
+        return decode_window(reader, sample_rate, offset=offset, duration=duration)
+    except sf.LibsndfileError:
+        pass
+
+    temp_file_path = get_temp_file_from_minio(file_name)
+    try:
+        AUDIO_OBJECT_BYTES_READ.labels(mode="full").inc(os.path.getsize(temp_file_path))
+        y, _ = librosa.load(temp_file_path, sr=sample_rate, offset=offset, duration=duration)
+        return y
+    finally:
+        os.remove(temp_file_path)
+
+
+# Decoded audio shared by the OpenL3 and MusicNet extractions of this process, None if disabled
+pcm_cache = PcmCache(
+    DEFAULT_SETTINGS.pcm_cache_dir or os.path.join(tempfile.gettempdir(), "pcm_cache"),
+    DEFAULT_SETTINGS.pcm_cache_max_mb * 1024 * 1024,
+) if DEFAULT_SETTINGS.pcm_cache_max_mb else None
+
+
+@contextmanager
+def open_audio(file_name: str, sample_rate: int, decode_on_miss: bool = True):
+    """
+    Provides an audio file stored in MinIO for decoding at a sample rate. With the decoded audio cache, the
+    samples are served from the cache, keyed by the ETag of the object, and the file is only downloaded and decoded
+    on a miss. Without it, the file is downloaded to a temporary file.
+
+    Args:
+        file_name (str): The name of the audio file.
+        sample_rate (int): The sample rate the audio will be decoded at.
+        decode_on_miss (bool): Whether to download and decode the file on a miss of the cache, or to yield None. It
+            is always a miss without the cache.
+
+    Yields:
+        str or PcmFile: The path to the downloaded file, or its cached samples at the sample rate, or None on a miss
+            of the cache without decode_on_miss.
+    """
+    if pcm_cache is None:
+        if not decode_on_miss:
+            yield None
+            return
+        temp_file_path = get_temp_file_from_minio(file_name)
+        try:
+            yield temp_file_path
+        finally:
+            os.unlink(temp_file_path)
+        return
+
+    bucket_name = get_audio_bucket_name(file_name)
+    etag = minio_client.stat_object(bucket_name, file_name).etag
+    fetch = lambda path: minio_client.fget_object(bucket_name, file_name, path)
+    suffix = os.path.splitext(file_name)[1]
+    with pcm_cache.open(f"{bucket_name}/{file_name}:{etag}", sample_rate, fetch, suffix=suffix,
+                        decode_on_miss=decode_on_miss) as pcm:
+        yield pcm
+
+
+@contextmanager
+def open_native_audio(file_name: str, decode_on_miss: bool = True):
+    """
+    Provides the native decode of an audio file stored in MinIO from the decoded audio cache, keyed by the ETag of
+    the object: a mono float32 WAV file at the sample rate of the file.
+
+    Args:
+        file_name (str): The name of the audio file.
+        decode_on_miss (bool): Whether to download and decode the file on a miss of the cache, or to yield None.
+
+    Yields:
+        str: The path to the WAV file, or None on a miss of the cache without decode_on_miss, and always None
+            without the cache.
+    """
+    if pcm_cache is None:
+        yield None
+        return
+
+    bucket_name = get_audio_bucket_name(file_name)
+    etag = minio_client.stat_object(bucket_name, file_name).etag
+    fetch = lambda path: minio_client.fget_object(bucket_name, file_name, path)
+    suffix = os.path.splitext(file_name)[1]
+    with pcm_cache.open_native(f"{bucket_name}/{file_name}:{etag}", fetch, suffix=suffix,
+                               decode_on_miss=decode_on_miss) as wav_path:
+        yield wav_path
+
+
+# Fills the decoded audio cache in the background, for the callers that decode part of a file on a miss. One file at
+# a time: while a file is being decoded, further requests are dropped instead of queued, so that a burst of misses
+# never turns into a backlog of full downloads. The thread is a daemon, so that exiting never waits for it.
+_pcm_cache_warming = set()
+_pcm_cache_warming_lock = threading.Lock()
+
+
+def warm_pcm_cache(file_name: str):
+    """
+    Decodes an audio file stored in MinIO into the decoded audio cache in the background, at its native sample
+    rate, so that the next uses of the file are served from the cache. Does nothing without the cache, or while
+    another file is being decoded.
+
+    Args:
+        file_name (str): The name of the audio file.
+
+    Returns:
+        threading.Thread: The background decode, or None if it was skipped.
+    """
+    if pcm_cache is None:
+        return None
+
+    def warm():
+        try:
+            with open_native_audio(file_name):
+                pass
+        except Exception as e:
+            print(f"Error caching the decoded audio of {file_name}: {e}")
+        finally:
+            with _pcm_cache_warming_lock:
+                _pcm_cache_warming.discard(file_name)
+
+    with _pcm_cache_warming_lock:
+        if _pcm_cache_warming:
+            return None
+        _pcm_cache_warming.add(file_name)
+    thread = threading.Thread(target=warm, name="pcm-cache-warmer", daemon=True)
+    thread.start()
+    return thread
+
+
 def delete_temp_file(temp_file_path: str):
     """
     Deletes a temporary file.
@@ -172,65 +463,124 @@ def sanitize_filename(filename):
     return sanitized
 
 
-def get_embedding_pkl(filename):
+def get_embedding_object_names(filename):
     """
-    Retrieves the embeddings for a specified audio file from MinIO. If the pkl containing the embeddings exists,
-    it returns the content of the pkl file (a list of floats). If the pkl file does not exist, it returns False.
+    Gets the names of the objects holding the embeddings of an audio file in the temp bucket.
 
     Args:
         filename (str): The name of the audio file.
 
     Returns:
-        list or False: The content of the pkl file (a list of floats) if exists, otherwise False.
+        tuple: The name of the binary embedding object and the name of the legacy pickle object.
     """
-    pkl_filename = filename.replace(".mp3", ".pkl")
-    try:
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            data = minio_client.get_object(DEFAULT_SETTINGS.minio_temp_bucket_name, pkl_filename)
-            temp_file.write(data.read())
-            temp_file.seek(0)
-            embeddings = pickle.load(temp_file)
-        return embeddings
-    except S3Error as e:
-        if e.code == 'NoSuchKey':
+    base_name = filename.rsplit(".", 1)[0]
+    return base_name + ".emb", base_name + ".pkl"
+
+
+def get_embedding(filename, exact=False):
+    """
+    Retrieves the embeddings for a specified audio file from MinIO, read straight from memory.
+
+    The binary embedding (.emb) is read first. Embeddings stored in the former pickle format (.pkl) are still read,
+    with a reader that refuses anything but a list of floats, and are migrated to the binary format on the way.
+
+    Args:
+        filename (str): The name of the audio file.
+        exact (bool): Whether to ignore an embedding approximated from sampled excerpts, where the full-track
+            embedding is expected.
+
+    Returns:
+        list or False: The embeddings (a list of floats) if they exist, otherwise False.
+    """
+    emb_filename, pkl_filename = get_embedding_object_names(filename)
+    data = read_object(DEFAULT_SETTINGS.minio_temp_bucket_name, emb_filename)
+    if data is not None:
+        embedding, metadata = decode_embedding(data)
+        if exact and is_sampled_model_version(metadata["model_version"]):
             return False
-        else:
-            raise
+        return embedding.tolist()
+
+    data = read_object(DEFAULT_SETTINGS.minio_temp_bucket_name, pkl_filename)
+    if data is None:
+        return False
+    embedding = load_legacy_pickle(data)
+    save_embedding(filename, embedding, model_version="legacy-pkl")
+    return embedding.tolist()
 
 
-def save_embedding_pkl(object_name, file_path):
+def save_embedding(filename, embedding, model_version="", hop_time=1.0, segment_count=0):
     """
-    Saves an object to MinIO.
+    Saves the embeddings of an audio file to MinIO in the binary embedding format, from memory.
 
     Args:
-        object_name (str): The name of the object to be saved in the bucket.
-        file_path (str): The local path to the file to be uploaded.
+        filename (str): The name of the audio file.
+        embedding (array-like): The embedding vector.
+        model_version (str): The version of the model that computed the embedding.
+        hop_time (float): The hop time in seconds used for the extraction.
+        segment_count (int): The number of segments averaged into the embedding.
 
     Returns:
-        bool: True if the file was successfully uploaded, False otherwise.
+        bool: True if the embeddings were successfully uploaded, False otherwise.
     """
-    bucket_name = DEFAULT_SETTINGS.minio_temp_bucket_name
+    data = encode_embedding(embedding, model_version=model_version, hop_time=hop_time, segment_count=segment_count,
+                            dtype=DEFAULT_SETTINGS.embedding_storage_dtype)
     try:
-        # Open the file in binary read mode
-        with open(file_path, "rb") as file_data:
-            # Get the position of the cursor, i.e., the file size
-            file_data.seek(0, 2)
-            file_length = file_data.tell() 
-            file_data.seek(0)  
-
-            # Upload the file
-            minio_client.put_object(
-                bucket_name,
-                object_name,
-                file_data,
-                length=file_length,
-                content_type="application/octet-stream"
-            )
+        minio_client.put_object(
+            DEFAULT_SETTINGS.minio_temp_bucket_name,
+            get_embedding_object_names(filename)[0],
+            io.BytesIO(data),
+            length=len(data),
+            content_type="application/octet-stream"
+        )
         return True
     except S3Error as e:
         return False
 
 
+def embedding_exists(filename):
+    """
+    Checks whether the embeddings of an audio file exist in MinIO, in either format, without downloading them.
+
+    Args:
+        filename (str): The name of the audio file.
+
+    Returns:
+        bool: True if the embeddings exist, False otherwise.
+    """
+    for object_name in get_embedding_object_names(filename):
+        try:
+            minio_client.stat_object(DEFAULT_SETTINGS.minio_temp_bucket_name, object_name)
+            return True
+        except S3Error as e:
+            if e.code != 'NoSuchKey':
+                raise
+    return False
+
+
+def read_object(bucket_name, object_name):
+    """
+    Reads a whole object from MinIO into memory.
+
+    Args:
+        bucket_name (str): The name of the bucket.
+        object_name (str): The name of the object.
+
+    Returns:
+        bytes or None: The content of the object, or None if it does not exist.
+    """
+    try:
+        response = minio_client.get_object(bucket_name, object_name)
+    except S3Error as e:
+        if e.code == 'NoSuchKey':
+            return None
+        raise
+    try:
+        return response.read()
+    finally:
+        response.close()
+        response.release_conn()
+
+
 def delete_file_background_task(file_path: str):
     """
     Deletes the specified file from the filesystem. To be used as a cleanup function after the file has been sent.
@@ -1,5 +1,7 @@
 import os
+import hashlib
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import matplotlib.pyplot as plt
@@ -9,7 +11,10 @@ import torch
 import mlflow.pytorch
 from torchvision import transforms
 
-from core.config import DEFAULT_SETTINGS
+from core.config import DEFAULT_SETTINGS, minio_client
+from core.model_registry import ModelRegistry
+from core.audio_decoding import decode_window
+from services.minio import decode_object_window, open_native_audio, warm_pcm_cache
 
 
 MAPPING_DICT_MUSIC_NET = {
@@ -19,14 +24,56 @@ MAPPING_DICT_MUSIC_NET = {
 }
 
 
+# Size in pixels (width, height) of the spectrogram PNGs the model was trained on: the axes area of a 10x4 inch
+# figure at 100 dpi, cropped by savefig(bbox_inches='tight', pad_inches=0)
+SPECTROGRAM_RENDER_SIZE = (775, 308)
+
+SPECTROGRAM_TRANSFORM = transforms.Compose([
+    transforms.ToTensor(),
+    transforms.Normalize(mean=[0.5], std=[0.5])
+])
+
+
+def compute_mel_db(audio_path, sr=22050, n_mels=128, fmax=8000, start_time=20, segment_duration=20):
+    """
+    Computes the mel spectrogram in dB of a segment of an audio file, as the MusicNet model expects it.
+
+    Args:
+        audio_path (str): The path to the audio file.
+        sr (int): The sample rate to load the audio at.
+        n_mels (int): The number of mel bands.
+        fmax (int): The highest frequency of the mel bands.
+        start_time (float): The start of the segment in seconds.
+        segment_duration (float): The duration of the segment in seconds.
+
+    Returns:
+        np.ndarray: The mel spectrogram in dB, of shape [n_mels, frames].
+    """
+    y, sr = librosa.load(audio_path, sr=sr, offset=start_time, duration=segment_duration)
+    return compute_mel_db_from_signal(y, sr=sr, n_mels=n_mels, fmax=fmax)
+
+
+def compute_mel_db_from_signal(y, sr=22050, n_mels=128, fmax=8000):
+    """
+    Computes the mel spectrogram in dB of an already decoded segment, as the MusicNet model expects it.
+
+    Args:
+        y (np.ndarray): The mono samples of the segment.
+        sr (int): The sample rate of the samples.
+        n_mels (int): The number of mel bands.
+        fmax (int): The highest frequency of the mel bands.
+
+    Returns:
+        np.ndarray: The mel spectrogram in dB, of shape [n_mels, frames].
+    """
+    S = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=n_mels, fmax=fmax)
+    return librosa.power_to_db(S, ref=np.max)
+
+
 def create_preprocessed_spectrogram(audio_path, sr=22050, n_mels=128, fmax=8000, img_size=(224, 224), start_time=20, segment_duration=20):
     try:
-        # Load the audio file
-        y, sr = librosa.load(audio_path, sr=sr, offset=start_time, duration=segment_duration)
-        
         # Generate the spectrogram
-        S = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=n_mels, fmax=fmax)
-        S_DB = librosa.power_to_db(S, ref=np.max)
+        S_DB = compute_mel_db(audio_path, sr=sr, n_mels=n_mels, fmax=fmax, start_time=start_time, segment_duration=segment_duration)
         
         # Plot the spectrogram
         plt.figure(figsize=(10, 4))
@@ -44,21 +91,78 @@ def create_preprocessed_spectrogram(audio_path, sr=22050, n_mels=128, fmax=8000,
             os.remove(tmpfile.name)
         
         # Transform the image to tensor
-        transform = transforms.Compose([
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.5], std=[0.5])
-        ])
-        img_tensor = transform(img).unsqueeze(0)  # Add batch dimension
+        img_tensor = SPECTROGRAM_TRANSFORM(img).unsqueeze(0)  # Add batch dimension
         
         return img_tensor
     except Exception as e:
         print(f"Error processing {audio_path}: {e}")
         return None
-    
+
+
+def render_spectrogram(S_DB, size=SPECTROGRAM_RENDER_SIZE):
+    """
+    Renders a mel spectrogram in dB to an RGB image in memory, pixel for pixel as specshow() and savefig() draw it.
+
+    The values are scaled to the range of the spectrogram and mapped through the colormap librosa picks for it
+    (magma for dB spectrograms), quantized like the 8-bit PNG. Each pixel takes the spectrogram cell under its
+    center, low frequencies at the bottom, as the rasterized mesh does. Full 20-second segments (more frames than
+    pixel columns) render identically; on shorter segments, Agg may break an exact tie between a cell edge and a
+    pixel center the other way, shifting that column by one cell.
+
+    Args:
+        S_DB (np.ndarray): The mel spectrogram in dB, of shape [n_mels, frames].
+        size (tuple): The (width, height) of the image in pixels.
+
+    Returns:
+        Image: The rendered RGB image.
+    """
+    width, height = size
+    n_mels, n_frames = S_DB.shape
+    colormap = librosa.display.cmap(S_DB)
+    lut = np.round(colormap(np.arange(colormap.N))[:, :3] * 255).astype(np.uint8)
+
+    low, high = S_DB.min(), S_DB.max()
+    scaled = (S_DB - low) / (high - low) if high > low else np.zeros_like(S_DB)
+    indices = np.clip((scaled * colormap.N).astype(np.int64), 0, colormap.N - 1)
+
+    rows = ((np.arange(height) + 0.5) * n_mels / height).astype(np.int64)[::-1]
+    cols = ((np.arange(width) + 0.5) * n_frames / width).astype(np.int64)
+    return Image.fromarray(lut[indices[rows[:, None], cols[None, :]]], mode="RGB")
+
+
+def create_spectrogram_tensor(audio_path, sr=22050, n_mels=128, fmax=8000, img_size=(224, 224), start_time=20, segment_duration=20):
+    """
+    Creates the MusicNet input tensor of an audio file in memory, without plotting the spectrogram and writing it to a
+    PNG file. The rendered image is identical to the PNG of create_preprocessed_spectrogram(), and goes through the
+    same resize and transform.
+
+    Args:
+        audio_path (str): The path to the audio file.
+        sr (int): The sample rate to load the audio at.
+        n_mels (int): The number of mel bands.
+        fmax (int): The highest frequency of the mel bands.
+        img_size (tuple): The size of the model input image.
+        start_time (float): The start of the segment in seconds.
+        segment_duration (float): The duration of the segment in seconds.
+
+    Returns:
+        torch.Tensor or None: The input tensor of shape [1, 3, height, width], or None if the audio could not be processed.
+    """
+    try:
+        S_DB = compute_mel_db(audio_path, sr=sr, n_mels=n_mels, fmax=fmax, start_time=start_time, segment_duration=segment_duration)
+        img = render_spectrogram(S_DB).resize(img_size, Image.Resampling.LANCZOS)
+        return SPECTROGRAM_TRANSFORM(img).unsqueeze(0)
+    except Exception as e:
+        print(f"Error processing {audio_path}: {e}")
+        return None
+
+
+MUSIC_NET_MODEL_PREFIX = "data/model/"
+
 
 def get_production_model():
     # load the model using mlflow
-    minio_url = F"s3://{DEFAULT_SETTINGS.minio_music_net_bucket_name}/data/model/"
+    minio_url = F"s3://{DEFAULT_SETTINGS.minio_music_net_bucket_name}/{MUSIC_NET_MODEL_PREFIX}"
 
     os.environ["AWS_ACCESS_KEY_ID"] = DEFAULT_SETTINGS.minio_root_user
     os.environ["AWS_SECRET_ACCESS_KEY"] = DEFAULT_SETTINGS.minio_root_password
@@ -71,10 +175,135 @@ def get_production_model():
         return mlflow.pytorch.load_model(minio_url, map_location=torch.device('cpu'))
 
 
+def get_music_net_model_version(backend=None):
+    """
+    Computes the version of the MusicNet model served by an inference backend: a fingerprint of the names and ETags
+    of the files of the artifact logged by MLflow in MinIO, which changes whenever a new model is registered,
+    followed by the backend, whose predictions can differ from those of the eager model.
+
+    Args:
+        backend (str): One of MUSIC_NET_BACKENDS, or None for the music_net_backend setting.
+
+    Returns:
+        str: The version, as "<fingerprint>+<backend>".
+    """
+    objects = minio_client.list_objects(DEFAULT_SETTINGS.minio_music_net_bucket_name, prefix=MUSIC_NET_MODEL_PREFIX, recursive=True)
+    fingerprint = hashlib.sha1()
+    for obj in sorted(objects, key=lambda obj: obj.object_name):
+        fingerprint.update(f"{obj.object_name}:{obj.etag}\n".encode())
+    return f"{fingerprint.hexdigest()[:12]}+{backend or DEFAULT_SETTINGS.music_net_backend}"
+
+
+MUSIC_NET_BACKENDS = ("eager", "torchscript", "torchscript-int8")
+
+# Shape of the model input the exported backends are traced with
+MUSIC_NET_INPUT_SHAPE = (1, 3, 224, 224)
+
+
+def export_music_net_model(model, backend="eager"):
+    """
+    Converts the eager MusicNet model into an inference backend for CPU hosts.
+
+    - "eager": the PyTorch model as loaded by MLflow.
+    - "torchscript": the model traced and frozen with TorchScript, which folds the batch normalizations into the
+      convolutions and runs without the Python overhead of each module call.
+    - "torchscript-int8": the linear layers dynamically quantized to int8 before tracing. The convolutions stay in
+      float32, dynamic quantization only applies to linear layers.
+
+    Args:
+        model (torch.nn.Module): The eager model, in eval mode.
+        backend (str): One of MUSIC_NET_BACKENDS.
+
+    Returns:
+        torch.nn.Module: The model to run inference with.
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    if backend not in MUSIC_NET_BACKENDS:
+        raise ValueError(f"Unknown MusicNet backend {backend!r}, expected one of {', '.join(MUSIC_NET_BACKENDS)}")
+    if backend == "eager":
+        return model
+
+    model = model.to("cpu")
+    if backend == "torchscript-int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, torch.zeros(MUSIC_NET_INPUT_SHAPE))
+    return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+
+def load_music_net_model(backend=None):
+    """
+    Loads the MusicNet production model with MLflow, in eval mode, along with its version, and converts it to the
+    configured inference backend.
+
+    Args:
+        backend (str): One of MUSIC_NET_BACKENDS, or None for the music_net_backend setting.
+
+    Returns:
+        tuple: The model and its version (see get_music_net_model_version).
+    """
+    backend = backend or DEFAULT_SETTINGS.music_net_backend
+    version = get_music_net_model_version(backend)
+    model = get_production_model()
+    model.eval()
+    return export_music_net_model(model, backend), version
+
+
+def check_backend_parity(reference_model, model, img_tensors, labels=None):
+    """
+    Compares the predictions of an inference backend to those of the eager model on a sample of spectrograms.
+
+    Args:
+        reference_model (torch.nn.Module): The eager model.
+        model (torch.nn.Module): The backend to check.
+        img_tensors (list): The [1, 3, 224, 224] tensors of the sample.
+        labels (list): The genre of each spectrogram, or None for an unlabelled sample.
+
+    Returns:
+        dict: The share of top-1 predictions the backend agrees on with the eager model, the maximum absolute
+            difference of their probabilities, and the accuracy of both when the sample is labelled.
+    """
+    batch = torch.cat(img_tensors).to("cpu")
+    with torch.no_grad():
+        reference = torch.softmax(reference_model(batch), dim=1)
+        probabilities = torch.softmax(model(batch), dim=1)
+
+    report = {
+        "samples": len(img_tensors),
+        "top1_agreement": (reference.argmax(1) == probabilities.argmax(1)).float().mean().item(),
+        "max_probability_difference": (reference - probabilities).abs().max().item(),
+    }
+    if labels is not None:
+        targets = torch.tensor([MAPPING_DICT_MUSIC_NET[label] for label in labels])
+        report["reference_accuracy"] = (reference.argmax(1) == targets).float().mean().item()
+        report["accuracy"] = (probabilities.argmax(1) == targets).float().mean().item()
+    return report
+
+
+# Process-resident MusicNet model, reloaded when the artifact in MinIO changes
+music_net_model_registry = ModelRegistry(
+    "music_net",
+    fetch_version=get_music_net_model_version,
+    load_model=load_music_net_model,
+    check_interval_seconds=DEFAULT_SETTINGS.music_net_model_check_interval_seconds,
+)
+
+
+def get_model_device(model):
+    """
+    Returns the device the inputs of a model go to: the device of its parameters, or the CPU for the frozen
+    TorchScript backends, whose weights are constants.
+    """
+    parameter = next(iter(model.parameters()), None)
+    return parameter.device if parameter is not None else torch.device("cpu")
+
+
 def predict_with_production_music_net(model, img_tensor):
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    device = get_model_device(model)
     img_tensor = img_tensor.to(device)
-    model.eval()
+    # The model is put in eval mode once, when it is loaded
     with torch.no_grad():
         output = model(img_tensor)
         _, predicted = torch.max(output, 1)
@@ -85,3 +314,112 @@ def predict_with_production_music_net(model, img_tensor):
     return predicted_class_name
 
 
+def predict_top_k_with_production_music_net(model, img_tensors, k=3):
+    """
+    Predicts the genres of several spectrograms at once, in a single forward pass of the model.
+
+    Args:
+        model (torch.nn.Module): The MusicNet model, in eval mode.
+        img_tensors (list): The [1, 3, 224, 224] tensors of the spectrograms.
+        k (int): The number of genres returned for each spectrogram.
+
+    Returns:
+        list: For each spectrogram, the k most probable genres as (genre, probability) tuples, most probable first.
+    """
+    device = get_model_device(model)
+    batch = torch.cat(img_tensors).to(device)
+    with torch.no_grad():
+        probabilities = torch.softmax(model(batch), dim=1)
+        top_probabilities, top_indices = probabilities.topk(min(k, probabilities.shape[1]), dim=1)
+
+    idx_to_class = {index: genre for genre, index in MAPPING_DICT_MUSIC_NET.items()}
+    return [
+        [(idx_to_class[index], probability) for index, probability in zip(indices, values)]
+        for indices, values in zip(top_indices.tolist(), top_probabilities.tolist())
+    ]
+
+
+def create_spectrogram_tensor_from_minio(file_path, sr=22050, n_mels=128, fmax=8000, img_size=(224, 224), start_time=20, segment_duration=20, warm_cache=True):
+    """
+    Creates the spectrogram tensor of the MusicNet segment of an audio file stored in MinIO. If the file is in the
+    decoded audio cache, shared with OpenL3, the segment is read from its native decode. Otherwise only the segment is
+    decoded, from the byte ranges of the file the decoder reads, instead of downloading the whole file, and with
+    warm_cache the file is added to the cache in the background.
+
+    Both paths go through decode_window, which reads the segment at the native sample rate, mixes it down and
+    resamples it with soxr. The cached samples at the MusicNet rate are not used, as Essentia resamples them
+    differently. The native samples still come from different decoders: the cached WAV was decoded by Essentia
+    (FFmpeg), while a miss decodes the original file with libsndfile. For lossless files the tensors are identical.
+    For MP3 the decoders round differently, by about 3e-5 per sample, so a few pixels of the spectrogram can be a
+    color level or three apart between a hit and a miss.
+
+    Args:
+        file_path (str): The path to the audio file in MinIO.
+        sr (int): The sample rate to load the audio at.
+        n_mels (int): The number of mel bands.
+        fmax (int): The highest frequency of the mel bands.
+        img_size (tuple): The size of the model input image.
+        start_time (float): The start of the segment in seconds.
+        segment_duration (float): The duration of the segment in seconds.
+        warm_cache (bool): Whether to add the file to the cache on a miss, which downloads and decodes the whole
+            file. Bulk callers turn it off: most of the files they warm would be evicted before being used again.
+
+    Returns:
+        torch.Tensor: The preprocessed spectrogram tensor.
+
+    Raises:
+        ValueError: If the spectrogram could not be created.
+    """
+    y = None
+    with open_native_audio(file_path, decode_on_miss=False) as wav_path:
+        if wav_path is not None:
+            y = decode_window(wav_path, sr, offset=start_time, duration=segment_duration)
+    if y is None:
+        y = decode_object_window(file_path, sr, offset=start_time, duration=segment_duration)
+        if warm_cache:
+            warm_pcm_cache(file_path)
+    if not len(y):
+        raise ValueError("Failed to create the preprocessed spectrogram: the segment is empty.")
+    S_DB = compute_mel_db_from_signal(y, sr=sr, n_mels=n_mels, fmax=fmax)
+    img = render_spectrogram(S_DB).resize(img_size, Image.Resampling.LANCZOS)
+    return SPECTROGRAM_TRANSFORM(img).unsqueeze(0)
+
+
+def predict_genres(model, file_paths, k=3, max_workers=4, warm_cache=False):
+    """
+    Predicts the genres of several audio files stored in MinIO. The files are retrieved and preprocessed in
+    parallel, then all the spectrograms go through the model in one batch. A file that fails does not fail the
+    others: its error is returned instead of its genres.
+
+    Args:
+        model (torch.nn.Module): The MusicNet model, in eval mode.
+        file_paths (list): The paths to the audio files in MinIO.
+        k (int): The number of genres returned for each file.
+        max_workers (int): The number of files preprocessed concurrently.
+        warm_cache (bool): Whether to add the files missing from the decoded audio cache to it in the background.
+
+    Returns:
+        list: For each file, in order, a dict with its path and either its top-k "genres" as (genre, probability)
+            tuples or an "error" message.
+    """
+    def preprocess(file_path):
+        try:
+            return create_spectrogram_tensor_from_minio(file_path, warm_cache=warm_cache), None
+        except Exception as e:
+            return None, str(e)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(file_paths)))) as executor:
+        preprocessed = list(executor.map(preprocess, file_paths))
+
+    results = [{"file_path": file_path, "genres": None, "error": error} for file_path, (_, error) in zip(file_paths, preprocessed)]
+    ready = [(result, img_tensor) for result, (img_tensor, _) in zip(results, preprocessed) if img_tensor is not None]
+    if ready:
+        try:
+            predictions = predict_top_k_with_production_music_net(model, [img_tensor for _, img_tensor in ready], k)
+        except Exception as e:
+            for result, _ in ready:
+                result["error"] = f"Error predicting genre: {e}"
+        else:
+            for (result, _), genres in zip(ready, predictions):
+                result["genres"] = genres
+    return results
@@ -0,0 +1,174 @@
+import argparse
+import json
+import time
+from datetime import datetime
+
+from sqlalchemy.orm import Session
+
+from core.config import DEFAULT_SETTINGS, SessionLocal
+from core.metrics import MUSIC_NET_PRECOMPUTED_LOOKUPS
+from models.music import MusicLibrary
+from models.music_net import MusicNetGenres
+from services.music_net import music_net_model_registry, predict_genres
+
+
+# Prefix of the paths of the catalog tracks, whose genres are precomputed
+CATALOG_PREFIX = "MegaSet/"
+
+
+def get_precomputed_genres(db: Session, file_paths, model_version, k=1):
+    """
+    Looks up the precomputed MusicNet genres of catalog tracks. Only the predictions of `model_version` are
+    served, so that a new model is never answered with the genres of the previous one.
+
+    Args:
+        db (Session): The SQLAlchemy session object.
+        file_paths (list): The paths to the audio files. Paths outside the catalog are skipped without a lookup.
+        model_version (str): The version of the active MusicNet model.
+        k (int): The number of genres needed for each file. Tracks with fewer precomputed genres are misses.
+
+    Returns:
+        dict: The k most probable genres of each track found, as (genre, probability) tuples, by path.
+    """
+    catalog_paths = {file_path for file_path in file_paths if file_path.startswith(CATALOG_PREFIX)}
+    if not catalog_paths:
+        return {}
+
+    rows = db.query(MusicNetGenres.filepath, MusicNetGenres.genres).filter(
+        MusicNetGenres.filepath.in_(catalog_paths),
+        MusicNetGenres.model_version == model_version,
+    )
+    found = {}
+    for row in rows:
+        genres = json.loads(row.genres)
+        if len(genres) >= k:
+            found[row.filepath] = [(genre, probability) for genre, probability in genres[:k]]
+    MUSIC_NET_PRECOMPUTED_LOOKUPS.labels(result="hit").inc(len(found))
+    MUSIC_NET_PRECOMPUTED_LOOKUPS.labels(result="miss").inc(len(catalog_paths) - len(found))
+    return found
+
+
+def save_precomputed_genres(db: Session, predictions, model_version):
+    """
+    Stores the genres predicted for music_library tracks by a version of the model, replacing previous predictions
+    of that version.
+
+    Args:
+        db (Session): The SQLAlchemy session object.
+        predictions (list): The (music_id, path, genres) of each track, the genres as (genre, probability) tuples.
+        model_version (str): The version of the model that predicted the genres.
+    """
+    paths = [file_path for _, file_path, _ in predictions]
+    db.query(MusicNetGenres).filter(
+        MusicNetGenres.filepath.in_(paths),
+        MusicNetGenres.model_version == model_version,
+    ).delete(synchronize_session=False)
+    now = datetime.now()
+    db.bulk_insert_mappings(MusicNetGenres, [
+        {
+            "music_id": music_id,
+            "filepath": file_path,
+            "model_version": model_version,
+            "genres": json.dumps([[genre, round(probability, 6)] for genre, probability in genres]),
+            "created_at": now,
+        }
+        for music_id, file_path, genres in predictions
+    ])
+    db.commit()
+
+
+def list_pending_tracks(db: Session, model_version):
+    """
+    Lists the music_library tracks without genres precomputed by a version of the model.
+
+    Args:
+        db (Session): The SQLAlchemy session object.
+        model_version (str): The version of the model.
+
+    Returns:
+        list: The (id, path) of each track, ordered by id.
+    """
+    done = db.query(MusicNetGenres.filepath).filter(MusicNetGenres.model_version == model_version)
+    rows = db.query(MusicLibrary.id, MusicLibrary.filepath).filter(
+        MusicLibrary.filepath.isnot(None),
+        MusicLibrary.filepath.notin_(done),
+    ).order_by(MusicLibrary.id)
+    return [(row.id, row.filepath) for row in rows]
+
+
+def prune_precomputed_genres(db: Session, model_version):
+    """
+    Deletes the precomputed genres of the other versions of the model.
+
+    Args:
+        db (Session): The SQLAlchemy session object.
+        model_version (str): The version of the model whose predictions are kept.
+
+    Returns:
+        int: The number of rows deleted.
+    """
+    deleted = db.query(MusicNetGenres).filter(MusicNetGenres.model_version != model_version).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
+def run(db: Session, model, model_version, tracks, batch_size=64, k=5, max_workers=4, report_every=10):
+    """
+    Predicts the genres of music_library tracks in batches and stores them. Each batch is committed as it completes,
+    so an interrupted run resumes with the tracks left, and tracks that failed are retried by the next run.
+
+    Args:
+        db (Session): The SQLAlchemy session object.
+        model (torch.nn.Module): The MusicNet model, in eval mode.
+        model_version (str): The version of the model.
+        tracks (list): The (id, path) of the tracks.
+        batch_size (int): The number of tracks predicted at once.
+        k (int): The number of genres stored for each track.
+        max_workers (int): The number of files preprocessed concurrently.
+        report_every (int): The number of batches between two progress reports.
+
+    Returns:
+        dict: The number of tracks predicted and failed, and the elapsed time in seconds.
+    """
+    start = time.time()
+    predicted = failed = 0
+    batches = range(0, len(tracks), batch_size)
+    for count, offset in enumerate(batches, start=1):
+        batch = tracks[offset:offset + batch_size]
+        results = predict_genres(model, [file_path for _, file_path in batch], k=k, max_workers=max_workers, warm_cache=False)
+        predictions = []
+        for (music_id, file_path), result in zip(batch, results):
+            if result["error"] is None:
+                predictions.append((music_id, file_path, result["genres"]))
+            else:
+                print(f"Error predicting the genres of {file_path}: {result['error']}")
+        if predictions:
+            save_precomputed_genres(db, predictions, model_version)
+        predicted += len(predictions)
+        failed += len(batch) - len(predictions)
+        if count % report_every == 0 or count == len(batches):
+            elapsed = time.time() - start
+            done = offset + len(batch)
+            rate = done / elapsed
+            print(f"{done}/{len(tracks)} tracks ({failed} failed), {rate:.2f} tracks/s, ETA {(len(tracks) - done) / rate / 60:.1f} min")
+    return {"predicted": predicted, "failed": failed, "seconds": time.time() - start}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precomputes the MusicNet genres of the music_library tracks with the production model.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_SETTINGS.music_net_batch_max_files, help="Number of tracks predicted at once.")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_SETTINGS.music_net_precomputed_top_k, help="Number of genres stored per track.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_SETTINGS.music_net_preprocess_workers, help="Number of files preprocessed concurrently.")
+    parser.add_argument("--limit", type=int, help="Only predict the first tracks left.")
+    parser.add_argument("--prune", action="store_true", help="Delete the genres precomputed by other versions of the model.")
+    args = parser.parse_args()
+
+    model, model_version = music_net_model_registry.get()
+    with SessionLocal() as db:
+        tracks = list_pending_tracks(db, model_version)
+        print(f"{len(tracks)} tracks to predict with MusicNet version {model_version}")
+        tracks = tracks[:args.limit] if args.limit else tracks
+        summary = run(db, model, model_version, tracks, batch_size=args.batch_size, k=args.top_k, max_workers=args.workers)
+        print(f"Predicted {summary['predicted']} tracks in {summary['seconds']:.0f} s, {summary['failed']} failed")
+        if args.prune:
+            print(f"Deleted {prune_precomputed_genres(db, model_version)} genres of other versions")
@@ -1,7 +1,7 @@
 import os
 import tensorflow as tf
 from core.config import DEFAULT_SETTINGS
-from services.minio import load_model_from_minio, get_temp_file_from_minio
+from services.minio import openl3_model_registry, open_audio
 
 # Suppress TensorFlow logging
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
@@ -24,17 +24,11 @@ def extract_embeddings(file_path: str):
         Exception: If the file cannot be found or an error occurs during the embedding extraction process.
     """
     try:
-        # Load the OpenL3 model from MinIO
-        embedding_512_model = load_model_from_minio()
-        # Obtain a temporary file path for the audio file from MinIO
-        temp_file_path = get_temp_file_from_minio(DEFAULT_SETTINGS.minio_openl3_bucket_name, file_path)
-
-        # Compute embeddings using the temporary file path
-        vector = embedding_512_model.compute(temp_file_path)
-        embedding = vector.mean(axis=0)
-
-        # Clean up the temporary file
-        os.unlink(temp_file_path)
+        # Get the OpenL3 model held by the worker
+        embedding_512_model, _ = openl3_model_registry.get()
+        # Compute embeddings from the audio file retrieved from MinIO, or its cached decode
+        with open_audio(file_path, embedding_512_model.mel_extractor.sr) as audio_file:
+            embedding = embedding_512_model.compute_mean(audio_file, window_seconds=DEFAULT_SETTINGS.openl3_stream_window_seconds)
 
         return embedding.tolist()
     
@@ -0,0 +1,317 @@
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from core.config import DEFAULT_SETTINGS
+
+
+CHECKPOINT_FILE = "done.txt"
+ERRORS_FILE = "errors.jsonl"
+MISSING_ENTITY_ERROR = "No entity in the Milvus collection"
+
+# Model of the current worker process, loaded once by init_worker()
+_worker_model = None
+
+
+def list_library_tracks():
+    """
+    Lists the tracks of the music_library table.
+
+    Returns:
+        list: The (id, path) of each track, ordered by id.
+    """
+    from core.config import SessionLocal
+    from models.music import MusicLibrary
+
+    with SessionLocal() as db:
+        rows = db.query(MusicLibrary.id, MusicLibrary.filepath).filter(MusicLibrary.filepath.isnot(None)).order_by(MusicLibrary.id)
+        return [(row.id, row.filepath) for row in rows]
+
+
+def list_local_tracks(directory):
+    """
+    Lists the MP3 files of a local directory, for dry runs without MinIO.
+
+    Args:
+        directory (str): The directory to walk.
+
+    Returns:
+        list: The (id, path) of each file, numbered in path order.
+    """
+    paths = sorted(str(path) for path in Path(directory).expanduser().rglob("*.mp3"))
+    return list(enumerate(paths, start=1))
+
+
+def load_checkpoint(output_dir):
+    """
+    Reads the ids of the tracks already embedded and written by previous runs.
+
+    Args:
+        output_dir (str): The output directory of the job.
+
+    Returns:
+        set: The ids of the tracks done.
+    """
+    checkpoint = Path(output_dir) / CHECKPOINT_FILE
+    if not checkpoint.exists():
+        return set()
+    with open(checkpoint) as f:
+        return {int(line) for line in f if line.strip()}
+
+
+def init_worker(graph_path, hop_time, window_seconds, local):
+    """
+    Loads the OpenL3 model of a worker process, once for all the tracks the process embeds.
+
+    Args:
+        graph_path (str): The path to the OpenL3 graph.
+        hop_time (float): The hop time in seconds for the embeddings extraction.
+        window_seconds (float): The streaming window of the extraction.
+        local (bool): Whether the track paths are local files instead of MinIO objects.
+    """
+    global _worker_model
+    from core.extract_openl3_embeddings import EmbeddingsOpenL3
+
+    # Processes already run in parallel: no pipelining thread nor micro-batching within a process
+    model = EmbeddingsOpenL3(graph_path, hop_time=hop_time, pipeline_depth=0)
+    _worker_model = (model, window_seconds, local)
+
+
+def embed_track(track):
+    """
+    Computes the mean embedding of a track, in a worker process.
+
+    Args:
+        track (tuple): The (id, path) of the track.
+
+    Returns:
+        tuple: The id and path of the track, its embedding (None on failure), the extraction time in seconds and the
+            error message (None on success).
+    """
+    track_id, path = track
+    model, window_seconds, local = _worker_model
+    start = time.time()
+    try:
+        if local:
+            embedding = model.compute_mean(path, window_seconds=window_seconds)
+        else:
+            from services.minio import get_temp_file_from_minio
+
+            temp_file_path = get_temp_file_from_minio(path)
+            try:
+                embedding = model.compute_mean(temp_file_path, window_seconds=window_seconds)
+            finally:
+                os.unlink(temp_file_path)
+        return track_id, path, embedding.astype(np.float32), time.time() - start, None
+    except Exception as e:
+        return track_id, path, None, time.time() - start, str(e)
+
+
+class EmbeddingWriter:
+    """
+    Writes the embeddings of a bulk job in large batches: to numbered .npz parts in the output directory and/or as
+    upserts into a Milvus collection. The ids of a batch are appended to the checkpoint once the batch is written
+    everywhere, so that a killed run resumes after the last complete batch. Tracks without an entity in the
+    collection are not checkpointed, and are returned by add() and flush() so that they are reported.
+    """
+
+    def __init__(self, output_dir, batch_size=256, store=True, collection=None):
+        self.output_dir = Path(output_dir)
+        self.batch_size = batch_size
+        self.store = store
+        self.collection = collection
+        self.pending = []
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.part = len([part for part in self.output_dir.glob("part-*.npz") if not part.name.endswith(".tmp.npz")])
+
+    def add(self, track_id, path, embedding):
+        self.pending.append((track_id, path, embedding))
+        if len(self.pending) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """
+        Writes the pending embeddings.
+
+        Returns:
+            list: The (id, path) of the tracks without an entity in the collection, which were not checkpointed.
+        """
+        if not self.pending:
+            return []
+        ids = np.array([track_id for track_id, _, _ in self.pending], dtype=np.int64)
+        paths = np.array([path for _, path, _ in self.pending])
+        embeddings = np.vstack([embedding for _, _, embedding in self.pending])
+
+        if self.store:
+            self.part += 1
+            part_file = self.output_dir / f"part-{self.part:05d}.npz"
+            temp_file = part_file.with_suffix(".tmp.npz")
+            np.savez(temp_file, ids=ids, paths=paths, embeddings=embeddings)
+            os.replace(temp_file, part_file)
+        missing = []
+        if self.collection is not None:
+            missing_paths = set(self._upsert(paths.tolist(), embeddings))
+            missing = [(track_id, path) for track_id, path, _ in self.pending if path in missing_paths]
+
+        missing_ids = {track_id for track_id, _ in missing}
+        with open(self.output_dir / CHECKPOINT_FILE, "a") as f:
+            f.writelines(f"{track_id}\n" for track_id in ids if track_id not in missing_ids)
+        self.pending = []
+        return missing
+
+    def _upsert(self, paths, embeddings):
+        """
+        Replaces the embedding of the existing entities of the given paths, keeping their other fields, bumps the
+        version of the collection, which invalidates the cached similarity results, and stores the ids of the
+        entities, which an upsert into a collection with generated ids changes.
+
+        Returns:
+            list: The paths without an entity in the collection.
+        """
+        from core.config import SessionLocal
+        from services.milvus import bump_collection_version
+        from services.milvus_ids import query_by_paths, save_path_ids
+
+        entities = query_by_paths(self.collection, paths, output_fields=["*"])
+        by_path = {path: embedding for path, embedding in zip(paths, embeddings)}
+        rows = []
+        for entity in entities:
+            entity["embedding"] = by_path[entity["path"]].tolist()
+            rows.append(entity)
+        if rows:
+            result = self.collection.upsert(rows)
+            with SessionLocal() as db:
+                bump_collection_version(db, self.collection.name)
+                save_path_ids(db, self.collection.name, {row["path"]: milvus_id for row, milvus_id in zip(rows, result.primary_keys)})
+        return [path for path in paths if path not in {entity["path"] for entity in entities}]
+
+
+def run(tracks, output_dir, graph_path, processes=2, batch_size=256, hop_time=1, window_seconds=60,
+        local=False, store=True, collection=None, report_every=10):
+    """
+    Embeds tracks across a process pool, skipping the tracks done by previous runs. Tracks that fail are logged to
+    errors.jsonl and retried by the next run, as are the tracks without an entity in the Milvus collection. A track
+    may appear in several parts if a run was killed between the write of a batch and its checkpoint: the last part
+    holding it wins.
+
+    Args:
+        tracks (list): The (id, path) of the tracks to embed.
+        output_dir (str): The output directory, holding the local store, the checkpoint and the errors.
+        graph_path (str): The path to the OpenL3 graph.
+        processes (int): The number of worker processes, each with its own model, or 0 to run in this process.
+        batch_size (int): The number of embeddings written at once.
+        hop_time (float): The hop time in seconds for the embeddings extraction.
+        window_seconds (float): The streaming window of the extraction.
+        local (bool): Whether the track paths are local files instead of MinIO objects.
+        store (bool): Whether to write the embeddings to the local store.
+        collection (Collection): A Milvus collection to upsert the embeddings into, or None.
+        report_every (int): The number of tracks between two progress reports.
+
+    Returns:
+        dict: The number of tracks embedded, failed, missing from the collection and skipped, and the elapsed time in
+            seconds.
+    """
+    done = load_checkpoint(output_dir)
+    pending = [track for track in tracks if track[0] not in done]
+    writer = EmbeddingWriter(output_dir, batch_size=batch_size, store=store, collection=collection)
+    print(f"{len(pending)} tracks to embed, {len(tracks) - len(pending)} already done")
+
+    initargs = (graph_path, hop_time, window_seconds, local)
+    if processes:
+        pool = multiprocessing.get_context("spawn").Pool(processes, initializer=init_worker, initargs=initargs)
+        results = pool.imap_unordered(embed_track, pending)
+    else:
+        pool = None
+        init_worker(*initargs)
+        results = map(embed_track, pending)
+
+    start = time.time()
+    embedded = failed = missing = 0
+    try:
+        with open(Path(output_dir) / ERRORS_FILE, "a") as errors:
+            def report_missing(tracks_missing):
+                for track_id, path in tracks_missing:
+                    errors.write(json.dumps({"id": track_id, "path": path, "error": MISSING_ENTITY_ERROR}) + "\n")
+                return len(tracks_missing)
+
+            for count, (track_id, path, embedding, _, error) in enumerate(results, start=1):
+                if error is None:
+                    missing += report_missing(writer.add(track_id, path, embedding))
+                    embedded += 1
+                else:
+                    errors.write(json.dumps({"id": track_id, "path": path, "error": error}) + "\n")
+                    failed += 1
+                if count % report_every == 0 or count == len(pending):
+                    elapsed = time.time() - start
+                    rate = count / elapsed
+                    eta = (len(pending) - count) / rate
+                    print(f"{count}/{len(pending)} tracks ({failed} failed), {rate:.2f} tracks/s, ETA {eta / 60:.1f} min")
+            missing += report_missing(writer.flush())
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return {"embedded": embedded - missing, "failed": failed, "missing": missing, "skipped": len(tracks) - len(pending),
+            "seconds": time.time() - start}
+
+
+def download_graph():
+    """
+    Downloads the OpenL3 graph stored in MinIO to a temporary file, shared by the worker processes.
+
+    Returns:
+        str: The path to the temporary file.
+    """
+    from core.config import minio_client
+
+    with tempfile.NamedTemporaryFile(suffix=".pb", delete=False) as temp_file:
+        graph_path = temp_file.name
+    minio_client.fget_object(DEFAULT_SETTINGS.minio_openl3_bucket_name, DEFAULT_SETTINGS.minio_openl3_file_name, graph_path)
+    return graph_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-embeds the music_library tracks with OpenL3, resuming interrupted runs.")
+    parser.add_argument("--output-dir", required=True, help="Directory of the local store, checkpoint and errors.")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Number of worker processes, one model each.")
+    parser.add_argument("--batch-size", type=int, default=256, help="Number of embeddings written at once.")
+    parser.add_argument("--hop-time", type=float, default=1, help="Hop time in seconds of the extraction.")
+    parser.add_argument("--window-seconds", type=float, default=DEFAULT_SETTINGS.openl3_stream_window_seconds,
+                        help="Streaming window of the extraction.")
+    parser.add_argument("--graph", help="Local OpenL3 graph, instead of the one stored in MinIO.")
+    parser.add_argument("--milvus", action="store_true", help="Upsert the embeddings into the 512-d Milvus collection.")
+    parser.add_argument("--no-store", action="store_true", help="Do not write the embeddings to the local store.")
+    parser.add_argument("--dry-run", metavar="MP3_DIR", help="Embed the MP3 files of a local directory instead of MinIO.")
+    parser.add_argument("--limit", type=int, help="Only embed the first tracks.")
+    args = parser.parse_args()
+
+    if args.dry_run and args.milvus:
+        parser.error("--milvus cannot be used with --dry-run")
+    if args.no_store and not args.milvus:
+        parser.error("--no-store requires --milvus")
+
+    tracks = list_local_tracks(args.dry_run) if args.dry_run else list_library_tracks()
+    tracks = tracks[:args.limit] if args.limit else tracks
+
+    collection = None
+    if args.milvus:
+        from services.milvus import get_milvus_512_collection
+        collection = get_milvus_512_collection()
+
+    graph_path = args.graph or download_graph()
+    try:
+        summary = run(tracks, args.output_dir, graph_path, processes=args.processes, batch_size=args.batch_size,
+                      hop_time=args.hop_time, window_seconds=args.window_seconds, local=bool(args.dry_run),
+                      store=not args.no_store, collection=collection)
+    finally:
+        if not args.graph:
+            os.unlink(graph_path)
+    print(f"Embedded {summary['embedded']} tracks in {summary['seconds']:.0f} s, "
+          f"{summary['failed']} failed, {summary['missing']} missing from Milvus, {summary['skipped']} skipped")
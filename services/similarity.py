@@ -0,0 +1,259 @@
+from core.config import DEFAULT_SETTINGS, SessionLocal
+from core.embedding_mirror import EmbeddingMirror, read_metadata
+from core.metrics import SIMILARITY_BACKEND_REQUESTS
+from core.result_cache import ResultCache, skip_caching
+from services.milvus import get_collection_version, get_milvus_512_collection, short_hit_to_dict
+from services.milvus_ids import query_by_paths
+
+
+SIMILARITY_BACKENDS = ("milvus", "local", "fallback")
+
+# Local mirror of the 512-d collection, written by `python -m services.embedding_mirror` and loaded on first use
+embedding_mirror = EmbeddingMirror(DEFAULT_SETTINGS.embedding_mirror_dir)
+
+
+def run_on_backend(operation, on_milvus, on_mirror, backend=None):
+    """
+    Runs a lookup or search of the 512-d embeddings on the configured backend:
+
+    - "milvus": the remote Milvus collection only.
+    - "local": the local embedding mirror only, e.g. offline or as a test stand-in for Milvus.
+    - "fallback": Milvus, and the local mirror if Milvus fails. The results of the mirror are then not cached.
+
+    Args:
+        operation (str): The name of the operation, for the metrics.
+        on_milvus (callable): Runs the operation on Milvus.
+        on_mirror (callable): Runs the operation on the local mirror.
+        backend (str): One of SIMILARITY_BACKENDS, or None for the similarity_backend setting.
+
+    Returns:
+        The result of the operation.
+    """
+    backend = backend or DEFAULT_SETTINGS.similarity_backend
+    if backend not in SIMILARITY_BACKENDS:
+        raise ValueError(f"Unknown similarity backend {backend!r}, expected one of {', '.join(SIMILARITY_BACKENDS)}")
+    if backend == "local":
+        SIMILARITY_BACKEND_REQUESTS.labels(backend="local", operation=operation).inc()
+        return on_mirror()
+    try:
+        result = on_milvus()
+    except Exception as e:
+        if backend == "milvus":
+            raise
+        print(f"Error running {operation} on Milvus, falling back to the local mirror: {e}")
+        SIMILARITY_BACKEND_REQUESTS.labels(backend="fallback", operation=operation).inc()
+        # The distances of the mirror are not those of Milvus, so its results must not be served after the outage
+        skip_caching()
+        return on_mirror()
+    SIMILARITY_BACKEND_REQUESTS.labels(backend="milvus", operation=operation).inc()
+    return result
+
+
+def get_entities_by_paths(paths, output_fields=("embedding",)):
+    """
+    Retrieves the entities of the 512-d collection with the given paths.
+
+    Args:
+        paths (list): The paths of the entities.
+        output_fields (tuple): The fields returned besides the id.
+
+    Returns:
+        list: The entities found, as dicts.
+    """
+    return run_on_backend(
+        "query",
+        lambda: query_by_paths(get_milvus_512_collection(), paths, output_fields=output_fields),
+        lambda: embedding_mirror.query(paths=list(paths), output_fields=list(output_fields)),
+    )
+
+
+def get_entities_by_id(entity_id, output_fields=("embedding",)):
+    """
+    Retrieves the entity of the 512-d collection with the given id.
+
+    Args:
+        entity_id (str): The id of the entity.
+        output_fields (tuple): The fields returned besides the id.
+
+    Returns:
+        list: The entity, as a dict, or an empty list if it was not found.
+    """
+    return run_on_backend(
+        "query",
+        lambda: get_milvus_512_collection().query(expr=f"id in [{entity_id}]", output_fields=list(output_fields)),
+        lambda: embedding_mirror.query(ids=[int(entity_id)], output_fields=list(output_fields)),
+    )
+
+
+def search_similar(embeddings, limit, offset=0, output_fields=("*",)):
+    """
+    Searches the 512-d collection for the entities most similar to each embedding.
+
+    Args:
+        embeddings (list): The query embeddings.
+        limit (int): The number of hits per query.
+        offset (int): The number of best hits skipped, 1 to skip the query entity itself.
+        output_fields (tuple): The fields of the hit entities.
+
+    Returns:
+        list: For each query, its hits, most similar first, with the attributes of Milvus hits (id, distance, entity).
+    """
+    return run_on_backend(
+        "search",
+        lambda: get_milvus_512_collection().search(
+            data=embeddings,
+            anns_field="embedding",
+            param={"nprobe": 16},
+            limit=limit,
+            offset=offset,
+            output_fields=list(output_fields),
+        ),
+        lambda: embedding_mirror.search(embeddings, limit, offset=offset, output_fields=list(output_fields)),
+    )
+
+
+def get_similarity_version():
+    """
+    Computes the version of the similarity results: the version stamp of the 512-d collection and, when the local
+    mirror may serve them, the sync of the mirror.
+
+    Returns:
+        str: The version of the similarity results.
+    """
+    with SessionLocal() as db:
+        version = f"{DEFAULT_SETTINGS.similarity_backend}:{get_collection_version(db, DEFAULT_SETTINGS.milvus_512_collection_name)}"
+    if DEFAULT_SETTINGS.similarity_backend != "milvus":
+        metadata = read_metadata(DEFAULT_SETTINGS.embedding_mirror_dir)
+        version += f":{metadata['matrix_file'] if metadata else None}"
+    return version
+
+
+# Results of the similarity routes for the catalog tracks, which only change when the collection is written
+similarity_cache = ResultCache(
+    "similarity",
+    DEFAULT_SETTINGS.similarity_cache_max_entries,
+    get_similarity_version,
+    check_interval_seconds=DEFAULT_SETTINGS.similarity_cache_check_interval_seconds,
+)
+
+
+def get_similarity_cache_key(kind, query, limit, offset=0, output_fields=(), **options):
+    """
+    Builds the key of a similarity result in the cache.
+
+    Args:
+        kind (str): The kind of query, e.g. "id" or "path".
+        query (str | list): The id or paths of the query entities.
+        limit (int): The number of hits per query.
+        offset (int): The number of best hits skipped.
+        output_fields (list): The fields of the hit entities.
+        **options: Other parameters the result depends on.
+
+    Returns:
+        tuple: The key of the result.
+    """
+    query = tuple(query) if isinstance(query, list) else query
+    return (DEFAULT_SETTINGS.milvus_512_collection_name, kind, query, limit, offset, tuple(output_fields),
+            tuple(sorted(options.items())))
+
+
+# Rank constant of the reciprocal rank fusion, which dampens the weight of the first ranks
+RRF_K = 60
+
+# Maximum number of hits of a Milvus search
+MAX_SEARCH_LIMIT = 16384
+
+
+def diversify(hits, k, max_per_artist=None, excluded_paths=()):
+    """
+    Selects the k best hits, with at most `max_per_artist` hits per artist. If too few hits satisfy the rule, the
+    list is completed with the best hits it skipped, as sort_entities() does.
+
+    Args:
+        hits (list): The hits, as dicts with the path and artist, best first.
+        k (int): The number of hits selected.
+        max_per_artist (int): The maximum number of hits of an artist, or None for no limit.
+        excluded_paths (iterable): Paths never selected, e.g. the query entities.
+
+    Returns:
+        list: The selected hits, best first.
+    """
+    excluded_paths = set(excluded_paths)
+    selected, skipped, per_artist = [], [], {}
+    for hit in hits:
+        if hit["path"] in excluded_paths:
+            continue
+        if max_per_artist is not None and per_artist.get(hit["artist"], 0) >= max_per_artist:
+            skipped.append(hit)
+            continue
+        selected.append(hit)
+        per_artist[hit["artist"]] = per_artist.get(hit["artist"], 0) + 1
+        if len(selected) == k:
+            return selected
+    return selected + skipped[:k - len(selected)]
+
+
+def fuse_rankings(rankings):
+    """
+    Merges the hit lists of several queries into a single ranking by reciprocal rank fusion: each hit scores
+    1 / (RRF_K + rank) in each list it appears in. Ranks are used instead of distances, which depend on the metric
+    of the backend.
+
+    Args:
+        rankings (list): The hit lists, as dicts with a path, best first.
+
+    Returns:
+        list: The distinct hits, best first, with their fused "score" and the number of lists they appear in as
+            "matches".
+    """
+    fused = {}
+    for hits in rankings:
+        for rank, hit in enumerate(hits, start=1):
+            entry = fused.setdefault(hit["path"], {**hit, "score": 0.0, "matches": 0})
+            entry["score"] += 1 / (RRF_K + rank)
+            entry["matches"] += 1
+    return sorted(fused.values(), key=lambda entry: entry["score"], reverse=True)
+
+
+def search_similar_batch(paths, k=9, max_per_artist=None, fuse=False):
+    """
+    Finds the entities most similar to each of several entities with one lookup and one search of the 512-d
+    collection, and optionally ranks the entities most similar to the set as a whole.
+
+    The search fetches more candidates than needed, so that the query entities, which are never returned, and the
+    hits removed by the artist rule can be replaced.
+
+    Args:
+        paths (list): The paths of the query entities.
+        k (int): The number of hits per query entity, and of the fused ranking.
+        max_per_artist (int): The maximum number of hits of an artist in each list, or None for no limit.
+        fuse (bool): Whether to also rank the hits across the query entities.
+
+    Returns:
+        dict: The "results" of each path, in order, with its "hits" or an "error" if it was not found, and the
+            "fused" ranking, or None.
+    """
+    entities = get_entities_by_paths(paths, output_fields=("path", "embedding"))
+    embeddings = {entity["path"]: [float(x) for x in entity["embedding"]] for entity in entities}
+    found = [path for path in dict.fromkeys(paths) if path in embeddings]
+
+    hits = {}
+    if found:
+        candidates = (k + len(found)) * (3 if max_per_artist is not None else 1)
+        searched = search_similar([embeddings[path] for path in found], limit=min(candidates, MAX_SEARCH_LIMIT),
+                                  output_fields=["title", "album", "artist", "path"])
+        hits = {
+            path: [{"id": str(hit.id), "distance": hit.distance, **short_hit_to_dict(hit)} for hit in path_hits]
+            for path, path_hits in zip(found, searched)
+        }
+
+    results = [
+        {"path": path, "hits": diversify(hits[path], k, max_per_artist, excluded_paths=found), "error": None}
+        if path in hits else {"path": path, "hits": None, "error": "Entity not found"}
+        for path in paths
+    ]
+    fused = None
+    if fuse:
+        rankings = [[hit for hit in hits[path] if hit["path"] not in found] for path in found]
+        fused = diversify(fuse_rankings(rankings), k, max_per_artist)
+    return {"results": results, "fused": fused}
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+import soundfile as sf
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from core.config import Base
+from models.music import MusicLibrary  # noqa: F401, the tables referenced by the others
+from models.users import User  # noqa: F401
+
+
+def lookups(metric, result, **labels):
+    """The number of lookups of a cache counted with a result so far, by the `<metric>_lookups_total` counter."""
+    return REGISTRY.get_sample_value(f"{metric}_lookups_total", {**labels, "result": result}) or 0
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """Sessions of a new SQLite database with all the tables, shared by the threads and processes of a test."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+@pytest.fixture
+def db_session(session_factory):
+    """A session of a new SQLite database with all the tables."""
+    session = session_factory()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def track(tmp_path):
+    """A 20 s stereo MP3 at 44.1 kHz, a lossy file like the MegaSet tracks."""
+    audio_file = str(tmp_path / "track.mp3")
+    n_samples = 44100 * 20
+    chirp = 0.3 * np.sin(np.cumsum(np.linspace(0.01, 0.5, n_samples)))
+    sf.write(audio_file, np.stack([chirp, 0.5 * chirp], axis=1).astype(np.float32), 44100, format="MP3")
+    return audio_file
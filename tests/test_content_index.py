@@ -0,0 +1,63 @@
+import io
+import hashlib
+from unittest.mock import MagicMock, patch
+
+
+from core.config import DEFAULT_SETTINGS
+from services.content_index import HashingReader, register_object, unregister_object, get_object_hash, find_duplicate_embedding, reuse_duplicate_embedding
+
+
+TEMP = DEFAULT_SETTINGS.minio_temp_bucket_name
+MUSIC = DEFAULT_SETTINGS.minio_bucket_name
+
+
+def test_hashing_reader_passes_data_through():
+    content = bytes(range(256)) * 1000
+    reader = HashingReader(io.BytesIO(content))
+
+    chunks = []
+    while chunk := reader.read(4096):
+        chunks.append(chunk)
+
+    assert b"".join(chunks) == content
+    assert reader.size == len(content)
+    assert reader.hexdigest() == hashlib.sha256(content).hexdigest()
+
+
+def test_register_replaces_overwritten_object(db_session):
+    register_object(db_session, "a" * 64, TEMP, "song.mp3", 10)
+    register_object(db_session, "b" * 64, TEMP, "song.mp3", 12)
+    assert get_object_hash(db_session, TEMP, "song.mp3") == "b" * 64
+
+    unregister_object(db_session, TEMP, "song.mp3")
+    assert get_object_hash(db_session, TEMP, "song.mp3") is None
+
+
+@patch("services.content_index.get_embedding")
+def test_duplicate_upload_reuses_embedding(mock_get_embedding, db_session):
+    register_object(db_session, "a" * 64, TEMP, "first.mp3", 10)
+    register_object(db_session, "a" * 64, TEMP, "copy.mp3", 10)
+    register_object(db_session, "c" * 64, TEMP, "other.mp3", 10)
+    mock_get_embedding.return_value = [0.5] * 512
+
+    assert find_duplicate_embedding(db_session, "copy.mp3") == ([0.5] * 512, "upload")
+    mock_get_embedding.assert_called_once_with("first.mp3", exact=True)
+    assert find_duplicate_embedding(db_session, "other.mp3") is None
+    assert find_duplicate_embedding(db_session, "unknown.mp3") is None
+
+
+@patch("services.content_index.save_embedding")
+@patch("services.content_index.get_milvus_512_collection")
+@patch("services.content_index.get_embedding", return_value=False)
+def test_library_duplicate_reuses_milvus_embedding(mock_get_embedding, mock_collection, mock_save_embedding, db_session):
+    register_object(db_session, "a" * 64, MUSIC, "MegaSet/Artist/Album/01 Song.mp3", 10)
+    register_object(db_session, "a" * 64, TEMP, "upload.mp3", 10)
+    collection = MagicMock()
+    collection.query.return_value = [{"id": 1, "path": "MegaSet/Artist/Album/01 Song.mp3", "embedding": [0.25] * 512}]
+    mock_collection.return_value = collection
+
+    embedding = reuse_duplicate_embedding(db_session, "upload.mp3")
+
+    assert embedding == [0.25] * 512
+    assert "MegaSet/Artist/Album/01 Song.mp3" in collection.query.call_args.kwargs["expr"]
+    mock_save_embedding.assert_called_once_with("upload.mp3", embedding, model_version="dedup-library")
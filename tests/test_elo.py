@@ -0,0 +1,68 @@
+import asyncio
+import json
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import routes.elo as elo
+from models.music import SongPath
+
+
+def compare(file_path="MegaSet/Artist/Album/track.mp3"):
+    response = asyncio.run(elo.get_comparison(SongPath(file_path=file_path), user=None))
+    return json.loads(response.body)
+
+
+def slow(result, seconds=0.3):
+    def branch(file_path):
+        time.sleep(seconds)
+        return result
+    return branch
+
+
+@pytest.fixture
+def branches():
+    with patch.object(elo, "get_metadata", slow({"file_path": "track.mp3", "artist": "Artist", "artwork": None})) as metadata, \
+            patch.object(elo, "get_mlflow_model_predictions", slow(("rock", "abc123"))) as music_net, \
+            patch.object(elo, "get_essentia_predictions", slow("cGxvdA==")) as essentia:
+        yield metadata, music_net, essentia
+
+
+def test_branches_run_concurrently(branches):
+    start = time.perf_counter()
+    result = compare()
+
+    assert time.perf_counter() - start < 0.6
+    assert result["artist"] == "Artist"
+    assert (result["prediction_model_1"], result["prediction_model_1_version"]) == ("rock", "abc123")
+    assert result["predictions_openl3"] == "cGxvdA=="
+    assert result["errors"] == {}
+    assert set(result["timings"]) == {"metadata", "music_net", "essentia"}
+    assert all(0.25 < seconds < 0.6 for seconds in result["timings"].values())
+
+
+def test_failed_and_timed_out_branches_return_partial_results(branches):
+    def fail(file_path):
+        raise RuntimeError("Milvus is unreachable")
+
+    with patch.object(elo, "get_essentia_predictions", fail), \
+            patch.object(elo, "get_metadata", slow({}, seconds=1)), \
+            patch.object(elo.DEFAULT_SETTINGS, "elo_metadata_timeout_seconds", 0.1):
+        result = compare()
+
+    assert result["prediction_model_1"] == "rock"
+    assert result["predictions_openl3"] is None
+    assert result["errors"] == {"metadata": "Timed out after 0.1 s", "essentia": "Milvus is unreachable"}
+    # The metadata falls back to the defaults
+    assert result["artist"] == "Unknown"
+    assert result["timings"]["metadata"] < 0.5
+
+
+def test_precomputed_music_net_genre_does_not_load_the_model():
+    with patch.object(elo.music_net_model_registry, "peek_version", return_value="v1"), \
+            patch.object(elo.music_net_model_registry, "get") as get, \
+            patch.object(elo, "SessionLocal", MagicMock()), \
+            patch.object(elo, "get_precomputed_genres", return_value={"MegaSet/a.mp3": [("jazz", 0.9)]}):
+        assert elo.get_mlflow_model_predictions("MegaSet/a.mp3") == ("jazz", "v1")
+    get.assert_not_called()
@@ -0,0 +1,129 @@
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+from fastapi import HTTPException
+
+import routes.elo as routes
+from core.elo import EloStore, expected_score, rating_change
+from models.elo import EloVote, VoteRequest
+from services.elo import load_ratings, persist_votes
+
+
+def database_store(session_factory, **kwargs):
+    return EloStore(
+        lambda: load_ratings(session_factory),
+        lambda votes, changes: persist_votes(votes, changes, session_factory, initial_rating=1500),
+        flush_interval_seconds=3600,
+        **kwargs,
+    )
+
+
+def test_rating_change():
+    assert expected_score(1500, 1500) == 0.5
+    assert rating_change(1500, 1500, 1) == 16
+    assert rating_change(1500, 1500, 0.5) == 0
+    # An upset moves the ratings more than an expected win
+    assert rating_change(1400, 1600, 1) > rating_change(1600, 1400, 1)
+
+
+def test_votes_update_the_leaderboard_in_memory():
+    persist = MagicMock()
+    store = EloStore(lambda: {}, persist, flush_interval_seconds=3600)
+
+    updated = store.vote("music_net:a", "essentia", 1)
+    store.vote("music_net:b", "essentia", 0.5)
+
+    assert updated["music_net:a"]["rating"] == 1516 and updated["essentia"]["rating"] == 1484
+    leaderboard = store.leaderboard()
+    assert [entry["model"] for entry in leaderboard] == ["music_net:a", "music_net:b", "essentia"]
+    assert leaderboard[2] == {"model": "essentia", "rating": leaderboard[2]["rating"], "wins": 0, "losses": 1,
+                              "draws": 1, "votes": 2}
+    assert store.pending() == 2
+    persist.assert_not_called()
+    store.close()
+
+
+def test_invalid_votes_are_rejected():
+    store = EloStore(lambda: {}, MagicMock(), flush_interval_seconds=3600)
+    with pytest.raises(ValueError):
+        store.vote("essentia", "essentia", 1)
+    with pytest.raises(ValueError):
+        store.vote("music_net:a", "essentia", 2)
+
+
+def test_votes_for_unknown_music_net_versions_are_rejected():
+    store = EloStore(lambda: {"music_net:old": {"rating": 1500, "wins": 0, "losses": 0, "draws": 0, "votes": 0}},
+                     MagicMock(), flush_interval_seconds=3600)
+    registry = MagicMock()
+    registry.status.return_value = {"version": "active"}
+    user = MagicMock(id=None)
+
+    with patch.object(routes, "elo_store", store), patch.object(routes, "music_net_model_registry", registry):
+        for version in ("active", "old"):
+            routes.vote(VoteRequest(file_path="MegaSet/a.mp3", music_net_version=version, winner="draw"), user=user)
+        with pytest.raises(HTTPException) as error:
+            routes.vote(VoteRequest(file_path="MegaSet/a.mp3", music_net_version="forged", winner="draw"), user=user)
+
+    assert error.value.status_code == 400
+    assert not store.has_model("music_net:forged")
+    assert store.pending() == 2
+    store.close()
+
+
+def test_votes_are_persisted_in_one_batch(session_factory):
+    store = database_store(session_factory)
+    for winner in (1, 1, 0, 0.5):
+        store.vote("music_net:a", "essentia", winner, file_path="MegaSet/track.mp3")
+
+    assert store.flush() == 4
+    assert store.pending() == 0
+    assert load_ratings(session_factory) == {entry.pop("model"): entry for entry in store.leaderboard()}
+    with session_factory() as db:
+        assert db.query(EloVote).count() == 4
+    store.close()
+
+
+def test_flush_is_triggered_by_the_number_of_votes(session_factory):
+    store = database_store(session_factory, flush_max_votes=3)
+    for _ in range(3):
+        store.vote("music_net:a", "essentia", 1)
+
+    # close() flushes too: the votes must be persisted before it, well within the hour of the flush interval
+    deadline = time.monotonic() + 5
+    while load_ratings(session_factory).get("music_net:a", {}).get("votes") != 3:
+        assert time.monotonic() < deadline, "the votes were not flushed"
+        time.sleep(0.01)
+    assert store.pending() == 0
+    store.close()
+
+
+def test_failed_flush_requeues_the_votes(session_factory):
+    store = database_store(session_factory)
+    store.vote("music_net:a", "essentia", 1)
+    store.persist = MagicMock(side_effect=RuntimeError("database unavailable"))
+    with pytest.raises(RuntimeError):
+        store.flush()
+
+    assert store.pending() == 1
+    store.persist = lambda votes, changes: persist_votes(votes, changes, session_factory, initial_rating=1500)
+    assert store.flush() == 1
+    assert load_ratings(session_factory)["music_net:a"]["rating"] == 1516
+
+
+def test_stores_of_several_processes_add_up(session_factory):
+    first, second = database_store(session_factory), database_store(session_factory)
+    first.vote("music_net:a", "essentia", 1)
+    second.vote("music_net:a", "essentia", 1)
+    first.flush()
+    second.flush()
+    first.vote("music_net:a", "essentia", 0.5)
+
+    persisted = load_ratings(session_factory)
+    assert persisted["music_net:a"]["votes"] == 2
+    assert persisted["music_net:a"]["rating"] == 1532
+    # Each store sees the votes of the other processes persisted before its last flush, plus its own pending votes
+    assert second.leaderboard()[0]["votes"] == 2
+    assert first.leaderboard()[0]["votes"] == 2
+    first.flush()
+    assert first.leaderboard()[0]["votes"] == 3
@@ -0,0 +1,73 @@
+import os
+import pickle
+
+import pytest
+import numpy as np
+
+from core.embedding_format import encode_embedding, decode_embedding, load_legacy_pickle
+
+
+def make_embedding(seed=0):
+    return np.random.default_rng(seed).standard_normal(512).astype(np.float32)
+
+
+def test_float32_roundtrip_is_exact():
+    embedding = make_embedding()
+
+    data = encode_embedding(embedding, model_version="etag-1", hop_time=0.5, segment_count=42)
+    decoded, metadata = decode_embedding(data)
+
+    np.testing.assert_array_equal(decoded, embedding)
+    assert metadata == {
+        "format_version": 1,
+        "dtype": "float32",
+        "model_version": "etag-1",
+        "hop_time": 0.5,
+        "segment_count": 42,
+    }
+    # Header and version string aside, 4 bytes per value
+    assert len(data) < 512 * 4 + 40
+
+
+def test_float16_roundtrip_is_close():
+    embedding = make_embedding()
+
+    data = encode_embedding(embedding, dtype="float16")
+    decoded, metadata = decode_embedding(data)
+
+    assert decoded.dtype == np.float32
+    assert metadata["dtype"] == "float16"
+    assert metadata["model_version"] is None
+    assert len(data) < 512 * 2 + 40
+    np.testing.assert_allclose(decoded, embedding, rtol=1e-3, atol=1e-3)
+
+
+@pytest.mark.parametrize("data", [b"", b"MEMB", b"XXXX" + bytes(100)])
+def test_decode_rejects_invalid_data(data):
+    with pytest.raises(ValueError):
+        decode_embedding(data)
+
+
+def test_decode_rejects_truncated_values():
+    data = encode_embedding(make_embedding())
+
+    with pytest.raises(ValueError):
+        decode_embedding(data[:-2])
+
+
+def test_legacy_pickle_is_read_as_float32():
+    embedding = make_embedding()
+
+    loaded = load_legacy_pickle(pickle.dumps(embedding.tolist()))
+
+    np.testing.assert_array_equal(loaded, embedding)
+
+
+class Payload:
+    def __reduce__(self):
+        return (os.system, ("true",))
+
+
+def test_legacy_pickle_refuses_objects():
+    with pytest.raises(pickle.UnpicklingError):
+        load_legacy_pickle(pickle.dumps(Payload()))
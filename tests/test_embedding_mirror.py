@@ -0,0 +1,98 @@
+import os
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+
+import services.similarity as similarity
+from core.embedding_mirror import EmbeddingMirror, read_metadata, write_mirror
+from services.embedding_mirror import sync_mirror
+
+
+def make_entities(count, dim=16, seed=0):
+    embeddings = np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+    return [
+        {"id": 100 + i, "path": f"MegaSet/Artist {i % 7}/track{i}.mp3", "title": f"Track {i}", "artist": f"Artist {i % 7}",
+         "album": "Album", "top_5_genres": ["rock", "pop"], "embedding": embedding.tolist()}
+        for i, embedding in enumerate(embeddings)
+    ]
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    entities = make_entities(200)
+    write_mirror(str(tmp_path), [entities[:64], entities[64:]], dim=16)
+    return EmbeddingMirror(str(tmp_path)), entities
+
+
+def test_search_matches_a_brute_force_cosine_ranking(mirror):
+    mirror, entities = mirror
+    matrix = np.array([entity["embedding"] for entity in entities])
+    queries = matrix[[3, 42]] * 2.5
+
+    hits = mirror.search(queries.tolist(), limit=10, offset=1, output_fields=["title", "path"])
+
+    normalized = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+    for query, query_hits in zip(queries, hits):
+        scores = normalized @ (query / np.linalg.norm(query))
+        expected = np.argsort(-scores)[1:11]
+        assert [hit.id for hit in query_hits] == [entities[row]["id"] for row in expected]
+        np.testing.assert_allclose([hit.distance for hit in query_hits], scores[expected], rtol=1e-5)
+        assert query_hits[0].entity.title == entities[expected[0]]["title"]
+        assert not hasattr(query_hits[0].entity, "embedding")
+
+
+def test_search_with_more_hits_than_entities(mirror):
+    mirror, entities = mirror
+    hits = mirror.search([entities[0]["embedding"]], limit=500)
+    assert len(hits[0]) == 200
+    assert hits[0][0].id == entities[0]["id"]
+
+
+def test_query_by_path_and_id(mirror):
+    mirror, entities = mirror
+    found = mirror.query(paths=[entities[5]["path"], "MegaSet/missing.mp3"], output_fields=["embedding"])
+    assert [entity["id"] for entity in found] == [105]
+    np.testing.assert_allclose(found[0]["embedding"], entities[5]["embedding"])
+    assert mirror.query(ids=[107], output_fields=["*"])[0]["path"] == entities[7]["path"]
+
+
+def test_new_sync_replaces_the_mirror(tmp_path, mirror):
+    mirror, _ = mirror
+    mirror.reload_interval_seconds = 0
+    previous = read_metadata(str(tmp_path))["matrix_file"]
+    assert mirror.status()["count"] == 200
+
+    collection = MagicMock()
+    iterator = collection.query_iterator.return_value
+    iterator.next.side_effect = [make_entities(30, seed=1), []]
+    assert sync_mirror(collection, str(tmp_path), dim=16) == 30
+
+    assert len(mirror.search([[1.0] * 16], limit=50)[0]) == 30
+    assert mirror.status()["count"] == 30
+    assert not os.path.exists(tmp_path / previous)
+    iterator.close.assert_called_once()
+
+
+def test_missing_mirror_is_reported(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        EmbeddingMirror(str(tmp_path)).search([[0.0] * 16], limit=1)
+
+
+def test_backends(mirror):
+    mirror, entities = mirror
+    collection = MagicMock()
+    collection.query.side_effect = ConnectionError("unavailable")
+
+    with patch.object(similarity, "embedding_mirror", mirror), \
+            patch.object(similarity, "get_milvus_512_collection", return_value=collection):
+        with patch.object(similarity.DEFAULT_SETTINGS, "similarity_backend", "fallback"):
+            assert similarity.get_entities_by_id("101")[0]["id"] == 101
+        with patch.object(similarity.DEFAULT_SETTINGS, "similarity_backend", "milvus"):
+            with pytest.raises(ConnectionError):
+                similarity.get_entities_by_paths([entities[0]["path"]])
+        with patch.object(similarity.DEFAULT_SETTINGS, "similarity_backend", "local"):
+            hits = similarity.search_similar([entities[0]["embedding"]], limit=3, offset=1)
+            assert len(hits[0]) == 3
+    assert collection.query.call_count == 2
+    collection.search.assert_not_called()
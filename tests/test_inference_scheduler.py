@@ -0,0 +1,71 @@
+import threading
+
+import numpy as np
+import pytest
+
+from core.inference_scheduler import MicroBatchScheduler
+
+
+class RecordingModel:
+    def __init__(self):
+        self.batch_sizes = []
+
+    def predict(self, batch):
+        self.batch_sizes.append(len(batch))
+        return batch * 2
+
+
+def test_concurrent_requests_are_pooled_and_scattered():
+    scheduler = MicroBatchScheduler("test", max_batch_size=12, max_wait_ms=200)
+    model = RecordingModel()
+    batches = [np.full((4, 3), i, dtype=np.float32) for i in range(3)]
+    results = [None] * 3
+
+    def extract(i):
+        results[i] = scheduler.submit(model.predict, batches[i]).result(timeout=5)
+
+    threads = [threading.Thread(target=extract, args=(i,)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # One full batch, each request getting back its own outputs
+    assert model.batch_sizes == [12]
+    for batch, result in zip(batches, results):
+        np.testing.assert_array_equal(result, batch * 2)
+
+
+def test_partial_batch_runs_after_max_wait():
+    scheduler = MicroBatchScheduler("test", max_batch_size=60, max_wait_ms=10)
+    model = RecordingModel()
+
+    result = scheduler.submit(model.predict, np.ones((5, 2))).result(timeout=5)
+
+    assert model.batch_sizes == [5]
+    np.testing.assert_array_equal(result, np.full((5, 2), 2))
+
+
+def test_requests_for_different_models_are_not_mixed():
+    scheduler = MicroBatchScheduler("test", max_batch_size=60, max_wait_ms=50)
+    first_model, second_model = RecordingModel(), RecordingModel()
+
+    first = scheduler.submit(first_model.predict, np.ones((3, 2)))
+    second = scheduler.submit(second_model.predict, np.ones((4, 2)))
+    first.result(timeout=5)
+    second.result(timeout=5)
+
+    assert first_model.batch_sizes == [3]
+    assert second_model.batch_sizes == [4]
+
+
+def test_errors_are_propagated_to_each_request():
+    scheduler = MicroBatchScheduler("test", max_batch_size=4, max_wait_ms=10)
+
+    def failing_predict(batch):
+        raise RuntimeError("inference failed")
+
+    with pytest.raises(RuntimeError, match="inference failed"):
+        scheduler.submit(failing_predict, np.ones((2, 2))).result(timeout=5)
+    with pytest.raises(ValueError):
+        scheduler.submit(failing_predict, np.ones((5, 2)))
@@ -0,0 +1,88 @@
+import threading
+import time
+
+import pytest
+
+from core.jobs import LocalJobQueue, JobQueueFullError
+
+
+def wait_for(job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not job.finished:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Job {job.id} did not finish")
+        time.sleep(0.01)
+
+
+def test_job_runs_with_progress_and_stage_timings():
+    queue = LocalJobQueue("test", max_workers=1)
+
+    def work(job, value):
+        with job.run_stage("compute"):
+            job.set_progress(1, 2)
+        return value * 2
+
+    job, created = queue.submit("song.mp3", work, 21)
+    wait_for(job)
+
+    assert created
+    assert job.state == "done"
+    assert job.result == 42
+    assert job.progress == 1.0
+    assert "compute" in job.timings
+    assert queue.get(job.id) is job
+    assert queue.stats()["mean_stage_seconds"].keys() == {"compute"}
+
+
+def test_duplicate_submissions_collapse_into_one_job():
+    queue = LocalJobQueue("test", max_workers=1)
+    release = threading.Event()
+    calls = []
+
+    def work(job):
+        calls.append(job.id)
+        release.wait(5)
+
+    first, first_created = queue.submit("song.mp3", work)
+    second, second_created = queue.submit("song.mp3", work)
+    release.set()
+    wait_for(first)
+
+    assert first is second
+    assert first_created and not second_created
+    assert len(calls) == 1
+
+
+def test_failed_job_reports_error_and_can_be_resubmitted():
+    queue = LocalJobQueue("test", max_workers=1)
+
+    def failing(job):
+        raise RuntimeError("decoding failed")
+
+    job, _ = queue.submit("song.mp3", failing)
+    wait_for(job)
+    retried, created = queue.submit("song.mp3", lambda job: "ok")
+    wait_for(retried)
+
+    assert job.state == "failed"
+    assert job.error == "decoding failed"
+    assert created and retried.result == "ok"
+
+
+def test_full_queue_rejects_submissions():
+    queue = LocalJobQueue("test", max_workers=1, max_queued=1)
+    release = threading.Event()
+    started = threading.Event()
+
+    def work(job):
+        started.set()
+        release.wait(5)
+
+    running, _ = queue.submit("a.mp3", work)
+    started.wait(5)
+    queued, _ = queue.submit("b.mp3", work)
+
+    with pytest.raises(JobQueueFullError):
+        queue.submit("c.mp3", work)
+    release.set()
+    wait_for(queued)
@@ -0,0 +1,119 @@
+import json
+from unittest.mock import MagicMock, patch
+
+
+import services.similarity as similarity
+from models.milvus import MilvusEntityId
+from models.music import MusicLibrary
+from services.milvus_ids import PathIdIndex, query_by_paths, save_path_ids, sync_path_ids
+from tests.conftest import lookups
+
+
+def fake_collection(entities, batch_size=2):
+    collection = MagicMock()
+    collection.name = "embeddings"
+    batches = [entities[i:i + batch_size] for i in range(0, len(entities), batch_size)] + [[]]
+    collection.query_iterator.return_value.next.side_effect = batches
+    return collection
+
+
+def test_sync_indexes_the_collection_and_links_the_library(session_factory):
+    with session_factory() as db:
+        db.add(MusicLibrary(filepath="MegaSet/a.mp3"))
+        db.add(MilvusEntityId(collection="embeddings", path="MegaSet/removed.mp3", milvus_id=1))
+        db.commit()
+
+        entities = [{"id": 10, "path": "MegaSet/a.mp3"}, {"id": 11, "path": "MegaSet/b.mp3"}, {"id": 12, "path": "MegaSet/c.mp3"}]
+        assert sync_path_ids(db, fake_collection(entities)) == 3
+
+        rows = {row.path: (row.milvus_id, row.music_id) for row in db.query(MilvusEntityId)}
+        music_id = db.query(MusicLibrary.id).scalar()
+    assert rows == {"MegaSet/a.mp3": (10, music_id), "MegaSet/b.mp3": (11, None), "MegaSet/c.mp3": (12, None)}
+
+
+def milvus_collection(entities):
+    """
+    Fake collection answering the id and path queries built by query_by_paths.
+    """
+    def query(expr, output_fields, **kwargs):
+        field, values = expr.split(" in ")
+        return [dict(entity) for entity in entities if entity[field] in json.loads(values)]
+
+    collection = MagicMock()
+    collection.name = "embeddings"
+    collection.query.side_effect = query
+    return collection
+
+
+def test_indexed_paths_are_fetched_by_id_and_misses_are_counted(session_factory):
+    entities = [{"id": 10, "path": "MegaSet/a.mp3"}, {"id": 11, "path": "MegaSet/b.mp3"}, {"id": 12, "path": "MegaSet/it's.mp3"}]
+    with session_factory() as db:
+        sync_path_ids(db, fake_collection(entities[:2]))
+    index = PathIdIndex(session_factory)
+    collection = milvus_collection(entities)
+    before = {result: lookups("milvus_path_id", result, collection="embeddings") for result in ("hit", "stale", "miss")}
+
+    assert query_by_paths(collection, ["MegaSet/a.mp3", "MegaSet/b.mp3"], ["embedding"], index) == entities[:2]
+    assert collection.query.call_args.kwargs == {"expr": "id in [10, 11]", "output_fields": ["embedding", "path"]}
+    assert query_by_paths(collection, ["MegaSet/a.mp3", "MegaSet/it's.mp3"], ["embedding"], index) == [entities[0], entities[2]]
+    assert collection.query.call_args.kwargs["expr"] == "path in [\"MegaSet/it's.mp3\"]"
+    assert {result: lookups("milvus_path_id", result, collection="embeddings") - before[result] for result in before} == {"hit": 3, "stale": 0, "miss": 1}
+    # Paths found by filter are then fetched by id
+    assert index.status()["collections"] == {"embeddings": 3}
+
+
+def test_stale_ids_are_looked_up_by_path(session_factory):
+    with session_factory() as db:
+        sync_path_ids(db, fake_collection([{"id": 10, "path": "MegaSet/a.mp3"}]))
+    index = PathIdIndex(session_factory)
+    # The entity was re-inserted under a new id since the sync
+    collection = milvus_collection([{"id": 20, "path": "MegaSet/a.mp3"}])
+    before = {result: lookups("milvus_path_id", result, collection="embeddings") for result in ("hit", "stale", "miss")}
+
+    assert query_by_paths(collection, ["MegaSet/a.mp3"], ["path"], index) == [{"id": 20, "path": "MegaSet/a.mp3"}]
+    assert query_by_paths(collection, ["MegaSet/a.mp3"], ["path"], index) == [{"id": 20, "path": "MegaSet/a.mp3"}]
+    assert {result: lookups("milvus_path_id", result, collection="embeddings") - before[result] for result in before} == {"hit": 1, "stale": 1, "miss": 0}
+
+
+def test_saved_ids_replace_the_stored_ones(session_factory):
+    with session_factory() as db:
+        db.add(MusicLibrary(filepath="MegaSet/b.mp3"))
+        sync_path_ids(db, fake_collection([{"id": 10, "path": "MegaSet/a.mp3"}]))
+        index = PathIdIndex(session_factory, reload_interval_seconds=3600)
+        save_path_ids(db, "embeddings", {"MegaSet/a.mp3": 20, "MegaSet/b.mp3": 21}, index)
+
+        rows = {row.path: (row.milvus_id, row.music_id) for row in db.query(MilvusEntityId)}
+        music_id = db.query(MusicLibrary.id).scalar()
+    assert rows == {"MegaSet/a.mp3": (20, None), "MegaSet/b.mp3": (21, music_id)}
+    assert index.get_ids("embeddings", ["MegaSet/a.mp3", "MegaSet/b.mp3"]) == ({"MegaSet/a.mp3": 20, "MegaSet/b.mp3": 21}, [])
+
+
+def test_index_is_reloaded_after_the_interval(session_factory):
+    index = PathIdIndex(session_factory, reload_interval_seconds=0)
+    assert index.get_ids("embeddings", ["MegaSet/a.mp3"]) == ({}, ["MegaSet/a.mp3"])
+
+    with session_factory() as db:
+        sync_path_ids(db, fake_collection([{"id": 10, "path": "MegaSet/a.mp3"}]))
+    assert index.get_ids("embeddings", ["MegaSet/a.mp3"]) == ({"MegaSet/a.mp3": 10}, [])
+
+
+def test_unreadable_index_falls_back_to_path_filters():
+    index = PathIdIndex(MagicMock(side_effect=RuntimeError("database down")))
+    collection = milvus_collection([{"id": 10, "path": 'MegaSet/"quoted".mp3'}])
+
+    assert query_by_paths(collection, ['MegaSet/"quoted".mp3'], ["path"], index) == [{"id": 10, "path": 'MegaSet/"quoted".mp3'}]
+    assert collection.query.call_args.kwargs["expr"] == 'path in ["MegaSet/\\"quoted\\".mp3"]'
+
+
+def test_entities_are_queried_by_id(session_factory):
+    with session_factory() as db:
+        sync_path_ids(db, fake_collection([{"id": 10, "path": "MegaSet/a.mp3"}]))
+    collection = milvus_collection([{"id": 10, "path": "MegaSet/a.mp3", "embedding": [0.5]}])
+
+    with patch("services.milvus_ids.path_id_index", PathIdIndex(session_factory)), \
+            patch.object(similarity.DEFAULT_SETTINGS, "similarity_backend", "milvus"), \
+            patch.object(similarity, "get_milvus_512_collection", return_value=collection):
+        entities = similarity.get_entities_by_paths(["MegaSet/a.mp3"])
+
+    assert entities == [{"id": 10, "path": "MegaSet/a.mp3", "embedding": [0.5]}]
+    assert collection.query.call_args.kwargs["expr"] == "id in [10]"
@@ -0,0 +1,107 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from prometheus_client import REGISTRY
+
+import core.milvus_pool as milvus_pool
+from core.milvus_pool import MilvusPool
+
+
+def operation_count(operation, result):
+    return REGISTRY.get_sample_value("milvus_operation_seconds_count", {"collection": "embeddings", "operation": operation, "result": result}) or 0
+
+
+@pytest.fixture
+def pymilvus():
+    def collection(name, using):
+        handle = MagicMock()
+        handle.name = name
+        return handle
+
+    with patch.object(milvus_pool, "connections") as connections, \
+            patch.object(milvus_pool, "utility") as utility, \
+            patch.object(milvus_pool, "Collection", MagicMock(side_effect=collection)) as collection_class:
+        yield connections, utility, collection_class
+
+
+def test_connection_and_handles_are_reused(pymilvus):
+    connections, _, collection_class = pymilvus
+    pool = MilvusPool("https://milvus", "token", health_check_interval_seconds=3600)
+
+    first = pool.get_collection("embeddings")
+    second = pool.get_collection("embeddings")
+    pool.get_collection("predictions")
+
+    assert first is second
+    assert connections.connect.call_count == 1
+    assert collection_class.call_count == 2
+    status = pool.status()
+    assert status["connected"] and status["collections"] == ["embeddings", "predictions"] and status["reconnects"] == 0
+
+
+def test_operations_are_timed(pymilvus):
+    pool = MilvusPool("https://milvus", "token")
+    before = operation_count("query", "ok")
+
+    collection = pool.get_collection("embeddings")
+    collection.query(expr="id in [0]")
+
+    assert operation_count("query", "ok") == before + 1
+    collection._collection.query.assert_called_once_with(expr="id in [0]")
+    # Other attributes are passed through untimed
+    assert collection.name == "embeddings"
+
+
+def test_stale_connection_is_checked_and_reopened(pymilvus):
+    connections, utility, _ = pymilvus
+    pool = MilvusPool("https://milvus", "token", health_check_interval_seconds=0)
+    pool.get_collection("embeddings")
+
+    pool.get_collection("embeddings")
+    assert utility.get_server_version.call_count == 1
+    assert connections.connect.call_count == 1
+
+    utility.get_server_version.side_effect = ConnectionError("unavailable")
+    pool.get_collection("embeddings")
+    assert connections.connect.call_count == 2
+    assert pool.status()["reconnects"] == 1
+    assert pool.status()["last_error"] == "unavailable"
+
+
+def test_failed_operation_is_retried_after_a_reconnection(pymilvus):
+    connections, utility, _ = pymilvus
+    pool = MilvusPool("https://milvus", "token", health_check_interval_seconds=3600)
+    collection = pool.get_collection("embeddings")
+    collection._collection.search.side_effect = ConnectionError("connection reset")
+    utility.get_server_version.side_effect = ConnectionError("unavailable")
+    before = operation_count("search", "retried")
+
+    collection.search(data=[[0.0]])
+
+    assert connections.connect.call_count == 2
+    assert operation_count("search", "retried") == before + 1
+    # The handle now wraps a collection bound to the new connection
+    collection._collection.search.assert_called_once_with(data=[[0.0]])
+
+
+def test_failed_operation_on_a_healthy_connection_is_not_retried(pymilvus):
+    connections, _, _ = pymilvus
+    pool = MilvusPool("https://milvus", "token", health_check_interval_seconds=3600)
+    collection = pool.get_collection("embeddings")
+    collection._collection.query.side_effect = ValueError("invalid expression")
+
+    with pytest.raises(ValueError):
+        collection.query(expr="id in [")
+    assert connections.connect.call_count == 1
+
+
+def test_non_idempotent_operation_is_not_retried(pymilvus):
+    connections, utility, _ = pymilvus
+    pool = MilvusPool("https://milvus", "token", health_check_interval_seconds=3600)
+    collection = pool.get_collection("embeddings")
+    collection._collection.insert.side_effect = ConnectionError("connection reset")
+    utility.get_server_version.side_effect = ConnectionError("unavailable")
+
+    with pytest.raises(ConnectionError):
+        collection.insert([[0.0]])
+    assert connections.connect.call_count == 2
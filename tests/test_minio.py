@@ -1,7 +1,16 @@
+import io
+import threading
+from contextlib import contextmanager
+
+import librosa
+import numpy as np
 import pytest
+import soundfile as sf
 from unittest.mock import MagicMock, PropertyMock, patch
 
-from services.minio import convert_artwork_to_base64, get_artwork, get_metadata_and_artwork, sanitize_filename
+from core.audio_decoding import decode_window
+from core.embedding_format import encode_embedding, sampled_model_version
+from services.minio import ObjectRangeReader, convert_artwork_to_base64, decode_object_window, get_artwork, get_embedding, get_metadata_and_artwork, sanitize_filename, warm_pcm_cache
 
 
 def test_convert_artwork_to_base64():
@@ -79,3 +88,118 @@ def test_sanitize_filename(filename, expected):
     """Test the sanitize_filename function with various inputs."""
     result = sanitize_filename(filename)
     assert result == expected, f"Expected {expected}, but got {result}"
+
+
+def write_track(path, seconds, sample_rate=44100, format=None):
+    n_samples = int(seconds * sample_rate)
+    chirp = 0.3 * np.sin(np.cumsum(np.linspace(0.01, 0.5, n_samples)))
+    sf.write(path, np.stack([chirp, 0.5 * chirp], axis=1).astype(np.float32), sample_rate, format=format)
+
+
+class FakeObjectStore:
+    """In-memory stand-in of the MinIO client range requests."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def stat_object(self, bucket_name, object_name):
+        return MagicMock(size=len(self.data))
+
+    def get_object(self, bucket_name, object_name, offset=0, length=0):
+        response = MagicMock()
+        response.read.return_value = self.data[offset:offset + length] if length else self.data[offset:]
+        return response
+
+
+@pytest.mark.parametrize("suffix,format", [(".wav", "WAV"), (".mp3", "MP3")])
+@pytest.mark.parametrize("offset,duration", [(20, 20), (0, 5), (55, 20), (3.3, None)])
+def test_decode_window_matches_a_window_of_the_full_decode(tmp_path, suffix, format, offset, duration):
+    audio_file = str(tmp_path / f"track{suffix}")
+    write_track(audio_file, 60, format=format)
+
+    full, native_rate = sf.read(audio_file, dtype=np.float32, always_2d=True)
+    start = int(offset * native_rate)
+    window = full[start:start + int(duration * native_rate) if duration is not None else None]
+    expected = librosa.resample(librosa.to_mono(window.T), orig_sr=native_rate, target_sr=22050, res_type="soxr_hq")
+    np.testing.assert_allclose(decode_window(audio_file, 22050, offset=offset, duration=duration), expected, atol=1e-6)
+
+
+def test_range_reader_decodes_the_window_from_part_of_the_object(tmp_path):
+    audio_file = str(tmp_path / "track.mp3")
+    write_track(audio_file, 240, format="MP3")
+    with open(audio_file, "rb") as f:
+        data = f.read()
+
+    with patch("services.minio.minio_client", FakeObjectStore(data)):
+        reader = ObjectRangeReader("bucket", "track.mp3", chunk_size=64 * 1024)
+        y = decode_window(reader, 22050, offset=20, duration=20)
+
+    np.testing.assert_array_equal(y, decode_window(audio_file, 22050, offset=20, duration=20))
+    assert reader.bytes_fetched < len(data) / 2
+
+
+def test_range_reader_reads_and_seeks_like_a_file():
+    data = bytes(range(256)) * 40
+    with patch("services.minio.minio_client", FakeObjectStore(data)):
+        reader = ObjectRangeReader("bucket", "object", chunk_size=100, max_chunks=2)
+        assert reader.read(250) == data[:250]
+        reader.seek(-10, io.SEEK_END)
+        assert reader.read() == data[-10:]
+        assert reader.read(5) == b""
+        reader.seek(95)
+        assert reader.read(10) == data[95:105]
+        assert reader.tell() == 105
+
+
+def test_decode_object_window_falls_back_to_a_full_download(tmp_path):
+    audio_file = str(tmp_path / "track.wav")
+    write_track(audio_file, 10)
+    downloaded = str(tmp_path / "downloaded")
+    with open(audio_file, "rb") as f, open(downloaded, "wb") as copy:
+        copy.write(f.read())
+
+    with patch("services.minio.minio_client", FakeObjectStore(b"not an audio file")), \
+            patch("services.minio.get_temp_file_from_minio", return_value=downloaded), \
+            patch("services.minio.librosa.load", return_value=(np.ones(3, dtype=np.float32), 22050)) as load:
+        y = decode_object_window("upload.m4a", 22050, offset=2, duration=5)
+
+    load.assert_called_once_with(downloaded, sr=22050, offset=2, duration=5)
+    np.testing.assert_array_equal(y, np.ones(3))
+
+
+def test_sampled_embeddings_are_ignored_where_exact_ones_are_expected():
+    version = sampled_model_version("etag", 8, 3, "even")
+    data = encode_embedding(np.ones(512), model_version=version)
+    assert version == "etag+sampled-8x3s-even"
+
+    with patch("services.minio.read_object", return_value=data):
+        assert get_embedding("upload.mp3") == [1.0] * 512
+        assert get_embedding("upload.mp3", exact=True) is False
+    with patch("services.minio.read_object", return_value=encode_embedding(np.ones(512), model_version="etag")):
+        assert get_embedding("upload.mp3", exact=True) == [1.0] * 512
+
+
+def test_cache_warming_is_dropped_while_a_file_is_being_decoded():
+    decoding = threading.Event()
+    release = threading.Event()
+    opened = []
+
+    @contextmanager
+    def slow_open_native_audio(file_name):
+        opened.append(file_name)
+        decoding.set()
+        release.wait(5)
+        yield None
+
+    with patch("services.minio.pcm_cache", MagicMock()), patch("services.minio.open_native_audio", slow_open_native_audio):
+        thread = warm_pcm_cache("MegaSet/a.mp3")
+        assert thread.daemon
+        assert decoding.wait(5)
+        assert warm_pcm_cache("MegaSet/a.mp3") is None
+        assert warm_pcm_cache("MegaSet/b.mp3") is None
+        release.set()
+        thread.join(5)
+        # Once the decode is done, the next miss is warmed again
+        warm_pcm_cache("MegaSet/b.mp3").join(5)
+
+    assert opened == ["MegaSet/a.mp3", "MegaSet/b.mp3"]
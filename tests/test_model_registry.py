@@ -0,0 +1,115 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from prometheus_client import REGISTRY
+
+from core.model_registry import ModelRegistry
+
+
+def make_registry(versions, check_interval_seconds=60):
+    # Each version check returns the next ETag, and the loaded model is tagged with the last one seen
+    seen = []
+
+    def fetch_version():
+        seen.append(versions[len(seen)])
+        return seen[-1]
+
+    load_model = MagicMock(side_effect=lambda: (object(), seen[-1]))
+    registry = ModelRegistry("test", fetch_version=fetch_version, load_model=load_model, check_interval_seconds=check_interval_seconds)
+    return registry, load_model
+
+
+@patch("core.model_registry.time.monotonic")
+def test_model_loaded_once_within_interval(mock_monotonic):
+    mock_monotonic.return_value = 0
+    registry, load_model = make_registry(["etag1"])
+
+    first_model, version = registry.get()
+    mock_monotonic.return_value = 30
+    second_model, _ = registry.get()
+
+    assert version == "etag1"
+    assert first_model is second_model
+    load_model.assert_called_once()
+
+
+@patch("core.model_registry.time.monotonic")
+def test_model_reloaded_when_version_changes(mock_monotonic):
+    mock_monotonic.return_value = 0
+    registry, load_model = make_registry(["etag1", "etag1", "etag2"])
+
+    first_model, _ = registry.get()
+    # Same ETag after the interval: the model is kept
+    mock_monotonic.return_value = 60
+    assert registry.get()[0] is first_model
+    # New ETag after the interval: the model is swapped
+    mock_monotonic.return_value = 120
+    new_model, version = registry.get()
+
+    assert new_model is not first_model
+    assert version == "etag2"
+    assert registry.version == "etag2"
+    assert load_model.call_count == 2
+
+
+@patch("core.model_registry.time.monotonic")
+def test_active_model_kept_when_check_fails(mock_monotonic):
+    mock_monotonic.return_value = 0
+    load_model = MagicMock(return_value=("model", "etag1"))
+    fetch_version = MagicMock(side_effect=["etag1", ConnectionError("MinIO is down")])
+    registry = ModelRegistry("test", fetch_version=fetch_version, load_model=load_model, check_interval_seconds=60)
+
+    registry.get()
+    mock_monotonic.return_value = 60
+
+    assert registry.get() == ("model", "etag1")
+    assert registry.status()["version"] == "etag1"
+
+
+def test_first_load_failure_is_raised():
+    registry = ModelRegistry("test", fetch_version=MagicMock(side_effect=ConnectionError("MinIO is down")), load_model=MagicMock())
+
+    with pytest.raises(ConnectionError):
+        registry.get()
+    assert registry.version is None
+
+
+@patch("core.model_registry.time.monotonic")
+def test_cold_and_warm_calls_are_measured_separately(mock_monotonic):
+    mock_monotonic.return_value = 0
+    registry, _ = make_registry(["etag1", "etag1", "etag2"])
+    registry.name = "test-latency"
+
+    def count(result):
+        return REGISTRY.get_sample_value("model_registry_get_seconds_count", {"model": "test-latency", "result": result}) or 0
+
+    registry.get()
+    registry.get()
+    mock_monotonic.return_value = 60
+    registry.get()
+    mock_monotonic.return_value = 120
+    registry.get()
+
+    # Loads of etag1 and etag2, and two hits on etag1 (one of them after an unchanged version check)
+    assert (count("cold"), count("warm")) == (2, 2)
+    assert REGISTRY.get_sample_value("model_registry_version", {"model": "test-latency", "version": "etag2"}) == 1
+    assert REGISTRY.get_sample_value("model_registry_version", {"model": "test-latency", "version": "etag1"}) is None
+    assert registry.status()["last_load_seconds"] is not None
+
+
+@patch("core.model_registry.time.monotonic")
+def test_version_is_peeked_without_loading_the_model(mock_monotonic):
+    mock_monotonic.return_value = 0
+    registry, load_model = make_registry(["etag1", "etag2", "etag2"])
+
+    assert registry.peek_version() == "etag1"
+    mock_monotonic.return_value = 30
+    assert registry.peek_version() == "etag1"
+    load_model.assert_not_called()
+
+    mock_monotonic.return_value = 60
+    assert registry.peek_version() == "etag2"
+    _, version = registry.get()
+    assert version == "etag2"
+    assert registry.peek_version() == "etag2"
+    load_model.assert_called_once()
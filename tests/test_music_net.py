@@ -0,0 +1,219 @@
+import shutil
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+import soundfile as sf
+import torch
+from PIL import Image
+
+import services.music_net as music_net
+from core.audio_decoding import decode_window
+from core.pcm_cache import PcmCache
+from services.music_net import create_preprocessed_spectrogram, create_spectrogram_tensor, compute_mel_db, render_spectrogram
+
+
+def write_audio(path, seconds, seed=0):
+    rng = np.random.default_rng(seed)
+    n_samples = int(22050 * seconds)
+    chirp = 0.3 * np.sin(np.cumsum(np.linspace(0.01, 0.5, n_samples)))
+    sf.write(path, (chirp + 0.05 * rng.standard_normal(n_samples)).astype(np.float32), 22050)
+
+
+@pytest.mark.parametrize("seconds,start_time,segment_duration,exact", [(45, 20, 20, True), (12, 1, 5, False), (3, 0, 20, False)])
+def test_in_memory_tensor_matches_png_rendering(tmp_path, monkeypatch, seconds, start_time, segment_duration, exact):
+    audio_file = str(tmp_path / "track.wav")
+    write_audio(audio_file, seconds)
+
+    # Keep the PNG rendered by the former path, before its resize
+    rendered = {}
+    resize = Image.Image.resize
+
+    def record_resize(image, *args, **kwargs):
+        rendered.setdefault("png", image.copy())
+        return resize(image, *args, **kwargs)
+
+    monkeypatch.setattr(Image.Image, "resize", record_resize)
+    expected = create_preprocessed_spectrogram(audio_file, start_time=start_time, segment_duration=segment_duration)
+    monkeypatch.undo()
+    result = create_spectrogram_tensor(audio_file, start_time=start_time, segment_duration=segment_duration)
+
+    S_DB = compute_mel_db(audio_file, start_time=start_time, segment_duration=segment_duration)
+    image = render_spectrogram(S_DB, size=rendered["png"].size)
+    identical = (np.asarray(image) == np.asarray(rendered["png"])).all(axis=2)
+    assert result.shape == expected.shape == (1, 3, 224, 224)
+    if exact:
+        # Full-length segments have more frames than pixel columns: pixel for pixel the same image
+        assert identical.all()
+        assert torch.equal(result, expected)
+    else:
+        # Agg breaks exact ties between cell edges and pixel centers either way, a column at a time
+        assert identical.mean() > 0.99
+        assert (result - expected).abs().mean() < 1e-3
+
+
+def test_segment_is_decoded_from_byte_ranges_on_a_cache_miss(monkeypatch):
+    @contextmanager
+    def cache_miss(file_path, decode_on_miss=True):
+        assert not decode_on_miss
+        yield None
+
+    rng = np.random.default_rng(0)
+    decode_window = MagicMock(return_value=(0.1 * rng.standard_normal(22050 * 20)).astype(np.float32))
+    warm = MagicMock()
+    monkeypatch.setattr(music_net, "open_native_audio", cache_miss)
+    monkeypatch.setattr(music_net, "decode_object_window", decode_window)
+    monkeypatch.setattr(music_net, "warm_pcm_cache", warm)
+
+    tensor = music_net.create_spectrogram_tensor_from_minio("MegaSet/a.mp3")
+
+    assert tensor.shape == (1, 3, 224, 224)
+    decode_window.assert_called_once_with("MegaSet/a.mp3", 22050, offset=20, duration=20)
+    warm.assert_called_once_with("MegaSet/a.mp3")
+
+
+def test_cache_hit_and_miss_give_nearly_the_same_tensor(tmp_path, monkeypatch, track):
+    cache = PcmCache(str(tmp_path / "cache"), max_bytes=1 << 30)
+
+    @contextmanager
+    def open_native_audio(file_path, decode_on_miss=True):
+        with cache.open_native(file_path, lambda path: shutil.copyfile(track, path), suffix=".mp3",
+                               decode_on_miss=decode_on_miss) as wav_path:
+            yield wav_path
+
+    object_window = MagicMock(side_effect=lambda file_path, sr, offset, duration: decode_window(track, sr, offset=offset, duration=duration))
+    monkeypatch.setattr(music_net, "open_native_audio", open_native_audio)
+    monkeypatch.setattr(music_net, "decode_object_window", object_window)
+    monkeypatch.setattr(music_net, "warm_pcm_cache", MagicMock())
+
+    miss = music_net.create_spectrogram_tensor_from_minio("MegaSet/track.mp3", start_time=5, segment_duration=10)
+    with open_native_audio("MegaSet/track.mp3"):
+        pass
+    hit = music_net.create_spectrogram_tensor_from_minio("MegaSet/track.mp3", start_time=5, segment_duration=10)
+
+    assert object_window.call_count == 1
+    # The MP3 decoders of FFmpeg (cached native decode) and libsndfile (segment decode) round differently, by about
+    # 3e-5: a few pixels end up a color level or three apart (a level is 2 / 255 after the normalization)
+    difference = (hit - miss).abs()
+    assert difference.mean() < 5e-4
+    assert difference.max() <= 4 * 2 / 255
+
+
+def test_model_version_changes_with_the_artifact(monkeypatch):
+    objects = [SimpleNamespace(object_name="data/model/MLmodel", etag="a"),
+               SimpleNamespace(object_name="data/model/data/model.pth", etag="b")]
+    client = MagicMock()
+    client.list_objects.side_effect = lambda *args, **kwargs: list(objects)
+    monkeypatch.setattr(music_net, "minio_client", client)
+
+    version = music_net.get_music_net_model_version()
+    objects.reverse()
+    assert music_net.get_music_net_model_version() == version
+
+    objects[0] = SimpleNamespace(object_name="data/model/data/model.pth", etag="c")
+    assert music_net.get_music_net_model_version() != version
+
+
+def test_model_version_names_the_backend(monkeypatch):
+    client = MagicMock()
+    client.list_objects.side_effect = lambda *args, **kwargs: [SimpleNamespace(object_name="data/model/MLmodel", etag="a")]
+    monkeypatch.setattr(music_net, "minio_client", client)
+
+    versions = {backend: music_net.get_music_net_model_version(backend) for backend in music_net.MUSIC_NET_BACKENDS}
+    assert len(set(versions.values())) == len(music_net.MUSIC_NET_BACKENDS)
+    assert versions["torchscript-int8"].endswith("+torchscript-int8")
+    assert music_net.get_music_net_model_version() == versions[music_net.DEFAULT_SETTINGS.music_net_backend]
+
+
+def test_model_is_loaded_once_in_eval_mode(monkeypatch):
+    model = MagicMock()
+    load = MagicMock(return_value=model)
+    monkeypatch.setattr(music_net, "get_production_model", load)
+    monkeypatch.setattr(music_net, "get_music_net_model_version", lambda backend=None: "v1")
+    registry = music_net.ModelRegistry("music_net_test", fetch_version=lambda: "v1", load_model=music_net.load_music_net_model,
+                                       check_interval_seconds=300)
+
+    assert registry.get() == (model, "v1")
+    assert registry.get() == (model, "v1")
+    load.assert_called_once()
+    model.eval.assert_called_once()
+
+
+class FlattenLinear(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.linear = torch.nn.Linear(3 * 8 * 8, len(music_net.MAPPING_DICT_MUSIC_NET))
+
+    def forward(self, x):
+        return self.linear(x.flatten(1))
+
+
+def test_batched_prediction_matches_single_predictions_and_isolates_errors(monkeypatch):
+    tensors = {f"track{i}.mp3": torch.randn(1, 3, 8, 8) for i in range(3)}
+
+    def fake_preprocess(file_path, warm_cache=True):
+        assert not warm_cache
+        if file_path not in tensors:
+            raise ValueError("Failed to create the preprocessed spectrogram.")
+        return tensors[file_path]
+
+    monkeypatch.setattr(music_net, "create_spectrogram_tensor_from_minio", fake_preprocess)
+    model = FlattenLinear().eval()
+
+    results = music_net.predict_genres(model, ["track0.mp3", "broken.mp3", "track1.mp3", "track2.mp3"], k=3, max_workers=2)
+
+    assert [result["file_path"] for result in results] == ["track0.mp3", "broken.mp3", "track1.mp3", "track2.mp3"]
+    assert results[1]["genres"] is None and "spectrogram" in results[1]["error"]
+    for result in results[:1] + results[2:]:
+        assert result["error"] is None
+        assert len(result["genres"]) == 3
+        probabilities = [probability for _, probability in result["genres"]]
+        assert probabilities == sorted(probabilities, reverse=True)
+        assert result["genres"][0][0] == music_net.predict_with_production_music_net(model, tensors[result["file_path"]])
+
+
+def test_batched_prediction_with_every_file_failing(monkeypatch):
+    monkeypatch.setattr(music_net, "create_spectrogram_tensor_from_minio", MagicMock(side_effect=OSError("missing")))
+    model = MagicMock()
+
+    results = music_net.predict_genres(model, ["a.mp3", "b.mp3"])
+
+    assert [result["error"] for result in results] == ["missing", "missing"]
+    model.assert_not_called()
+
+
+class SmallMusicNet(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.features = torch.nn.Sequential(
+            torch.nn.Conv2d(3, 8, 3, stride=4), torch.nn.BatchNorm2d(8), torch.nn.ReLU(), torch.nn.AdaptiveAvgPool2d(4),
+        )
+        self.classifier = torch.nn.Linear(8 * 4 * 4, len(music_net.MAPPING_DICT_MUSIC_NET))
+
+    def forward(self, x):
+        return self.classifier(self.features(x).flatten(1))
+
+
+@pytest.mark.parametrize("backend", music_net.MUSIC_NET_BACKENDS)
+def test_exported_backends_match_the_eager_model(backend):
+    model = SmallMusicNet().eval()
+    tensors = [torch.randn(music_net.MUSIC_NET_INPUT_SHAPE) for _ in range(6)]
+    labels = [music_net.predict_with_production_music_net(model, tensor) for tensor in tensors]
+
+    exported = music_net.export_music_net_model(model, backend)
+    report = music_net.check_backend_parity(model, exported, tensors, labels)
+
+    assert report["samples"] == 6
+    assert report["reference_accuracy"] == 1
+    assert report["top1_agreement"] == 1
+    assert report["max_probability_difference"] < (1e-2 if backend == "torchscript-int8" else 1e-5)
+    assert [genre for genre, _ in music_net.predict_top_k_with_production_music_net(exported, tensors, k=1)[0]] == labels[:1]
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError, match="onnx"):
+        music_net.export_music_net_model(SmallMusicNet().eval(), "onnx")
@@ -0,0 +1,111 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import routes.music_net as routes
+import services.music_net_catalog as catalog
+from models.music import MusicLibrary
+from models.music_net import MusicNetGenres
+
+
+@pytest.fixture
+def db_session(db_session):
+    for music_id, path in enumerate(["MegaSet/a.mp3", "MegaSet/b.mp3", "MegaSet/broken.mp3"], start=1):
+        db_session.add(MusicLibrary(id=music_id, filepath=path))
+    db_session.commit()
+    return db_session
+
+
+def fake_predict_genres(model, file_paths, k=3, max_workers=4, warm_cache=False):
+    return [
+        {"file_path": file_path, "genres": None, "error": "missing"} if "broken" in file_path else
+        {"file_path": file_path, "genres": [("rock", 0.6), ("metal", 0.3), ("pop", 0.1)][:k], "error": None}
+        for file_path in file_paths
+    ]
+
+
+def test_job_stores_the_genres_and_resumes(db_session, monkeypatch):
+    monkeypatch.setattr(catalog, "predict_genres", MagicMock(side_effect=fake_predict_genres))
+    tracks = catalog.list_pending_tracks(db_session, "v1")
+    assert tracks == [(1, "MegaSet/a.mp3"), (2, "MegaSet/b.mp3"), (3, "MegaSet/broken.mp3")]
+
+    summary = catalog.run(db_session, MagicMock(), "v1", tracks, batch_size=2, k=3)
+
+    assert (summary["predicted"], summary["failed"]) == (2, 1)
+    assert catalog.predict_genres.call_count == 2
+    assert all(not call.kwargs["warm_cache"] for call in catalog.predict_genres.call_args_list)
+    # Only the failed track is left for the next run, and every track for a new model version
+    assert catalog.list_pending_tracks(db_session, "v1") == [(3, "MegaSet/broken.mp3")]
+    assert len(catalog.list_pending_tracks(db_session, "v2")) == 3
+
+
+def test_lookup_serves_the_active_version_only(db_session):
+    catalog.save_precomputed_genres(db_session, [(1, "MegaSet/a.mp3", [("rock", 0.6), ("metal", 0.3)])], "v1")
+    catalog.save_precomputed_genres(db_session, [(1, "MegaSet/a.mp3", [("jazz", 0.9), ("blues", 0.1)])], "v1")
+
+    assert catalog.get_precomputed_genres(db_session, ["MegaSet/a.mp3", "uploads/a.mp3"], "v1") == {"MegaSet/a.mp3": [("jazz", 0.9)]}
+    assert catalog.get_precomputed_genres(db_session, ["MegaSet/a.mp3"], "v2") == {}
+    # More genres than precomputed are a miss
+    assert catalog.get_precomputed_genres(db_session, ["MegaSet/a.mp3"], "v1", k=3) == {}
+    assert db_session.query(MusicNetGenres).count() == 1
+
+    catalog.save_precomputed_genres(db_session, [(1, "MegaSet/a.mp3", [("jazz", 0.9)])], "v2")
+    assert catalog.prune_precomputed_genres(db_session, "v2") == 1
+
+
+def test_batch_endpoint_only_runs_inference_for_the_other_files(db_session):
+    catalog.save_precomputed_genres(db_session, [(1, "MegaSet/a.mp3", [("jazz", 0.9), ("blues", 0.1)])], "v1")
+    query = routes.GenreBatchRequest(file_paths=["uploads/c.mp3", "MegaSet/a.mp3", "MegaSet/b.mp3"], top_k=2)
+
+    with patch.object(routes.music_net_model_registry, "peek_version", return_value="v1"), \
+            patch.object(routes.music_net_model_registry, "get", return_value=(MagicMock(), "v1")), \
+            patch.object(routes, "predict_genres", MagicMock(side_effect=fake_predict_genres)) as predict:
+        response = routes.predict_genres_batch(query, user=None, db=db_session)
+
+    assert predict.call_args.args[1] == ["uploads/c.mp3", "MegaSet/b.mp3"]
+    assert [prediction["file_path"] for prediction in response["predictions"]] == query.file_paths
+    assert [prediction["precomputed"] for prediction in response["predictions"]] == [False, True, False]
+    assert response["predictions"][1]["genres"] == [{"genre": "jazz", "probability": 0.9}, {"genre": "blues", "probability": 0.1}]
+
+
+def test_single_endpoint_serves_precomputed_genres(db_session):
+    catalog.save_precomputed_genres(db_session, [(1, "MegaSet/a.mp3", [("jazz", 0.9)])], "v1")
+    query = routes.PathForEmbedding(file_path="MegaSet/a.mp3")
+
+    with patch.object(routes.music_net_model_registry, "peek_version", return_value="v1"), \
+            patch.object(routes.music_net_model_registry, "get") as get, \
+            patch.object(routes, "create_spectrogram_tensor_from_minio") as preprocess:
+        response = routes.predict_genre(query, user=None, db=db_session)
+
+    assert response == {"genre": "jazz", "model_version": "v1", "precomputed": True}
+    get.assert_not_called()
+    preprocess.assert_not_called()
+
+
+def test_batch_endpoint_of_precomputed_files_does_not_load_the_model(db_session):
+    catalog.save_precomputed_genres(db_session, [(1, "MegaSet/a.mp3", [("jazz", 0.9)]), (2, "MegaSet/b.mp3", [("rock", 0.8)])], "v1")
+    query = routes.GenreBatchRequest(file_paths=["MegaSet/a.mp3", "MegaSet/b.mp3"], top_k=1)
+
+    with patch.object(routes.music_net_model_registry, "peek_version", return_value="v1"), \
+            patch.object(routes.music_net_model_registry, "get") as get, \
+            patch.object(routes, "predict_genres") as predict:
+        response = routes.predict_genres_batch(query, user=None, db=db_session)
+
+    assert [prediction["precomputed"] for prediction in response["predictions"]] == [True, True]
+    get.assert_not_called()
+    predict.assert_not_called()
+
+
+def test_batch_endpoint_follows_a_model_loaded_after_the_lookup(db_session):
+    catalog.save_precomputed_genres(db_session, [(1, "MegaSet/a.mp3", [("jazz", 0.9)])], "v1")
+    catalog.save_precomputed_genres(db_session, [(2, "MegaSet/b.mp3", [("rock", 0.8)])], "v2")
+    query = routes.GenreBatchRequest(file_paths=["MegaSet/a.mp3", "MegaSet/b.mp3"], top_k=1)
+
+    with patch.object(routes.music_net_model_registry, "peek_version", return_value="v1"), \
+            patch.object(routes.music_net_model_registry, "get", return_value=(MagicMock(), "v2")), \
+            patch.object(routes, "predict_genres", MagicMock(side_effect=fake_predict_genres)) as predict:
+        response = routes.predict_genres_batch(query, user=None, db=db_session)
+
+    assert predict.call_args.args[1] == ["MegaSet/a.mp3"]
+    assert response["model_version"] == "v2"
+    assert response["predictions"][1]["genres"] == [{"genre": "rock", "probability": 0.8}]
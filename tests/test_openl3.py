@@ -0,0 +1,212 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+import pytest
+import numpy as np
+import essentia.standard as es
+
+from core.audio_decoding import DecoderProcessPool, stream_audio_blocks
+from core.extract_openl3_embeddings import EmbeddingsOpenL3, MelSpectrogramOpenL3, _frame_starts, melspectrogram_to_patches
+
+
+def make_audio(seconds, seed=0):
+    rng = np.random.default_rng(seed)
+    n_samples = int(48000 * seconds)
+    tone = 0.3 * np.sin(np.arange(n_samples) * 0.05)
+    return (tone + 0.1 * rng.standard_normal(n_samples)).astype(np.float32)
+
+
+@pytest.mark.parametrize("n_samples,frame_size,hop_size,ratio", [
+    (75, 93, 8, 0),
+    (455, 117, 76, 0.5),
+    (939, 109, 1, 0.5),
+    (1000, 48000, 48000, 0),
+    (72001, 48000, 24000, 0),
+    (48000, 2048, 242, 0.5),
+])
+def test_frame_starts_matches_frame_generator(n_samples, frame_size, hop_size, ratio):
+    audio = np.arange(1, n_samples + 1, dtype=np.float32)
+    frames = list(es.FrameGenerator(audio, frameSize=frame_size, hopSize=hop_size, validFrameThresholdRatio=ratio))
+    starts = _frame_starts(n_samples, frame_size, hop_size, ratio)
+
+    assert len(starts) == len(frames)
+    for frame, start in zip(frames, starts):
+        # The first valid sample of each frame is the sample at its start index
+        assert frame[max(0, -start)] == audio[max(0, start)]
+
+
+@pytest.mark.parametrize("hop_time", [1, 0.5])
+def test_batched_melspectrogram_matches_framewise(hop_time):
+    audio = make_audio(3.3)
+    extractor = MelSpectrogramOpenL3(hop_time=hop_time, block_size=2)
+
+    framewise = extractor._compute_framewise(audio)
+    batched = extractor._compute_batched(audio)
+
+    assert batched.shape == framewise.shape
+    assert batched.dtype == np.float32
+    # Documented tolerance of the batched engine, in dB
+    np.testing.assert_allclose(batched, framewise, atol=1e-3)
+
+
+@pytest.mark.parametrize("n_frames,hop_size", [(100, 199), (398, 199), (500, 199), (500, 50)])
+def test_melspectrogram_to_patches(n_frames, hop_size):
+    melspectrogram = np.random.default_rng(0).standard_normal((n_frames, 128)).astype(np.float32)
+
+    patches = melspectrogram_to_patches(melspectrogram, 199, hop_size)
+
+    # Same patches as the former copy loop, the last one zero-padded
+    assert patches.shape[0] == int(np.ceil((n_frames - 199) / hop_size)) + 1
+    for i, patch in enumerate(patches):
+        data = melspectrogram[i * hop_size:i * hop_size + 199]
+        np.testing.assert_array_equal(patch[:len(data)], data)
+        assert not patch[len(data):].any()
+
+    # Full patches are views into the mel spectrogram
+    if n_frames % hop_size == 0 and hop_size == 199:
+        assert np.shares_memory(patches, melspectrogram)
+
+
+@pytest.mark.parametrize("hop_time,block_samples,window_patches", [(1, 10000, 2), (1, 96000, 3), (0.5, 33333, 4)])
+def test_streamed_melspectrogram_matches_whole_signal(hop_time, block_samples, window_patches):
+    audio = make_audio(5.3)
+    extractor = MelSpectrogramOpenL3(hop_time=hop_time)
+    blocks = (audio[start:start + block_samples] for start in range(0, len(audio), block_samples))
+
+    windows = list(extractor.iter_compute(blocks, window_patches))
+
+    assert all(len(window) <= window_patches * 199 for window in windows)
+    np.testing.assert_array_equal(np.vstack(windows), extractor.compute_from_audio(audio))
+
+
+def fake_model(pool):
+    # Stand-in for TensorflowPredict: a deterministic 512-d projection of each patch
+    batch = pool["melspectrogram"]
+    return {"embeddings": batch.reshape(len(batch), -1)[:, 5::40][:, :512]}
+
+
+@pytest.mark.parametrize("pipeline_depth", [0, 2])
+@pytest.mark.parametrize("hop_time,batch_size,window_seconds", [(1, 2, 1), (1, 3, 4), (0.5, 60, 60)])
+def test_streaming_mean_embedding_is_identical(tmp_path, hop_time, batch_size, window_seconds, pipeline_depth):
+    audio_file = str(tmp_path / "track.wav")
+    es.MonoWriter(filename=audio_file, sampleRate=44100)(make_audio(7.7 * 44100 / 48000))
+    with patch("core.extract_openl3_embeddings.es.TensorflowPredict", return_value=MagicMock(side_effect=fake_model)):
+        model = EmbeddingsOpenL3("graph.pb", hop_time=hop_time, batch_size=batch_size, pipeline_depth=pipeline_depth)
+
+    expected = model.compute(audio_file).mean(axis=0)
+    result = model.compute_mean(audio_file, window_seconds=window_seconds)
+
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_streaming_mean_embedding_is_identical_with_a_decoder_process(tmp_path):
+    audio_file = str(tmp_path / "track.wav")
+    es.MonoWriter(filename=audio_file, sampleRate=44100)(make_audio(7.7 * 44100 / 48000))
+    decoder = DecoderProcessPool()
+    with patch("core.extract_openl3_embeddings.es.TensorflowPredict", return_value=MagicMock(side_effect=fake_model)):
+        model = EmbeddingsOpenL3("graph.pb", hop_time=1, batch_size=3, decoder=decoder)
+    progress = MagicMock()
+
+    try:
+        result = model.compute_mean(audio_file, window_seconds=4, progress=progress)
+    finally:
+        decoder.shutdown()
+
+    embeddings = model.compute(audio_file)
+    np.testing.assert_array_equal(result, embeddings.mean(axis=0))
+    assert progress.call_args.args == (len(embeddings), len(embeddings))
+
+
+def test_blocks_are_yielded_while_the_file_is_decoded():
+    audio = make_audio(1)
+    written = threading.Event()
+
+    def decode(audio_file, pcm_file, sample_rate):
+        # Writes the first 2.5 blocks, then the rest once the first block was read
+        decoding = Future()
+
+        def write():
+            with open(pcm_file, "wb") as f:
+                audio[:25000].tofile(f)
+                f.flush()
+                written.wait(5)
+                audio[25000:].tofile(f)
+            decoding.set_result(None)
+        threading.Thread(target=write).start()
+        return decoding
+
+    decoder = MagicMock()
+    decoder.submit.side_effect = decode
+    on_decoded = MagicMock()
+    blocks = stream_audio_blocks("track.mp3", 48000, 10000, on_decoded=on_decoded, decoder=decoder)
+
+    first = next(blocks)
+    assert not on_decoded.called
+    written.set()
+    blocks = [first, *blocks]
+
+    assert [len(block) for block in blocks] == [10000] * 4 + [8000]
+    np.testing.assert_array_equal(np.concatenate(blocks), audio)
+    on_decoded.assert_called_once_with(48000)
+
+
+@pytest.mark.parametrize("selection", ["even", "energy"])
+def test_sampled_mean_uses_patches_of_the_full_extraction(tmp_path, selection):
+    audio_file = str(tmp_path / "track.wav")
+    audio = make_audio(20)
+    # Louder sections, for the energy selection to pick
+    audio[3 * 48000:6 * 48000] *= 2
+    audio[12 * 48000:15 * 48000] *= 3
+    es.MonoWriter(filename=audio_file, sampleRate=48000)(audio)
+    with patch("core.extract_openl3_embeddings.es.TensorflowPredict", return_value=MagicMock(side_effect=fake_model)):
+        model = EmbeddingsOpenL3("graph.pb", hop_time=1, batch_size=4)
+
+    full = model.compute(audio_file)
+    result = model.compute_sampled_mean(audio_file, n_excerpts=2, excerpt_seconds=3, selection=selection)
+
+    expected_patches = {"even": [4, 5, 6, 14, 15, 16], "energy": [3, 4, 5, 12, 13, 14]}[selection]
+    assert len(full) == 21
+    np.testing.assert_allclose(result, full[expected_patches].mean(axis=0), rtol=1e-5, atol=1e-5)
+
+
+def test_sampled_mean_covering_the_track_uses_all_patches(tmp_path):
+    audio_file = str(tmp_path / "track.wav")
+    es.MonoWriter(filename=audio_file, sampleRate=48000)(make_audio(6.5))
+    with patch("core.extract_openl3_embeddings.es.TensorflowPredict", return_value=MagicMock(side_effect=fake_model)):
+        model = EmbeddingsOpenL3("graph.pb", hop_time=1, batch_size=4)
+
+    result = model.compute_sampled_mean(audio_file, n_excerpts=4, excerpt_seconds=2)
+
+    np.testing.assert_allclose(result, model.compute(audio_file).mean(axis=0), rtol=1e-5, atol=1e-5)
+
+
+def test_concurrent_full_batches_share_a_model_call():
+    from core.inference_scheduler import MicroBatchScheduler
+
+    # Room for four full model batches of 60 patches
+    scheduler = MicroBatchScheduler("test", max_batch_size=240, max_wait_ms=1000)
+    tensorflow_model = MagicMock(side_effect=fake_model)
+    with patch("core.extract_openl3_embeddings.es.TensorflowPredict", return_value=tensorflow_model):
+        model = EmbeddingsOpenL3("graph.pb", scheduler=scheduler)
+
+    rng = np.random.default_rng(0)
+    # Two extractions of two full model batches each
+    batches = [rng.standard_normal((2 * model.batch_size, 128, 199, 1)).astype(np.float32) for _ in range(2)]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(model._predict, batches))
+
+    assert tensorflow_model.call_count == 1
+    assert len(tensorflow_model.call_args.args[0]["melspectrogram"]) == 4 * model.batch_size
+    for batch, result in zip(batches, results):
+        expected = [model._run_model(batch[start:start + model.batch_size]) for start in (0, model.batch_size)]
+        np.testing.assert_array_equal(result, np.vstack(expected))
+
+
+def test_scheduler_smaller_than_a_model_batch_is_rejected():
+    from core.inference_scheduler import MicroBatchScheduler
+
+    with patch("core.extract_openl3_embeddings.es.TensorflowPredict", return_value=MagicMock(side_effect=fake_model)):
+        with pytest.raises(ValueError, match="60-patch"):
+            EmbeddingsOpenL3("graph.pb", scheduler=MicroBatchScheduler("test", max_batch_size=59))
+        EmbeddingsOpenL3("graph.pb", scheduler=MicroBatchScheduler("test", max_batch_size=60))
@@ -0,0 +1,133 @@
+import os
+import shutil
+
+import essentia.standard as es
+import numpy as np
+import pytest
+
+from core.audio_decoding import PcmFile, decoded_pcm, stream_audio_blocks
+from core.pcm_cache import PcmCache
+from tests.conftest import lookups
+
+
+def copier(audio_file, calls):
+    def fetch(path):
+        calls.append(path)
+        shutil.copyfile(audio_file, path)
+    return fetch
+
+
+def test_cached_samples_match_a_direct_decode(tmp_path, track):
+    cache = PcmCache(str(tmp_path / "cache"), max_bytes=1 << 30)
+    calls = []
+    before = {result: lookups("pcm_cache", result) for result in ("miss", "resample", "hit")}
+
+    for sample_rate in (48000, 22050, 48000):
+        with cache.open("bucket/track.mp3:etag", sample_rate, copier(track, calls), suffix=".mp3") as pcm:
+            assert pcm.sample_rate == sample_rate
+            expected = es.MonoLoader(filename=track, sampleRate=sample_rate)()
+            np.testing.assert_array_equal(np.fromfile(pcm.path, dtype=np.float32), expected)
+
+    assert len(calls) == 1
+    assert {result: lookups("pcm_cache", result) - before[result] for result in before} == {"miss": 1, "resample": 1, "hit": 1}
+
+
+def test_another_key_decodes_again(tmp_path, track):
+    cache = PcmCache(str(tmp_path / "cache"), max_bytes=1 << 30)
+    calls = []
+    with cache.open("bucket/track.mp3:etag1", 48000, copier(track, calls), suffix=".mp3"):
+        pass
+    with cache.open("bucket/track.mp3:etag2", 48000, copier(track, calls), suffix=".mp3"):
+        pass
+    assert len(calls) == 2
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, track):
+    directory = str(tmp_path / "cache")
+    entry_size = 44100 * 20 * 4
+    # Room for about two native decodes and their 44.1 kHz copies
+    cache = PcmCache(directory, max_bytes=int(4.5 * entry_size))
+    calls = []
+
+    for key in ("a", "b", "a", "c"):
+        with cache.open(key, 44100, copier(track, calls), suffix=".mp3"):
+            pass
+
+    assert len(calls) == 3
+    assert cache.size <= cache.max_bytes
+    assert sorted(os.listdir(directory)) == sorted(cache._entries)
+    with cache.open("a", 44100, copier(track, calls), suffix=".mp3"):
+        pass
+    # "a" was used more recently than "b", which was evicted first
+    assert len(calls) == 3
+
+
+def test_entries_in_use_are_not_evicted(tmp_path, track):
+    cache = PcmCache(str(tmp_path / "cache"), max_bytes=1)
+    calls = []
+    with cache.open("a", 44100, copier(track, calls), suffix=".mp3") as pcm:
+        with cache.open("b", 44100, copier(track, calls), suffix=".mp3"):
+            assert os.path.exists(pcm.path)
+        assert os.path.exists(pcm.path)
+    assert cache.size == 0
+
+
+def test_entries_in_use_survive_an_eviction_by_another_process(tmp_path, track):
+    directory = str(tmp_path / "cache")
+    cache = PcmCache(directory, max_bytes=1 << 30)
+    calls = []
+    with cache.open("a", 48000, copier(track, calls), suffix=".mp3") as pcm:
+        expected = np.fromfile(pcm.path, dtype=np.float32)
+        # Another process sharing the directory evicts every entry
+        for name in os.listdir(directory):
+            if not name.startswith("tmp"):
+                os.unlink(os.path.join(directory, name))
+        np.testing.assert_array_equal(np.fromfile(pcm.path, dtype=np.float32), expected)
+    assert os.listdir(directory) == []
+
+    with cache.open("a", 48000, copier(track, calls), suffix=".mp3"):
+        pass
+    assert len(calls) == 2
+
+
+def test_cache_files_are_reused_by_a_new_process(tmp_path, track):
+    directory = str(tmp_path / "cache")
+    calls = []
+    with PcmCache(directory, max_bytes=1 << 30).open("a", 48000, copier(track, calls), suffix=".mp3"):
+        pass
+    cache = PcmCache(directory, max_bytes=1 << 30)
+    assert cache.size > 0
+    with cache.open("a", 48000, copier(track, calls), suffix=".mp3"):
+        pass
+    assert len(calls) == 1
+
+
+def test_decoding_functions_read_pcm_files_in_place(tmp_path):
+    path = str(tmp_path / "audio.pcm")
+    samples = np.arange(10, dtype=np.float32)
+    samples.tofile(path)
+    pcm = PcmFile(path, 48000)
+
+    blocks = list(stream_audio_blocks(pcm, 48000, 4))
+    np.testing.assert_array_equal(np.concatenate(blocks), samples)
+    with decoded_pcm(pcm, 48000) as audio:
+        np.testing.assert_array_equal(audio, samples)
+    assert os.path.exists(path)
+    with pytest.raises(ValueError, match="22050"):
+        list(stream_audio_blocks(pcm, 22050, 4))
+
+
+def test_lookup_without_decode_on_miss(tmp_path, track):
+    cache = PcmCache(str(tmp_path / "cache"), max_bytes=1 << 30)
+    calls = []
+
+    with cache.open("a", 22050, copier(track, calls), suffix=".mp3", decode_on_miss=False) as pcm:
+        assert pcm is None
+    assert calls == []
+
+    with cache.open("a", 48000, copier(track, calls), suffix=".mp3"):
+        pass
+    # Once the native decode is cached, other rates are resampled from it
+    with cache.open("a", 22050, copier(track, calls), suffix=".mp3", decode_on_miss=False) as pcm:
+        assert pcm.sample_rate == 22050
+    assert len(calls) == 1
@@ -0,0 +1,52 @@
+import threading
+import time
+
+import pytest
+
+from core.pipeline import iter_prefetched
+
+
+def test_items_are_produced_in_order():
+    assert list(iter_prefetched(range(100), max_pending=3)) == list(range(100))
+
+
+def test_producer_stays_bounded_ahead_of_consumer():
+    produced = []
+
+    def producer():
+        for i in range(20):
+            produced.append(i)
+            yield i
+
+    for item in iter_prefetched(producer(), max_pending=2):
+        time.sleep(0.02)
+        # The current item, the queued ones, and the one waiting for room in the queue
+        assert len(produced) <= item + 1 + 2 + 1
+
+
+def test_producer_errors_are_raised_in_consumer():
+    def producer():
+        yield 1
+        raise RuntimeError("decoding failed")
+
+    items = iter_prefetched(producer())
+    assert next(items) == 1
+    with pytest.raises(RuntimeError, match="decoding failed"):
+        next(items)
+
+
+def test_closing_consumer_stops_and_cleans_up_producer():
+    closed = threading.Event()
+
+    def producer():
+        try:
+            for i in range(1000):
+                yield i
+        finally:
+            closed.set()
+
+    items = iter_prefetched(producer(), max_pending=2)
+    assert next(items) == 0
+    items.close()
+
+    assert closed.is_set()
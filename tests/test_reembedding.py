@@ -0,0 +1,78 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import essentia.standard as es
+
+from services.milvus_ids import PathIdIndex
+from services.reembedding import MISSING_ENTITY_ERROR, run, load_checkpoint, list_local_tracks
+from tests.test_openl3 import make_audio, fake_model
+
+
+def write_tracks(directory, count):
+    paths = []
+    for i in range(count):
+        path = str(directory / f"track{i}.wav")
+        es.MonoWriter(filename=path, sampleRate=48000)(make_audio(2 + i, seed=i))
+        paths.append(path)
+    return paths
+
+
+@patch("core.extract_openl3_embeddings.es.TensorflowPredict", return_value=MagicMock(side_effect=fake_model))
+def test_run_resumes_and_writes_batches(mock_predict, tmp_path):
+    paths = write_tracks(tmp_path, 3)
+    tracks = list(enumerate(paths, start=1))
+    output_dir = tmp_path / "output"
+
+    first = run(tracks[:2], str(output_dir), "graph.pb", processes=0, batch_size=1, local=True)
+    second = run(tracks + [(4, str(tmp_path / "missing.wav"))], str(output_dir), "graph.pb", processes=0,
+                 batch_size=10, local=True)
+
+    assert (first["embedded"], first["skipped"]) == (2, 0)
+    assert (second["embedded"], second["failed"], second["skipped"]) == (1, 1, 2)
+    # The failed track is logged, and not checkpointed so that the next run retries it
+    assert load_checkpoint(str(output_dir)) == {1, 2, 3}
+    errors = [json.loads(line) for line in open(output_dir / "errors.jsonl")]
+    assert [error["id"] for error in errors] == [4]
+
+    parts = sorted(output_dir.glob("part-*.npz"))
+    assert len(parts) == 3
+    stored = {}
+    for part in parts:
+        data = np.load(part)
+        stored.update(zip(data["ids"].tolist(), data["embeddings"]))
+    assert sorted(stored) == [1, 2, 3]
+    assert all(embedding.shape == (512,) for embedding in stored.values())
+
+
+def test_list_local_tracks(tmp_path):
+    (tmp_path / "b").mkdir()
+    for name in ["b/2.mp3", "1.mp3", "cover.jpg"]:
+        (tmp_path / name).touch()
+
+    assert list_local_tracks(str(tmp_path)) == [(1, str(tmp_path / "1.mp3")), (2, str(tmp_path / "b/2.mp3"))]
+
+
+@patch("core.extract_openl3_embeddings.es.TensorflowPredict", return_value=MagicMock(side_effect=fake_model))
+def test_tracks_missing_from_milvus_are_reported(mock_predict, tmp_path, session_factory):
+    paths = write_tracks(tmp_path, 2)
+    output_dir = tmp_path / "output"
+    collection = MagicMock()
+    collection.name = "embeddings"
+    collection.query.return_value = [{"id": 1, "path": paths[0], "embedding": []}]
+    # The collection generates new ids on upsert
+    collection.upsert.return_value.primary_keys = [7]
+    index = PathIdIndex(session_factory, reload_interval_seconds=3600)
+
+    with patch("core.config.SessionLocal", session_factory), \
+            patch("services.milvus_ids.path_id_index", index):
+        summary = run(list(enumerate(paths, start=1)), str(output_dir), "graph.pb", processes=0, local=True,
+                      store=False, collection=collection)
+
+    assert (summary["embedded"], summary["missing"]) == (1, 1)
+    assert [row["path"] for row in collection.upsert.call_args.args[0]] == [paths[0]]
+    assert index.get_ids("embeddings", [paths[0]]) == ({paths[0]: 7}, [])
+    # The missing track is logged, and not checkpointed so that the next run retries it
+    assert load_checkpoint(str(output_dir)) == {1}
+    errors = [json.loads(line) for line in open(output_dir / "errors.jsonl")]
+    assert [(error["id"], error["error"]) for error in errors] == [(2, MISSING_ENTITY_ERROR)]
@@ -0,0 +1,97 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from fastapi import HTTPException
+
+import routes.milvus as routes
+import services.similarity as similarity
+from core.result_cache import ResultCache
+from models.milvus import FilePathsQuery
+from services.milvus import bump_collection_version, get_collection_version
+from tests.conftest import lookups
+
+
+def test_hits_skip_the_computation():
+    cache = ResultCache("test", max_entries=10, fetch_version=lambda: 1)
+    compute = MagicMock(return_value=["hit"])
+    before = {result: lookups("result_cache", result, cache="test") for result in ("hit", "miss")}
+
+    assert cache.get(("a",), compute) == ["hit"]
+    assert cache.get(("a",), compute) == ["hit"]
+
+    compute.assert_called_once()
+    assert {result: lookups("result_cache", result, cache="test") - before[result] for result in before} == {"hit": 1, "miss": 1}
+
+
+def test_least_recently_used_results_are_evicted():
+    cache = ResultCache("test", max_entries=2, fetch_version=lambda: 1)
+    for key in ("a", "b", "a", "c"):
+        cache.get(key, lambda: key)
+
+    assert list(cache._entries) == ["a", "c"]
+
+
+def test_version_change_empties_the_cache():
+    version = MagicMock(return_value=1)
+    cache = ResultCache("test", max_entries=10, fetch_version=version, check_interval_seconds=0)
+    compute = MagicMock(return_value="result")
+
+    cache.get("a", compute)
+    cache.get("a", compute)
+    version.return_value = 2
+    cache.get("a", compute)
+
+    assert compute.call_count == 2
+    assert cache.status()["version"] == 2
+
+
+def test_version_is_checked_once_per_interval():
+    version = MagicMock(return_value=1)
+    cache = ResultCache("test", max_entries=10, fetch_version=version, check_interval_seconds=3600)
+    for key in "abc":
+        cache.get(key, lambda: key)
+    version.assert_called_once()
+
+
+def test_errors_are_not_cached():
+    cache = ResultCache("test", max_entries=10, fetch_version=lambda: 1)
+    with pytest.raises(HTTPException):
+        cache.get("a", MagicMock(side_effect=HTTPException(status_code=404)))
+    assert cache.get("a", lambda: "found") == "found"
+
+
+def test_collection_version_stamp(session_factory):
+    with session_factory() as db:
+        assert get_collection_version(db, "embeddings_512") == 0
+        assert bump_collection_version(db, "embeddings_512") == 1
+        assert bump_collection_version(db, "embeddings_512") == 2
+        assert get_collection_version(db, "embeddings_512") == 2
+
+
+def test_similar_entities_are_served_from_the_cache():
+    hit = MagicMock()
+    hit.entity.artist = "Artist"
+    cache = ResultCache("test", max_entries=10, fetch_version=lambda: 1)
+
+    with patch.object(routes, "similarity_cache", cache), \
+            patch.object(routes, "get_entities_by_paths", return_value=[{"embedding": [0.1, 0.2]}]) as query, \
+            patch.object(routes, "search_similar", return_value=[[hit]]) as search:
+        first = routes.get_similar_9_entities_by_path(FilePathsQuery(path=["MegaSet/a.mp3"]), user=None)
+        second = routes.get_similar_9_entities_by_path(FilePathsQuery(path=["MegaSet/a.mp3"]), user=None)
+        routes.get_similar_9_entities_by_path(FilePathsQuery(path=["MegaSet/b.mp3"]), user=None)
+
+    assert first == second
+    assert query.call_count == search.call_count == 2
+
+
+def test_fallback_results_are_not_cached():
+    cache = ResultCache("test", max_entries=10, fetch_version=lambda: 1)
+    on_milvus = MagicMock(side_effect=[ConnectionError("Milvus down"), "milvus"])
+
+    def search():
+        return similarity.run_on_backend("search", on_milvus, lambda: "mirror", backend="fallback")
+
+    assert cache.get("a", search) == "mirror"
+    assert cache.get("a", search) == "milvus"
+    assert cache.get("a", search) == "milvus"
+    assert on_milvus.call_count == 2
@@ -0,0 +1,83 @@
+from unittest.mock import patch
+
+import pytest
+from fastapi import HTTPException
+
+import routes.milvus as routes
+import services.similarity as similarity
+from core.embedding_mirror import EmbeddingMirror, write_mirror
+from core.result_cache import ResultCache
+from models.milvus import BatchSimilarityQuery
+from services.similarity import diversify, fuse_rankings, search_similar_batch
+from tests.test_embedding_mirror import make_entities
+
+
+@pytest.fixture
+def local_backend(tmp_path):
+    entities = make_entities(300)
+    write_mirror(str(tmp_path), [entities], dim=16)
+    mirror = EmbeddingMirror(str(tmp_path))
+    with patch.object(similarity, "embedding_mirror", mirror), \
+            patch.object(similarity.DEFAULT_SETTINGS, "similarity_backend", "local"):
+        yield mirror, entities
+
+
+def hit(path, artist):
+    return {"id": path, "distance": 0.0, "title": path, "album": "Album", "artist": artist, "path": path}
+
+
+def test_diversify_limits_the_hits_per_artist():
+    hits = [hit("a1", "A"), hit("a2", "A"), hit("q", "B"), hit("a3", "A"), hit("b1", "B"), hit("c1", "C")]
+
+    assert [h["path"] for h in diversify(hits, 3, max_per_artist=1, excluded_paths=["q"])] == ["a1", "b1", "c1"]
+    assert [h["path"] for h in diversify(hits, 3)] == ["a1", "a2", "q"]
+    # Too few artists: the list is completed with the best skipped hits
+    assert [h["path"] for h in diversify(hits[:4], 3, max_per_artist=1, excluded_paths=["q"])] == ["a1", "a2", "a3"]
+
+
+def test_fused_ranking_favours_hits_shared_by_the_inputs():
+    fused = fuse_rankings([[hit("x", "A"), hit("y", "B")], [hit("z", "C"), hit("y", "B")]])
+    assert [entry["path"] for entry in fused] == ["y", "x", "z"]
+    assert fused[0]["matches"] == 2
+
+
+def test_batch_returns_the_results_of_every_input_from_one_search(local_backend):
+    mirror, entities = local_backend
+    paths = [entities[0]["path"], "MegaSet/missing.mp3", entities[1]["path"]]
+
+    with patch.object(mirror, "search", wraps=mirror.search) as search:
+        response = search_similar_batch(paths, k=5, fuse=True)
+
+    assert search.call_count == 1
+    assert [result["path"] for result in response["results"]] == paths
+    assert response["results"][1] == {"path": "MegaSet/missing.mp3", "hits": None, "error": "Entity not found"}
+    for index, result in zip((0, 1), (response["results"][0], response["results"][2])):
+        single = mirror.search([entities[index]["embedding"]], limit=10)[0]
+        expected = [h.entity.path for h in single if h.entity.path not in (entities[0]["path"], entities[1]["path"])][:5]
+        assert [h["path"] for h in result["hits"]] == expected
+    assert len(response["fused"]) == 5
+    assert not {h["path"] for h in response["fused"]} & set(paths)
+
+
+def test_batch_applies_the_artist_rule(local_backend):
+    _, entities = local_backend
+    response = search_similar_batch([entities[0]["path"]], k=7, max_per_artist=1)
+    artists = [h["artist"] for h in response["results"][0]["hits"]]
+    assert len(artists) == 7 and len(set(artists)) == 7
+
+
+def test_batch_endpoint_validates_and_caches(local_backend):
+    _, entities = local_backend
+    query = BatchSimilarityQuery(paths=[entities[0]["path"]], k=3, fuse=True)
+
+    with patch.object(routes, "similarity_cache", ResultCache("test", max_entries=10, fetch_version=lambda: 1)), \
+            patch.object(routes, "search_similar_batch", wraps=search_similar_batch) as batch:
+        first = routes.get_similar_entities_batch(query, user=None)
+        assert routes.get_similar_entities_batch(query, user=None) == first
+    assert batch.call_count == 1
+    assert routes.BatchSimilarityResponse(**first).fused[0].matches == 1
+
+    with pytest.raises(HTTPException):
+        routes.get_similar_entities_batch(BatchSimilarityQuery(paths=[entities[0]["path"]], k=0), user=None)
+    with pytest.raises(HTTPException):
+        routes.get_similar_entities_batch(BatchSimilarityQuery(paths=[]), user=None)